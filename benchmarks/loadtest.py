@@ -0,0 +1,373 @@
+"""HTTP load test of server.py: latency percentiles, throughput, error and 503 rates, server RSS.
+
+    # infrastructure only: models replaced by stubs that burn CPU for a share of the audio length
+    python benchmarks/loadtest.py --stub --concurrency 8 --duration 60
+
+    # real models, open loop at 5 requests/s, English and French, 80 % repeated sentences
+    python benchmarks/loadtest.py --rate 5 --langs en,fr --repeated 0.8 --duration 120 --out load.json
+
+    # an already running server (no RSS unless --pid)
+    python benchmarks/loadtest.py --url http://localhost:8000 --concurrency 4
+
+The harness starts ``server:app`` with uvicorn on a free port (unless ``--url``), with a
+fresh temporary cache directory so the reference voices are synthesized during the run,
+and with the audio cache off (``OPENPRONOUNCE_AUDIO_CACHE_MB=0`` unless set): the bundled
+samples are uploaded again and again, and every upload must run the models. Start a
+server given with ``--url`` the same way.
+Requests go to ``/pronunciation``, ``/phonemes`` and ``/tts`` in the ``--mix`` proportions,
+in the languages of ``--langs``. A ``--repeated`` share of the sentences comes from a
+pool of ``--pool`` sentences per language (the reference voice and phonemes are then
+cached); the others are new. ``/pronunciation`` uploads the bundled samples.
+
+Closed loop by default: ``--concurrency`` clients send a request as soon as the
+previous one is answered. With ``--rate``, requests arrive as a Poisson process at that
+rate whatever the answers (open loop), at most ``--concurrency`` in flight; the others
+count as ``dropped``.
+
+``--stub`` replaces the models and the phonemizer in the server process: each model
+stage multiplies matrices for ``--stub-rtf`` seconds per second of audio (real CPU
+contention, torch threads included), the reference voice is a synthetic tone and the
+phonemes are the letters. Scheduling, caching, decoding and serialization are the real
+ones.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES = ["assets/developer.wav", "assets/developer1.wav", "assets/harvard.wav", "assets/reference.wav"]
+ENDPOINTS = ("pronunciation", "phonemes", "tts")
+WORDS = ("the", "cat", "sat", "on", "a", "warm", "red", "mat", "while", "my", "friend", "read", "an", "old", "book",
+         "about", "ships", "and", "stars", "near", "blue", "river", "every", "morning", "we", "walk", "to", "school")
+PERCENTILES = (50, 95, 99)
+
+
+# ---------------------------------------------------------------------------
+# Stubbed server (runs in the child process)
+# ---------------------------------------------------------------------------
+
+def install_stubs(rtf):
+    """Replace the models and the phonemizer with CPU-burning stand-ins (see the module docstring)."""
+    import torch
+
+    from openpronounce import phones, speech, tts
+
+    matrix = torch.rand(256, 256)
+
+    def burn(audio_waveform):
+        deadline = time.perf_counter() + rtf * len(audio_waveform) / 16000
+        while time.perf_counter() < deadline:
+            matrix @ matrix
+
+    def extract_embeddings(audio_waveform, sampling_rate=16000):
+        burn(audio_waveform)
+        rng = np.random.default_rng(len(audio_waveform))
+        return rng.standard_normal((max(1, len(audio_waveform) // 320), 32)).astype(np.float32)
+
+    def transcribe(audio_waveform, lang="en"):
+        burn(audio_waveform)
+        return "HELLO"
+
+    def recognize_phones(audio_waveform, sampling_rate=16000, normalize=True, lang="en"):
+        burn(audio_waveform)
+        return list("helo")
+
+    def phonemize(text, language=None, backend=None, strip=True, preserve_punctuation=False, separator=None):
+        word_separator = " | " if separator is not None and separator.word.strip() else " "
+        return word_separator.join(" ".join(word) for word in text.split())
+
+    def synthesize_tone(text, lang, voice):
+        seconds = 0.3 + 0.06 * len(text)
+        t = np.arange(int(16000 * seconds)) / 16000
+        return (0.1 * np.sin(2 * np.pi * 140 * t)).astype(np.float32), 16000
+
+    speech.extract_embeddings = extract_embeddings
+    speech.transcribe = transcribe
+    speech.phonemize = phonemize
+    phones.recognize_phones = recognize_phones
+    phones.phonemize = phonemize
+    tts.BACKENDS["stub"] = (synthesize_tone, lambda lang: "tone")
+    os.environ["OPENPRONOUNCE_TTS"] = "stub"
+
+
+def serve(args):
+    sys.path.insert(0, ROOT)
+    if args.stub:
+        install_stubs(args.stub_rtf)
+    import uvicorn
+
+    import server
+
+    uvicorn.run(server.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+# ---------------------------------------------------------------------------
+# Load generator
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, cache_dir):
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--stub-rtf", str(args.stub_rtf)] + (["--stub"] if args.stub else [])
+    env = dict(os.environ, OPENPRONOUNCE_CACHE_DIR=cache_dir)
+    # The same samples are uploaded over and over: with the audio cache the models would only run once per sample
+    env.setdefault("OPENPRONOUNCE_AUDIO_CACHE_MB", "0")
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_healthy(client, url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"the server exited with status {process.returncode}")
+        try:
+            if (await client.get(f"{url}/health")).status_code == 200:
+                return
+        except Exception:  # noqa: BLE001 - not listening yet
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"the server did not answer /health within {timeout} s")
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+class Traffic:
+    """Draws the next request: endpoint by ``mix``, language, repeated or new sentence, sample."""
+
+    def __init__(self, args):
+        self.random = random.Random(args.seed)
+        self.mix = args.mix
+        self.langs = args.langs
+        self.repeated = args.repeated
+        self.pools = {lang: [self.sentence() for _ in range(args.pool)] for lang in self.langs}
+        self.samples = []
+        for path in SAMPLES:
+            with open(os.path.join(ROOT, path), "rb") as f:
+                self.samples.append((os.path.basename(path), f.read()))
+        self.new = 0
+
+    def sentence(self):
+        return " ".join(self.random.choice(WORDS) for _ in range(self.random.randint(4, 10)))
+
+    def next(self):
+        endpoint = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        lang = self.random.choice(self.langs)
+        if self.random.random() < self.repeated:
+            text = self.random.choice(self.pools[lang])
+        else:
+            self.new += 1
+            text = f"{self.sentence()} {self.new}"
+        return endpoint, lang, text, self.random.choice(self.samples)
+
+
+async def send(client, url, endpoint, lang, text, sample):
+    data = {"lang": lang}
+    files = None
+    if endpoint == "pronunciation":
+        data["expected_text"] = text
+        files = {"file": (sample[0], sample[1], "audio/wav")}
+    else:
+        data["text"] = text
+    started = time.perf_counter()
+    try:
+        response = await client.post(f"{url}/{endpoint}", data=data, files=files)
+        await response.aread()
+        status = response.status_code
+    except Exception:  # noqa: BLE001 - counted as an error
+        status = 0
+    return endpoint, status, time.perf_counter() - started, started
+
+
+async def drive(client, url, args, traffic):
+    """Send the traffic for ``--duration`` seconds (or ``--requests``). Returns the results and the dropped count."""
+    results = []
+    deadline = time.perf_counter() + args.duration
+    budget = args.requests or float("inf")
+    sent = 0
+    dropped = 0
+
+    def more():
+        return time.perf_counter() < deadline and sent < budget
+
+    if args.rate:
+        in_flight = set()
+        rng = random.Random(args.seed + 1)
+        while more():
+            await asyncio.sleep(rng.expovariate(args.rate))
+            sent += 1
+            if len(in_flight) >= args.concurrency:
+                dropped += 1
+                continue
+            task = asyncio.create_task(send(client, url, *traffic.next()))
+            in_flight.add(task)
+            task.add_done_callback(lambda t: (in_flight.discard(t), results.append(t.result())))
+        if in_flight:
+            await asyncio.wait(in_flight)
+        return results, dropped
+
+    async def worker():
+        nonlocal sent
+        while more():
+            sent += 1
+            results.append(await send(client, url, *traffic.next()))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return results, dropped
+
+
+async def sample_rss(pid, interval, origin, samples):
+    while True:
+        samples.append({"t": round(time.perf_counter() - origin, 1), "rss_mb": rss_mb(pid)})
+        await asyncio.sleep(interval)
+
+
+def summarize(results, seconds):
+    """Counts, rates and latency percentiles (of the successful requests) for ``results``."""
+    ok = [latency for _, status, latency, _ in results if 200 <= status < 300]
+    overloaded = sum(status == 503 for _, status, _, _ in results)
+    errors = len(results) - len(ok) - overloaded
+    row = {
+        "requests": len(results),
+        "ok": len(ok),
+        "throughput_per_s": round(len(ok) / seconds, 3) if seconds else 0.0,
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "rate_503": round(overloaded / len(results), 4) if results else 0.0,
+    }
+    if ok:
+        row.update({f"p{q}_ms": round(1000 * float(np.percentile(ok, q)), 1) for q in PERCENTILES})
+    return row
+
+
+async def run(args):
+    import httpx
+
+    traffic = Traffic(args)
+    process = None
+    with tempfile.TemporaryDirectory() as cache_dir:
+        url = args.url
+        if url is None:
+            process, url = start_server(args, cache_dir)
+        pid = process.pid if process is not None else args.pid
+        try:
+            async with httpx.AsyncClient(timeout=args.timeout,
+                                         limits=httpx.Limits(max_connections=args.concurrency)) as client:
+                await wait_healthy(client, url, process, args.startup_timeout)
+                origin = time.perf_counter()
+                rss = []
+                sampler = asyncio.create_task(sample_rss(pid, args.rss_interval, origin, rss)) if pid else None
+                results, dropped = await drive(client, url, args, traffic)
+                seconds = time.perf_counter() - origin
+                if sampler is not None:
+                    sampler.cancel()
+                try:
+                    queue = (await client.get(f"{url}/queue")).json()
+                except Exception:  # noqa: BLE001 - older server
+                    queue = None
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(30)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("serve", "port")},
+        "seconds": round(seconds, 1),
+        "dropped": dropped,
+        "total": summarize(results, seconds),
+        "endpoints": {endpoint: summarize([r for r in results if r[0] == endpoint], seconds)
+                      for endpoint in args.mix if any(r[0] == endpoint for r in results)},
+        "rss": rss,
+        "queue": queue,
+    }
+    return report
+
+
+def print_report(report):
+    print(f"{'endpoint':15} {'requests':>8} {'ok/s':>7} {'err':>6} {'503':>6} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8}", file=sys.stderr)
+    rows = dict(report["endpoints"], total=report["total"])
+    for name, row in rows.items():
+        print(f"{name:15} {row['requests']:8d} {row['throughput_per_s']:7.2f} {row['error_rate']:6.1%} "
+              f"{row['rate_503']:6.1%} {row.get('p50_ms', 0):8.0f} {row.get('p95_ms', 0):8.0f} "
+              f"{row.get('p99_ms', 0):8.0f}", file=sys.stderr)
+    if report["dropped"]:
+        print(f"dropped (more than --concurrency in flight): {report['dropped']}", file=sys.stderr)
+    known = [s["rss_mb"] for s in report["rss"] if s["rss_mb"] is not None]
+    if known:
+        print(f"server RSS: {known[0]:.0f} MB at start, {max(known):.0f} MB peak, {known[-1]:.0f} MB at end",
+              file=sys.stderr)
+
+
+def _mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, expected one of: {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="load an already running server instead of starting one")
+    parser.add_argument("--pid", type=int, help="process id of the --url server, for its RSS")
+    parser.add_argument("--stub", action="store_true", help="start the server with stubbed models")
+    parser.add_argument("--stub-rtf", type=float, default=0.1,
+                        help="CPU seconds per second of audio of each stubbed model stage (default 0.1)")
+    parser.add_argument("--concurrency", type=int, default=4, help="clients, or max requests in flight (default 4)")
+    parser.add_argument("--rate", type=float, help="open loop: requests per second (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic (default 30)")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--mix", type=_mix, default=_mix("pronunciation=8,phonemes=1,tts=1"),
+                        help="endpoint weights (default pronunciation=8,phonemes=1,tts=1)")
+    parser.add_argument("--langs", type=lambda t: t.split(","), default=["en"], help="languages (default en)")
+    parser.add_argument("--repeated", type=float, default=0.5, help="share of repeated sentences (default 0.5)")
+    parser.add_argument("--pool", type=int, default=20, help="repeated sentences per language (default 20)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120, help="request timeout in seconds (default 120)")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--rss-interval", type=float, default=1.0, help="seconds between RSS samples (default 1)")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        return serve(args)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
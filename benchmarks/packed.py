@@ -0,0 +1,123 @@
+"""Append-only store of variable-length arrays in one memory-mapped file.
+
+A store is a directory with three files:
+
+- ``data.bin``: the rows of every array, back to back (``dtype``, ``width`` values per row,
+  or one value per row for 1-D arrays);
+- ``index.jsonl``: one line per array, ``{"key", "start", "rows"}``, appended after the data;
+- ``meta.json``: ``dtype`` and ``width``.
+
+``store[key]`` is a read-only view into the memory map: no copy, no file opened per
+array, and every process reading the store shares the same pages of the page cache.
+``append`` writes the data first and the index line second, so an interrupted extraction
+leaves at most a tail of unindexed data, truncated the next time the store is opened
+for writing.
+
+    store = PackedStore(path, width=len(vocab), dtype="float16")
+    store.append("utt1", log_posteriors)
+    store["utt1"]  # (frames, width) float16 view
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+class PackedStore:
+    def __init__(self, directory, width=None, dtype="float32"):
+        self.directory = directory
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if width is not None and meta["width"] != width or np.dtype(dtype) != np.dtype(meta["dtype"]):
+                raise ValueError(f"{directory} holds {meta['dtype']} rows of width {meta['width']}, "
+                                 f"not {np.dtype(dtype).name} rows of width {width}")
+            width, dtype = meta["width"], meta["dtype"]
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = self.dtype.itemsize * (width or 1)
+        self.index = {}
+        self.rows = 0
+        index_path = os.path.join(directory, "index.jsonl")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                for line in f:
+                    if not line.endswith("\n"):  # torn last line
+                        break
+                    entry = json.loads(line)
+                    self.index[entry["key"]] = (entry["start"], entry["rows"])
+                    self.rows = max(self.rows, entry["start"] + entry["rows"])
+        self._map = None
+        self._data = None
+        self._index = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, key):
+        start, rows = self.index[key]
+        if self._map is None or len(self._map) < start + rows:
+            self._map = self._open_map()
+        return self._map[start:start + rows]
+
+    def _open_map(self):
+        if self.rows == 0:
+            return np.empty((0, self.width) if self.width else 0, dtype=self.dtype)
+        shape = (self.rows, self.width) if self.width else (self.rows,)
+        return np.memmap(os.path.join(self.directory, "data.bin"), dtype=self.dtype, mode="r", shape=shape)
+
+    def append(self, key, array):
+        """Append ``array`` under ``key`` (cast to the store's dtype); keys are written once."""
+        if key in self.index:
+            raise ValueError(f"{key!r} is already in {self.directory}")
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        expected = (self.width,) if self.width else ()
+        if array.ndim != len(expected) + 1 or array.shape[1:] != expected:
+            raise ValueError(f"expected an array of shape (n, {self.width}), got {array.shape}"
+                             if self.width else f"expected a 1-D array, got shape {array.shape}")
+        if self._data is None:
+            self._open_for_append()
+        self._data.write(array.tobytes())
+        self._data.flush()
+        self._index.write(json.dumps({"key": key, "start": self.rows, "rows": len(array)}) + "\n")
+        self._index.flush()
+        self.index[key] = (self.rows, len(array))
+        self.rows += len(array)
+
+    def _open_for_append(self):
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, "meta.json")
+        if not os.path.exists(meta_path):
+            with open(meta_path, "w") as f:
+                json.dump({"dtype": self.dtype.name, "width": self.width}, f)
+        data_path = os.path.join(self.directory, "data.bin")
+        with open(data_path, "ab") as f:
+            f.truncate(self.rows * self.row_bytes)  # drop the data of an append that never got its index line
+        index_path = os.path.join(self.directory, "index.jsonl")
+        if os.path.exists(index_path):
+            with open(index_path, "rb+") as f:
+                content = f.read()
+                f.truncate(content.rfind(b"\n") + 1)
+        self._data = open(data_path, "ab")
+        self._index = open(index_path, "a")
+
+    def close(self):
+        for f in (self._data, self._index):
+            if f is not None:
+                f.close()
+        self._data = self._index = None
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,244 @@
+"""Speed of every stage and of the whole pipeline on the bundled samples, with regression checks.
+
+    python benchmarks/perf.py --out benchmarks/results/perf.json
+    python benchmarks/perf.py --threads 1,4 --repeat 10 --out perf.json
+    python benchmarks/perf.py --compare benchmarks/results/perf.json --tolerance 0.15
+
+For each torch thread count of ``--threads``, each stage (decode, reference TTS,
+embeddings, ASR, phone recognition and comparison, DTW, prosody) and the end-to-end
+``compare_audio_with_text`` run on every sample of :data:`ASSETS`: the first call of
+the process is the cold latency (model loading, first synthesis of the references in
+an empty cache), the ``--repeat`` calls after it give the warm percentiles. Then the
+pipeline runs with 1, 4 and 16 requests in flight (``--batch``) for the throughput.
+The peak RSS of the process closes the report.
+
+Everything runs offline: the Hugging Face hub is put in offline mode (the models must
+be in the local cache) and the reference voice defaults to Piper
+(``OPENPRONOUNCE_TTS=piper``, voice files cached). The audio cache is off
+(``OPENPRONOUNCE_AUDIO_CACHE_MB=0``): the repeated runs on the same samples time the
+models rather than cache hits. ``--compare`` reruns the suite and
+exits with status 1 when a warm p50 or p90 is more than ``--tolerance`` slower (and at
+least ``--min-delta-ms`` slower) than in the baseline, a throughput more than
+``--tolerance`` lower, or the peak RSS more than ``--tolerance`` higher.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+os.environ.setdefault("OPENPRONOUNCE_TTS", "piper")
+# Every run analyses the same samples again: the timings are those of the models, not of the audio cache.
+os.environ.setdefault("OPENPRONOUNCE_AUDIO_CACHE_MB", "0")
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from openpronounce import __version__, audio, phones, speech  # noqa: E402
+
+ASSETS = [
+    ("assets/developer.wav", "hello I am a developer"),
+    ("assets/developer1.wav", "hello I am a developer"),
+    ("assets/example.mp3", "Hello, how are you?"),
+    ("assets/harvard.wav", "assets/harvard_text.txt"),
+]
+STAGES = ("decode", "reference_tts", "embeddings", "asr", "phone_recognition", "phone_comparison", "dtw", "prosody",
+          "pipeline")
+PERCENTILES = (50, 90, 99)
+
+
+class Sample:
+    def __init__(self, path, text):
+        self.path = os.path.join(ROOT, path)
+        text_path = os.path.join(ROOT, text)
+        if os.path.isfile(text_path):
+            with open(text_path, encoding="utf-8") as f:
+                text = f.read().strip()
+        self.text = text
+        self.name = os.path.basename(path)
+        self.sound = audio.load(self.path)
+        self.recognition = None
+        self.embeddings = None
+        self.reference_embeddings = None
+
+
+def stage_runners(lang):
+    """``{stage: fn(sample)}``; the stages that need an earlier output compute it once, untimed."""
+
+    def phone_comparison(sample):
+        if sample.recognition is None:
+            sample.recognition = phones.recognize_phones(sample.sound, lang=lang)
+        return phones.compare_phones(sample.recognition, sample.text, lang)
+
+    def dtw(sample):
+        if sample.embeddings is None:
+            sample.embeddings = speech.extract_embeddings(sample.sound)
+            reference = audio.load(audio.text2speech(sample.text, lang=lang))
+            sample.reference_embeddings = speech.extract_embeddings(reference)
+        return speech.fastdtw(sample.embeddings, sample.reference_embeddings, dist=speech.euclidean)
+
+    return {
+        "decode": lambda sample: audio.load(sample.path),
+        "reference_tts": lambda sample: audio.text2speech(sample.text, lang=lang),
+        "embeddings": lambda sample: speech.extract_embeddings(sample.sound),
+        "asr": lambda sample: speech.transcribe(sample.sound, lang),
+        "phone_recognition": lambda sample: phones.recognize_phones(sample.sound, lang=lang),
+        "phone_comparison": phone_comparison,
+        "dtw": dtw,
+        "prosody": lambda sample: (speech.extract_energy(sample.sound),
+                                   speech.interpolate_f0(speech.extract_f0(sample.sound))),
+        "pipeline": lambda sample: speech.compare_audio_with_text(sample.sound, sample.text, lang=lang),
+    }
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return 1000 * (time.perf_counter() - started)
+
+
+def summarize(times_ms):
+    times = np.asarray(times_ms)
+    row = {f"p{q}_ms": round(float(np.percentile(times, q)), 2) for q in PERCENTILES}
+    row.update(mean_ms=round(float(times.mean()), 2), n=len(times))
+    return row
+
+
+def throughput(run, samples, batch, rounds):
+    """Pipelines per second with ``batch`` requests in flight, over ``batch * rounds`` requests."""
+    items = [samples[i % len(samples)] for i in range(batch * rounds)]
+    with ThreadPoolExecutor(max_workers=batch) as pool:
+        started = time.perf_counter()
+        list(pool.map(run, items))
+        seconds = time.perf_counter() - started
+    return round(len(items) / seconds, 3)
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_suite(args):
+    cold = {}
+    if "decode" in args.stages:
+        cold["decode"] = round(timed(audio.load, os.path.join(ROOT, ASSETS[0][0])), 2)
+    samples = [Sample(path, text) for path, text in ASSETS]
+    runners = stage_runners(args.lang)
+    stages = [s for s in STAGES if s in args.stages]
+    report = {
+        "meta": {
+            "openpronounce": __version__,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "tts": os.environ["OPENPRONOUNCE_TTS"],
+            "repeat": args.repeat,
+            "samples": [sample.name for sample in samples],
+        },
+        "runs": {},
+    }
+    with tempfile.TemporaryDirectory() as cache_dir:
+        audio.CACHE_DIR = cache_dir  # cold reference synthesis, then cached
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            run = {"stages": {}, "throughput": {}}
+            for stage in stages:
+                if stage not in cold:
+                    cold[stage] = round(timed(runners[stage], samples[0]), 2)
+                times = [timed(runners[stage], sample) for _ in range(args.repeat) for sample in samples]
+                run["stages"][stage] = {"cold_ms": cold[stage], **summarize(times)}
+                print(f"threads={threads} {stage:18} cold {cold[stage]:9.1f} ms  "
+                      f"p50 {run['stages'][stage]['p50_ms']:9.1f} ms  p90 {run['stages'][stage]['p90_ms']:9.1f} ms",
+                      file=sys.stderr)
+            if "pipeline" in stages:
+                for batch in args.batch:
+                    run["throughput"][str(batch)] = throughput(runners["pipeline"], samples, batch, args.rounds)
+                    print(f"threads={threads} batch={batch:<3} {run['throughput'][str(batch)]:.2f} pipelines/s",
+                          file=sys.stderr)
+            report["runs"][str(threads)] = run
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def compare(current, baseline, tolerance, min_delta_ms):
+    """Regressions of ``current`` against ``baseline``, as human-readable lines."""
+    regressions = []
+    for threads, run in current["runs"].items():
+        base_run = baseline.get("runs", {}).get(threads)
+        if base_run is None:
+            continue
+        for stage, row in run["stages"].items():
+            base = base_run["stages"].get(stage)
+            if base is None:
+                continue
+            for key in ("p50_ms", "p90_ms"):
+                if row[key] > base[key] * (1 + tolerance) and row[key] - base[key] >= min_delta_ms:
+                    regressions.append(f"threads={threads} {stage} {key}: {base[key]:.1f} -> {row[key]:.1f}")
+        for batch, value in run["throughput"].items():
+            base = base_run["throughput"].get(batch)
+            if base is not None and value < base * (1 - tolerance):
+                regressions.append(f"threads={threads} throughput batch={batch}: {base:.2f} -> {value:.2f}/s")
+    base_rss = baseline.get("peak_rss_mb")
+    if base_rss and current["peak_rss_mb"] > base_rss * (1 + tolerance):
+        regressions.append(f"peak RSS: {base_rss:.0f} -> {current['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def _int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=_int_list, default=[1, 4], help="torch thread counts (default 1,4)")
+    parser.add_argument("--repeat", type=int, default=5, help="warm runs per stage and sample (default 5)")
+    parser.add_argument("--batch", type=_int_list, default=[1, 4, 16], help="requests in flight (default 1,4,16)")
+    parser.add_argument("--rounds", type=int, default=2, help="throughput runs of batch size each (default 2)")
+    parser.add_argument("--stages", type=lambda t: t.split(","), default=list(STAGES),
+                        help=f"stages to run (default all: {','.join(STAGES)})")
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="fail on regressions against this report")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown, as a fraction (default 0.15)")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0,
+                        help="latency changes below this are noise (default 2 ms)")
+    args = parser.parse_args(argv)
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    report = run_suite(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(report, indent=2))
+    print(f"peak RSS {report['peak_rss_mb']:.0f} MB", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"no regression against {args.compare} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Pitch trackers on the bundled samples: contour error of the fast YIN against pYIN, and runtime.
+
+    python benchmarks/pitch.py
+    python benchmarks/pitch.py --repeat 5 --json
+
+pYIN is the reference. For every recording in assets/: the share of frames where the two
+trackers agree on voicing, the median error in cents and the gross error rate (more than
+20 % off) on the frames both call voiced, and the best-of-``--repeat`` wall time of each.
+pYIN's first call includes numba compilation, so it is run once before timing.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openpronounce import audio, pitch  # noqa: E402
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+
+
+def best_time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - started)
+    return out, best
+
+
+def compare(sound, repeat):
+    reference, pyin_seconds = best_time(lambda: pitch.pyin_f0(sound, audio.TARGET_SR), repeat)
+    fast, fast_seconds = best_time(lambda: pitch.fast_f0(sound, audio.TARGET_SR), repeat)
+    both = (reference > 0) & (fast > 0)
+    cents = np.abs(1200 * np.log2(fast[both] / reference[both])) if both.any() else np.zeros(0)
+    ratio = fast[both] / reference[both]
+    return {
+        "seconds": round(len(sound) / audio.TARGET_SR, 2),
+        "voicing_agreement": round(float(((reference > 0) == (fast > 0)).mean()), 3),
+        "voiced_pyin": round(float((reference > 0).mean()), 3),
+        "voiced_fast": round(float((fast > 0).mean()), 3),
+        "median_cents": round(float(np.median(cents)), 1) if len(cents) else None,
+        "gross_error_rate": round(float((np.abs(ratio - 1) > 0.2).mean()), 3) if len(ratio) else None,
+        "pyin_ms": round(pyin_seconds * 1000, 1),
+        "fast_ms": round(fast_seconds * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="timing runs per tracker, best is kept (default 3)")
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON")
+    args = parser.parse_args(argv)
+
+    paths = sorted(p for p in glob.glob(os.path.join(ASSETS_DIR, "*")) if p.endswith((".wav", ".mp3", ".flac")))
+    pitch.pyin_f0(np.zeros(audio.TARGET_SR, dtype=np.float32), audio.TARGET_SR)  # numba warm-up
+    rows = {}
+    for path in paths:
+        try:
+            sound = audio.load(path)
+        except Exception as e:  # noqa: BLE001 - mp3 needs ffmpeg
+            print(f"skipping {os.path.basename(path)}: {e}", file=sys.stderr)
+            continue
+        rows[os.path.basename(path)] = compare(sound, args.repeat)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'file':28} {'sec':>6} {'voicing':>8} {'cents':>6} {'gross':>6} {'pyin ms':>8} {'fast ms':>8}")
+    for name, row in rows.items():
+        print(f"{name:28} {row['seconds']:6.1f} {row['voicing_agreement']:8.2f} {row['median_cents'] or 0:6.1f} "
+              f"{row['gross_error_rate'] or 0:6.3f} {row['pyin_ms']:8.1f} {row['fast_ms']:8.1f}")
+    total_pyin = sum(r["pyin_ms"] for r in rows.values())
+    total_fast = sum(r["fast_ms"] for r in rows.values())
+    if total_fast:
+        print(f"total: pyin {total_pyin:.0f} ms, fast {total_fast:.0f} ms ({total_pyin / total_fast:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
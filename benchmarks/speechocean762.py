@@ -5,11 +5,20 @@ Two modes:
     # run inference on a fixed random sample of the test split (resumable)
     python benchmarks/speechocean762.py --sample 500 --out benchmarks/results/speechocean762.csv
 
+    # the whole test split on 4 worker processes
+    python benchmarks/speechocean762.py --sample 2500 --workers 4 --out benchmarks/results/full.csv
+
     # analyse an existing CSV: correlations, word-level precision/recall, grid search + CV
     python benchmarks/speechocean762.py --report --out benchmarks/results/speechocean762.csv
 
+    # decode the audio of the whole test split once, ahead of the runs
+    python benchmarks/speechocean762.py --decode --sample 0
+
 The dataset (parquet, with audio) is downloaded from the Hugging Face hub
-(``mispeech/speechocean762``) into ``~/.cache/openpronounce/speechocean762``.
+(``mispeech/speechocean762``) into ``~/.cache/openpronounce/speechocean762``. The audio
+is decoded once into ``waveforms/<split>`` there (16 kHz float32 in a memory-mapped
+store, see ``packed.py``): the runs read waveforms from it, decoding only the utterances
+it does not have yet.
 """
 
 import argparse
@@ -23,8 +32,13 @@ import sys
 import time
 from collections import defaultdict
 
+from packed import PackedStore
+
 DATASET_REPO = "mispeech/speechocean762"
 DATASET_DIR = os.path.join(os.path.expanduser("~"), ".cache", "openpronounce", "speechocean762")
+WAVEFORMS_DIR = os.path.join(DATASET_DIR, "waveforms")
+# Rows of the parquet file read at a time.
+BATCH_ROWS = 64
 PARQUET = {"test": "data/test-00000-of-00001.parquet", "train": "data/train-00000-of-00001.parquet"}
 
 # A word is "mispronounced" for the human raters when its accuracy is below this (0-10 scale).
@@ -53,16 +67,62 @@ def download(split="test"):
 
 
 def load_rows(split="test"):
-    """Return the list of utterance dicts (audio bytes included) of ``split``."""
+    """Return the list of utterance dicts of ``split``, without their audio (see :func:`waveforms`).
+
+    Only the label columns and the ``audio.path`` leaf of the audio struct are read: the
+    audio bytes are neither read nor decompressed.
+    """
     import pyarrow.parquet as pq
 
-    path = download(split)
-    rows = pq.read_table(path).to_pylist()
-    for row in rows:
-        row["utt"] = os.path.splitext(row["audio"]["path"])[0]
+    parquet = pq.ParquetFile(download(split))
+    names = [name for name in parquet.schema_arrow.names if name != "audio"]
+    rows = []
+    for batch in parquet.iter_batches(batch_size=BATCH_ROWS, columns=names + ["audio.path"]):
+        labels = {name: batch.column(name).to_pylist() for name in names}
+        for i, path in enumerate(batch.column("audio").field("path").to_pylist()):
+            row = {name: values[i] for name, values in labels.items()}
+            row["utt"] = os.path.splitext(path)[0]
+            rows.append(row)
     return rows
 
 
+def _audio_bytes(split, utts=None):
+    """``(utt, encoded audio)`` of the utterances of ``split`` in ``utts`` (all when ``None``), batch by batch."""
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(download(split))
+    for batch in parquet.iter_batches(batch_size=BATCH_ROWS, columns=["audio"]):
+        column = batch.column(0)
+        for i, path in enumerate(column.field("path").to_pylist()):
+            utt = os.path.splitext(path)[0]
+            if utts is None or utt in utts:
+                yield utt, column.field("bytes")[i].as_py()
+
+
+def waveforms(split="test", rows=None):
+    """The decoded 16 kHz waveforms of ``split``, as a :class:`PackedStore` indexed by ``utt``.
+
+    The utterances of ``rows`` (every utterance of the split when ``None``) that are not
+    in the store yet are decoded once and appended. ``store[utt]`` is then a float32 view
+    into a memory map: no decoding, no copy, and the memory of the waveforms read stays
+    in the page cache, shared by the worker processes.
+    """
+    directory = os.path.join(WAVEFORMS_DIR, split)
+    store = PackedStore(directory, dtype="float32")
+    missing = None if rows is None else {r["utt"] for r in rows} - set(store.keys())
+    if missing is None or missing:
+        from openpronounce import audio
+
+        with store:
+            for k, (utt, data) in enumerate(_audio_bytes(split, missing), 1):
+                if utt not in store:
+                    store.append(utt, audio.load(io.BytesIO(data)))
+                if k % 100 == 0:
+                    logger.info("decoded %d utterances into %s", k, directory)
+        store = PackedStore(directory, dtype="float32")
+    return store
+
+
 def sample_rows(rows, n, seed=0):
     """Random sample of ``n`` rows, stratified on the human ``total`` score (proportional allocation)."""
     if n >= len(rows):
@@ -131,55 +191,170 @@ def word_metrics(row, errors):
     }
 
 
+def assess(row, sound):
+    """Run the pipeline on one utterance and its waveform; returns its CSV row and its duration in seconds."""
+    from openpronounce import audio, speech
+
+    text = normalize_text(row["text"])
+    t0 = time.time()
+    text2speech_with_retry(text)
+    result = speech.compare_audio_with_text(sound, text)
+    diff = result["differences"]
+    out = {
+        "utt": row["utt"],
+        "speaker": row["speaker"],
+        "text": row["text"],
+        "human_total": row["total"],
+        "human_accuracy": row["accuracy"],
+        "human_fluency": row["fluency"],
+        "human_prosodic": row["prosodic"],
+        "score": result["score"],
+        "acoustic_distance": result["acoustic_distance"],
+        "phoneme_error_rate": diff["phoneme_error_rate"],
+        "word_error_rate": diff["word_error_rate"],
+        **word_metrics(row, diff["errors"]),
+        "wall_time": round(time.time() - t0, 2),
+    }
+    return out, len(sound) / audio.TARGET_SR
+
+
+def assess_all(worker, rows, store):
+    """Assess ``rows``, yielding ``("row", worker, out)`` or ``("failed", worker, utt)`` for each.
+
+    Ends with ``("done", worker, stats)``: utterances assessed, seconds and seconds of audio.
+    """
+    started = time.time()
+    done = 0
+    audio_seconds = 0.0
+    for row in rows:
+        try:
+            out, seconds = assess(row, store[row["utt"]])
+        except Exception as e:  # noqa: BLE001
+            logger.error("utt %s failed: %s", row["utt"], e)
+            yield "failed", worker, row["utt"]
+            continue
+        done += 1
+        audio_seconds += seconds
+        yield "row", worker, out
+    yield "done", worker, {"utterances": done, "seconds": time.time() - started, "audio_seconds": audio_seconds}
+
+
+def _worker(worker, threads, split, tasks, results):
+    """Worker process: loads the models once (on its first utterance) and assesses rows from ``tasks``."""
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s %(levelname)s [worker {worker}] %(message)s",
+                        stream=sys.stderr)
+    logging.getLogger("phonemizer").setLevel(logging.ERROR)
+    import torch
+
+    torch.set_num_threads(threads)
+    store = PackedStore(os.path.join(WAVEFORMS_DIR, split), dtype="float32")
+    for message in assess_all(worker, iter(tasks.get, None), store):
+        results.put(message)
+
+
+def _from_workers(results, processes):
+    """Messages of the worker processes until every one is done (or dead)."""
+    import queue
+
+    running = set(range(len(processes)))
+    while running:
+        try:
+            message = results.get(timeout=5)
+        except queue.Empty:
+            for worker in list(running):
+                if not processes[worker].is_alive():
+                    logger.error("worker %d exited with status %s", worker, processes[worker].exitcode)
+                    running.discard(worker)
+            continue
+        if message[0] == "done":
+            running.discard(message[1])
+        yield message
+
+
+def shard_rows(rows, shard):
+    """The ``i``-th of ``n`` interleaved slices of ``rows`` (``shard = (i, n)``, 1-based)."""
+    i, n = shard
+    return rows[i - 1::n]
+
+
+def _shard(text):
+    try:
+        i, n = (int(x) for x in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/n, got {text!r}") from None
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"shard {i} out of 1..{n}")
+    return i, n
+
+
 def run(args):
     import torch
 
-    torch.set_num_threads(args.threads)
-    from openpronounce import audio, speech
+    threads = args.threads or (6 if args.workers == 1 else max(1, (os.cpu_count() or 1) // args.workers))
+    torch.set_num_threads(threads)
 
     rows = sample_rows(load_rows(args.split), args.sample, seed=args.seed)
+    if args.shard:
+        rows = shard_rows(rows, args.shard)
     done = read_done(args.out)
     todo = [r for r in rows if r["utt"] not in done]
-    logger.info("%d utterances in sample, %d already done, %d to run", len(rows), len(done), len(todo))
-
+    logger.info("%d utterances in sample%s, %d already done, %d to run on %d worker(s) of %d threads",
+                len(rows), f" (shard {args.shard[0]}/{args.shard[1]})" if args.shard else "", len(done),
+                len(todo), args.workers, threads)
+
+    store = waveforms(args.split, todo)
+    processes = []
+    if args.workers == 1:
+        messages = assess_all(0, todo, store)
+    else:
+        import multiprocessing
+
+        context = multiprocessing.get_context("spawn")
+        tasks, results = context.Queue(), context.Queue()
+        for row in todo:
+            tasks.put(row)
+        for _ in range(args.workers):
+            tasks.put(None)
+        processes = [context.Process(target=_worker, args=(worker, threads, args.split, tasks, results), daemon=True)
+                     for worker in range(args.workers)]
+        for process in processes:
+            process.start()
+        messages = _from_workers(results, processes)
+
+    # This process is the only writer: rows are appended and flushed as they arrive, so an
+    # interrupted run resumes where it stopped whatever the number of workers.
     os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
     new_file = not os.path.exists(args.out) or os.path.getsize(args.out) == 0
     failures = []
+    stats = {}
+    started = time.time()
     with open(args.out, "a", newline="") as f:
         writer = csv.DictWriter(f, fieldnames=FIELDS)
         if new_file:
             writer.writeheader()
-        for k, row in enumerate(todo, 1):
-            text = normalize_text(row["text"])
-            t0 = time.time()
-            try:
-                text2speech_with_retry(text)
-                sound = audio.load(io.BytesIO(row["audio"]["bytes"]))
-                result = speech.compare_audio_with_text(sound, text)
-            except Exception as e:  # noqa: BLE001
-                logger.error("utt %s failed: %s", row["utt"], e)
-                failures.append(row["utt"])
+        k = 0
+        for kind, worker, payload in messages:
+            if kind == "done":
+                stats[worker] = payload
                 continue
-            diff = result["differences"]
-            out = {
-                "utt": row["utt"],
-                "speaker": row["speaker"],
-                "text": row["text"],
-                "human_total": row["total"],
-                "human_accuracy": row["accuracy"],
-                "human_fluency": row["fluency"],
-                "human_prosodic": row["prosodic"],
-                "score": result["score"],
-                "acoustic_distance": result["acoustic_distance"],
-                "phoneme_error_rate": diff["phoneme_error_rate"],
-                "word_error_rate": diff["word_error_rate"],
-                **word_metrics(row, diff["errors"]),
-                "wall_time": round(time.time() - t0, 2),
-            }
-            writer.writerow(out)
+            k += 1
+            if kind == "failed":
+                failures.append(payload)
+                continue
+            writer.writerow(payload)
             f.flush()
-            logger.info("[%d/%d] %s human=%d score=%.1f (%.1fs)", k, len(todo), row["utt"],
-                        row["total"], result["score"], out["wall_time"])
+            logger.info("[%d/%d] worker %d: %s human=%d score=%.1f (%.1fs)", k, len(todo), worker, payload["utt"],
+                        payload["human_total"], payload["score"], payload["wall_time"])
+    for process in processes:
+        process.join()
+
+    for worker, s in sorted(stats.items()):
+        logger.info("worker %d: %d utterances in %.0f s, %.1f/min, %.1fx real time", worker, s["utterances"],
+                    s["seconds"], 60 * s["utterances"] / max(s["seconds"], 1e-9),
+                    s["audio_seconds"] / max(s["seconds"], 1e-9))
+    elapsed = time.time() - started
+    logger.info("%d utterances written in %.0f s (%.1f/min)", k - len(failures), elapsed,
+                60 * (k - len(failures)) / max(elapsed, 1e-9))
     if failures:
         logger.warning("%d utterances failed: %s", len(failures), " ".join(failures))
 
@@ -211,11 +386,8 @@ def score_from_components(ad, per, wer, good, bad, w_ac, w_ph, w_wo):
 
 # Grid of the score constants explored by ``--report``: weights on a 0.1 step (summing to
 # 1), acoustic bounds GOOD in 3..8 and BAD in 12..22.
-GRID_WEIGHTS = [(a / 10, p / 10, round((10 - a - p) / 10, 1)) for a in range(11) for p in range(11 - a)]
 GRID_GOOD = [float(g) for g in range(3, 9)]
 GRID_BAD = [float(b) for b in range(12, 23)]
-GRID = [(w, g, b) for w in GRID_WEIGHTS for g in GRID_GOOD for b in GRID_BAD
-        if w[0] > 0 or (g, b) == (GRID_GOOD[0], GRID_BAD[0])]  # bounds irrelevant without acoustic weight
 
 # Combinations always reported by the cross-validation, next to the current defaults.
 CV_CANDIDATES = [
@@ -229,10 +401,9 @@ CV_CANDIDATES = [
 
 
 def current_constants():
-    from openpronounce import speech
+    from openpronounce import calibrate
 
-    w = speech.SCORE_WEIGHTS
-    return (w["acoustic"], w["phonemes"], w["words"]), speech.ACOUSTIC_DISTANCE_GOOD, speech.ACOUSTIC_DISTANCE_BAD
+    return calibrate.current_constants("en")
 
 
 def components(rows):
@@ -242,44 +413,41 @@ def components(rows):
 
 
 def grid_search(rows, human, top=8):
+    """Grid search and cross-validation of the score constants (see :mod:`openpronounce.calibrate`)."""
     import numpy as np
-    from scipy.stats import spearmanr
-
-    ad, per, wer = components(rows)
 
-    def rho(combo, idx=slice(None)):
-        (w_ac, w_ph, w_wo), good, bad = combo
-        s = score_from_components(ad[idx], per[idx], wer[idx], good, bad, w_ac, w_ph, w_wo)
-        return spearmanr(s, human[idx]).correlation
+    from openpronounce import calibrate
 
-    results = sorted(((rho(c), c) for c in GRID), reverse=True)
     default = current_constants()
+    grid = calibrate.make_grid(GRID_GOOD, GRID_BAD, extra=[default] + CV_CANDIDATES)
+    points = [grid.point(i) for i in range(len(grid))]
+
+    # Two-fold cross-validation, three random splits: the best combination of one half is
+    # scored on the other half, next to fixed candidates.
+    candidates = [default] + [c for c in CV_CANDIDATES if grid.find(c) != grid.find(default)]
+    cv = calibrate.cross_validate(components(rows), human, grid, splits=3, points=[grid.find(c) for c in candidates])
+    rho = cv["full"]
+    order = np.argsort(-np.nan_to_num(rho, nan=-np.inf), kind="stable")
 
     print("\nGrid search (Spearman of recomputed score vs human total):")
     print(f"{'spearman':>9} {'w_acoustic':>10} {'w_phonemes':>10} {'w_words':>8} {'AD_GOOD':>8} {'AD_BAD':>7}")
-    for r, ((w_ac, w_ph, w_wo), good, bad) in results[:top]:
-        print(f"{r:9.4f} {w_ac:10.1f} {w_ph:10.1f} {w_wo:8.1f} {good:8.1f} {bad:7.1f}")
+    for i in order[:top]:
+        (w_ac, w_ph, w_wo), good, bad = points[i]
+        print(f"{rho[i]:9.4f} {w_ac:10.1f} {w_ph:10.1f} {w_wo:8.1f} {good:8.1f} {bad:7.1f}")
     (w_ac, w_ph, w_wo), good, bad = default
-    print(f"{rho(default):9.4f} {w_ac:10.1f} {w_ph:10.1f} {w_wo:8.1f} {good:8.1f} {bad:7.1f}  <- current defaults")
+    current = rho[grid.find(default)]
+    print(f"{current:9.4f} {w_ac:10.1f} {w_ph:10.1f} {w_wo:8.1f} {good:8.1f} {bad:7.1f}  <- current defaults")
 
-    # Two-fold cross-validation, three random splits: the best combination of one half is
-    # scored on the other half, next to fixed candidates.
-    n = len(rows)
-    folds = []
-    for seed in range(3):
-        perm = np.random.RandomState(seed).permutation(n)
-        folds.append((perm[: n // 2], perm[n // 2:]))
-        folds.append((perm[n // 2:], perm[: n // 2]))
     print("\nCross-validation (2 folds x 3 splits), held-out Spearman with human total:")
-    tuned = [(rho(max(GRID, key=lambda c: rho(c, train)), test)) for train, test in folds]
+    tuned = cv["tuned"]
     print(f"{'best of the training half':32} mean {np.mean(tuned):.3f}  folds " + " ".join(f"{v:.3f}" for v in tuned))
-    for combo in [default] + [c for c in CV_CANDIDATES if c != default]:
-        vals = [rho(combo, test) for _, test in folds]
+    for combo in candidates:
+        vals = cv["held_out"][grid.find(combo)]
         (w_ac, w_ph, w_wo), good, bad = combo
         name = f"{w_ac:.1f}/{w_ph:.1f}/{w_wo:.1f} bounds {good:.0f}/{bad:.0f}"
         print(f"{name:32} mean {np.mean(vals):.3f}  folds " + " ".join(f"{v:.3f}" for v in vals)
               + ("  <- current defaults" if combo == default else ""))
-    return results
+    return [(rho[i], points[i]) for i in order]
 
 
 def report(args):
@@ -384,13 +552,32 @@ def main(argv=None):
     parser.add_argument("--split", default="test", choices=["test", "train"])
     parser.add_argument("--seed", type=int, default=0)
     parser.add_argument("--out", default="benchmarks/results/speechocean762.csv")
-    parser.add_argument("--threads", type=int, default=6, help="torch threads")
+    parser.add_argument("--threads", type=int,
+                        help="torch threads per worker (default 6 with one worker, else the CPUs shared out)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes, each loading the models once (default 1: in this process)")
+    parser.add_argument("--shard", type=_shard, metavar="I/N",
+                        help="run only the I-th of N interleaved slices of the sample (1-based), e.g. one per machine")
+    parser.add_argument("--phones-only", action="store_true",
+                        help="skip the word ASR model (OPENPRONOUNCE_WORD_ASR=0): word error rate from the phones")
+    parser.add_argument("--trim-silence", action="store_true",
+                        help="cut the silence at both ends before the models (OPENPRONOUNCE_TRIM_SILENCE=1)")
     parser.add_argument("--report", action="store_true", help="analyse the CSV instead of running inference")
+    parser.add_argument("--decode", action="store_true",
+                        help="only decode the audio of the sample into the waveform store (--sample 0: whole split)")
     args = parser.parse_args(argv)
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
     logging.getLogger("phonemizer").setLevel(logging.ERROR)
+    if args.phones_only:
+        # Before openpronounce is imported here or in the workers, which inherit the environment
+        os.environ["OPENPRONOUNCE_WORD_ASR"] = "0"
+    if args.trim_silence:
+        os.environ["OPENPRONOUNCE_TRIM_SILENCE"] = "1"
     if args.report:
         report(args)
+    elif args.decode:
+        rows = sample_rows(load_rows(args.split), args.sample, seed=args.seed) if args.sample else None
+        logger.info("%d utterances in %s", len(waveforms(args.split, rows)), os.path.join(WAVEFORMS_DIR, args.split))
     else:
         run(args)
 
@@ -12,25 +12,32 @@
     # 4. flagged words on the bundled samples (assets/), as a regression check
     python benchmarks/word_detection.py --assets
 
-The posteriors are cached in ``~/.cache/openpronounce/speechocean762/logits`` (float16,
-one ``.npy`` per utterance, plus ``labels.json`` and ``vocab.json``), so steps 2-4 do not
-need the model. A word is "mispronounced" for the raters when its accuracy is below 5
-(strict) or 7 (lenient); both are reported. The sample is split by parity of the
-utterance index: even for tuning, odd held out.
+The posteriors are cached in ``~/.cache/openpronounce/speechocean762/logits``: a packed
+store of float16 frames (``posteriors/``, see ``packed.py``) read through a memory map,
+plus ``labels.json`` and ``vocab.json``, so steps 2-4 do not need the model. Extraction
+appends to the store and resumes where it stopped; the one-``.npy``-per-utterance files
+of older versions are packed instead of being recomputed. Steps 2 and 3 decode the
+posteriors and align the words in ``--workers`` processes sharing the memory map.
+
+A word is "mispronounced" for the raters when its accuracy is below 5 (strict) or 7
+(lenient); both are reported. The sample is split by parity of the utterance index: even
+for tuning, odd held out.
 """
 
 import argparse
-import io
 import itertools
 import json
 import logging
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from speechocean762 import DATASET_DIR, load_rows, sample_rows  # noqa: E402
+from packed import PackedStore  # noqa: E402
+from speechocean762 import DATASET_DIR, load_rows, sample_rows, waveforms  # noqa: E402
 
 LOGITS_DIR = os.path.join(DATASET_DIR, "logits")
+STORE_DIR = os.path.join(LOGITS_DIR, "posteriors")
 LABEL_THRESHOLDS = (5, 7)
 ASSETS = [
     ("assets/developer.wav", "hello I am a developer"),
@@ -51,7 +58,7 @@ def extract(args):
     import torch
 
     torch.set_num_threads(args.threads)
-    from openpronounce import audio, phones
+    from openpronounce import phones
 
     rows = sample_rows(load_rows(args.split), args.sample, seed=args.seed)
     os.makedirs(LOGITS_DIR, exist_ok=True)
@@ -61,15 +68,22 @@ def extract(args):
     } for r in rows]
     with open(os.path.join(LOGITS_DIR, "labels.json"), "w") as f:
         json.dump(labels, f)
+    vocab = list(phones.phone_vocab())
     with open(os.path.join(LOGITS_DIR, "vocab.json"), "w") as f:
-        json.dump(list(phones.phone_vocab()), f)
-    for k, row in enumerate(rows, 1):
-        path = os.path.join(LOGITS_DIR, row["utt"] + ".npy")
-        if os.path.exists(path):
-            continue
-        sound = audio.load(io.BytesIO(row["audio"]["bytes"]))
-        np.save(path, phones.phone_log_posteriors(sound).astype(np.float16))
-        logger.info("[%d/%d] %s", k, len(rows), row["utt"])
+        json.dump(vocab, f)
+    sounds = None
+    with PackedStore(STORE_DIR, width=len(vocab), dtype="float16") as store:
+        for k, row in enumerate(rows, 1):
+            if row["utt"] in store:
+                continue
+            legacy = os.path.join(LOGITS_DIR, row["utt"] + ".npy")
+            if os.path.exists(legacy):
+                store.append(row["utt"], np.load(legacy))
+                continue
+            if sounds is None:
+                sounds = waveforms(args.split, [r for r in rows if r["utt"] not in store])
+            store.append(row["utt"], phones.phone_log_posteriors(sounds[row["utt"]]))
+            logger.info("[%d/%d] %s", k, len(rows), row["utt"])
 
 
 def load_cache():
@@ -78,22 +92,29 @@ def load_cache():
         labels = json.load(f)
     with open(os.path.join(LOGITS_DIR, "vocab.json")) as f:
         vocab = tuple(json.load(f))
-    missing = [lab["utt"] for lab in labels if not os.path.exists(os.path.join(LOGITS_DIR, lab["utt"] + ".npy"))]
+    store = PackedStore(STORE_DIR, width=len(vocab), dtype="float16")
+    missing = [lab["utt"] for lab in labels if lab["utt"] not in store]
     if missing:
         raise SystemExit(f"{len(missing)} utterances without cached posteriors, run --extract first")
     return labels, vocab
 
 
-def word_rows(labels, vocab, use_posteriors=True):
-    """One dict per word: the report of ``phones._word_reports`` plus ``bad<5``/``bad<7`` and ``tune``."""
-    import numpy as np
+_store = None
+
 
+def _open_store(vocab):
+    global _store
+    _store = PackedStore(STORE_DIR, width=len(vocab), dtype="float16")
+
+
+def _word_rows_of(task):
+    """Word rows of a chunk of ``(index, label)`` pairs, from the posteriors of the shared store."""
+    chunk, vocab, use_posteriors = task
     from openpronounce import phones
 
     rows = []
-    for k, lab in enumerate(labels):
-        log_posteriors = np.load(os.path.join(LOGITS_DIR, lab["utt"] + ".npy")).astype(np.float32)
-        recognition = phones.decode_ctc(log_posteriors, vocab)
+    for k, lab in chunk:
+        recognition = phones.decode_ctc(_store[lab["utt"]], vocab)
         heard = recognition if use_posteriors else recognition.phones
         for report in phones._word_reports(heard, lab["text"].lower()):
             accuracy = lab["words"][report["position"]]["accuracy"]
@@ -104,6 +125,21 @@ def word_rows(labels, vocab, use_posteriors=True):
     return rows
 
 
+def word_rows(labels, vocab, use_posteriors=True, workers=1):
+    """One dict per word: the report of ``phones._word_reports`` plus ``bad<5``/``bad<7`` and ``tune``.
+
+    With ``workers > 1`` the utterances are shared out between processes that each map the store.
+    """
+    pairs = list(enumerate(labels))
+    if workers <= 1:
+        _open_store(vocab)
+        return _word_rows_of((pairs, vocab, use_posteriors))
+    size = max(1, len(pairs) // (4 * workers))
+    tasks = [(pairs[i:i + size], vocab, use_posteriors) for i in range(0, len(pairs), size)]
+    with ProcessPoolExecutor(workers, initializer=_open_store, initargs=(vocab,)) as pool:
+        return [row for rows in pool.map(_word_rows_of, tasks) for row in rows]
+
+
 # ---------------------------------------------------------------------------
 # Rules and metrics
 # ---------------------------------------------------------------------------
@@ -129,21 +165,42 @@ def metrics(rows, flag, label):
 GRID = list(itertools.product([t / 20 for t in range(4, 25)], [1.5, 2, 2.5, 3, 4, 99]))
 
 
+def grid_metrics(rows, key, label):
+    """:func:`metrics` of :func:`rule` at every point of :data:`GRID`, in the grid order.
+
+    The word rows are turned into arrays once and every grid point is a few vector
+    operations, instead of calling the rule on every word for every point.
+    """
+    import numpy as np
+
+    edits = np.array([r[key] for r in rows], dtype=np.float64)
+    ratio = edits / np.array([len(r["expected"]) for r in rows])
+    differs = np.array([r["distance"] > 0 for r in rows])
+    bad = np.array([r[label] for r in rows], dtype=bool)
+    results = []
+    for threshold, min_edits in GRID:
+        flagged = differs & ((ratio >= threshold) | (edits >= min_edits))
+        tp = int(np.sum(flagged & bad))
+        fp = int(np.sum(flagged & ~bad))
+        fn = int(np.sum(~flagged & bad))
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        results.append({"precision": precision, "recall": recall, "f1": f1, "flagged": (tp + fp) / len(rows)})
+    return results
+
+
 def precision_at_recall(rows, key, label, target):
     """Best precision over the grid of thresholds among operating points with recall >= target."""
-    best = 0.0
-    for threshold, min_edits in GRID:
-        m = metrics(rows, rule(threshold, min_edits, key), label)
-        if m["recall"] >= target:
-            best = max(best, m["precision"])
-    return best
+    return max((m["precision"] for m in grid_metrics(rows, key, label) if m["recall"] >= target), default=0.0)
 
 
 def tune(args):
     labels, vocab = load_cache()
-    rows = [r for r in word_rows(labels, vocab) if r["tune"]]
+    rows = [r for r in word_rows(labels, vocab, workers=args.workers) if r["tune"]]
     label = f"bad<{args.label}"
-    results = sorted(((metrics(rows, rule(t, m), label), t, m) for t, m in GRID), key=lambda x: -x[0]["f1"])
+    results = sorted(((m, t, me) for m, (t, me) in zip(grid_metrics(rows, "weighted_edits", label), GRID)),
+                     key=lambda x: -x[0]["f1"])
     print(f"Tuning half: {len(rows)} words, {sum(r[label] for r in rows)} with human accuracy < {args.label}")
     print(f"{'threshold':>9} {'min_edits':>9} {'F1':>6} {'P':>6} {'R':>6} {'flagged':>8}")
     for m, t, me in results[:15]:
@@ -154,8 +211,8 @@ def report(args):
     from openpronounce import phones
 
     labels, vocab = load_cache()
-    with_posteriors = word_rows(labels, vocab)
-    without = word_rows(labels, vocab, use_posteriors=False)
+    with_posteriors = word_rows(labels, vocab, workers=args.workers)
+    without = word_rows(labels, vocab, use_posteriors=False, workers=args.workers)
     current = rule(phones.PHONE_ERROR_THRESHOLD, phones.PHONE_ERROR_MIN_EDITS)
     systems = [
         ("0.2.1 rule (edit distance >= 50 % or >= 3)", without, rule(0.5, 3, "distance"), "distance"),
@@ -207,6 +264,8 @@ def main(argv=None):
     parser.add_argument("--label", type=int, default=5, choices=LABEL_THRESHOLDS,
                         help="human accuracy below which a word is mispronounced, for --tune")
     parser.add_argument("--threads", type=int, default=6, help="torch threads")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes decoding the cached posteriors for --tune and --report (default: CPUs)")
     args = parser.parse_args(argv)
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
     logging.getLogger("phonemizer").setLevel(logging.ERROR)
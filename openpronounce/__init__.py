@@ -9,10 +9,14 @@ Typical usage::
     print(result["score"], result["differences"]["errors"])
 
     result = compare_audio_with_text(load_audio("bonjour.wav"), "Bonjour le monde", lang="fr")
+
+    # one-to-three-minute read-aloud passages, scored sentence by sentence
+    result = assess_passage(load_audio("reading.wav"), open("reading.txt").read())
 """
 
 from .audio import load as load_audio, text2speech
 from .languages import LANGUAGES, get_language
+from .passage import assess_passage, iter_passage
 from .phones import compare_phones, recognize_phones, transcribe_phones
 from .speech import (
     compare_audio_with_text,
@@ -31,6 +35,8 @@ __all__ = [
     "LANGUAGES",
     "get_language",
     "compare_audio_with_text",
+    "assess_passage",
+    "iter_passage",
     "compare_transcriptions",
     "compare_phones",
     "recognize_phones",
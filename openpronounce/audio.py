@@ -6,12 +6,14 @@ import os
 import shutil
 import subprocess
 import tempfile
+import threading
+from typing import NamedTuple
 
 import librosa
 import numpy as np
 import soundfile as sf
 
-from openpronounce import tts
+from openpronounce import metrics, tracing, tts
 
 logger = logging.getLogger(__name__)
 
@@ -22,14 +24,30 @@ CACHE_DIR = os.environ.get(
     os.path.join(tempfile.gettempdir(), "openpronounce"),
 )
 
+# Longest recording the server accepts, in seconds (0: no limit).
+MAX_SECONDS = float(os.environ.get("OPENPRONOUNCE_MAX_SECONDS", "300"))
 
-def _decode_with_ffmpeg(file_path, sr):
-    """Decode any container/codec ffmpeg knows (webm/opus, m4a, ...) to a mono float32 waveform."""
+
+class AudioTooLongError(ValueError):
+    """The recording is longer than the ``max_seconds`` it was loaded with."""
+
+    def __init__(self, max_seconds):
+        super().__init__(f"recording longer than {max_seconds:g} seconds")
+        self.max_seconds = max_seconds
+
+
+def _decode_with_ffmpeg(file_path, sr, max_seconds=None):
+    """Decode any container/codec ffmpeg knows (webm/opus, m4a, ...) to a mono float32 waveform.
+
+    With ``max_seconds``, ffmpeg stops a little after that duration instead of decoding the whole file.
+    """
     ffmpeg = shutil.which("ffmpeg")
     if ffmpeg is None:
         raise RuntimeError("ffmpeg is not installed")
+    limit = ["-t", f"{max_seconds + 1:g}"] if max_seconds else []
     result = subprocess.run(
-        [ffmpeg, "-v", "error", "-i", file_path, "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sr), "-"],
+        [ffmpeg, "-v", "error", "-i", file_path, *limit, "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1",
+         "-ar", str(sr), "-"],
         capture_output=True,
         check=False,
     )
@@ -38,19 +56,35 @@ def _decode_with_ffmpeg(file_path, sr):
     return np.frombuffer(result.stdout, dtype=np.float32).copy()
 
 
-def load(file_path, sr=TARGET_SR):
+@tracing.span("decode")
+def load(file_path, sr=TARGET_SR, max_seconds=None):
     """Load any audio file (wav, mp3, flac, ogg, webm, m4a...) as a mono float32 waveform at ``sr`` Hz.
 
     libsndfile (through librosa) handles wav/flac/ogg/mp3; anything it cannot open
     (browser webm/opus recordings, m4a...) is decoded with ffmpeg.
+
+    With ``max_seconds``, a longer recording raises :class:`AudioTooLongError`: from the
+    file header when libsndfile can read it, otherwise once decoding has gone past the
+    limit, so the rest of the file is never decoded.
     """
     try:
-        waveform, _ = librosa.load(file_path, sr=sr, mono=True)
-        return waveform
+        if max_seconds:
+            try:
+                duration = sf.info(file_path).duration
+            except Exception:  # noqa: BLE001 - not a libsndfile format, decode up to the limit instead
+                duration = None
+            if duration is not None and duration > max_seconds:
+                raise AudioTooLongError(max_seconds)
+        waveform, _ = librosa.load(file_path, sr=sr, mono=True, duration=max_seconds + 1 if max_seconds else None)
+        return _check_duration(waveform, sr, max_seconds)
+    except AudioTooLongError:
+        raise
     except Exception as e:  # noqa: BLE001 - libsndfile cannot read this format, try ffmpeg
         libsndfile_error = e
     try:
-        return _decode_with_ffmpeg(file_path, sr)
+        return _check_duration(_decode_with_ffmpeg(file_path, sr, max_seconds), sr, max_seconds)
+    except AudioTooLongError:
+        raise
     except Exception as e:  # noqa: BLE001
         raise RuntimeError(
             f"Unable to decode {file_path!r} (libsndfile: {libsndfile_error}; ffmpeg: {e}). "
@@ -58,6 +92,136 @@ def load(file_path, sr=TARGET_SR):
         ) from e
 
 
+def _check_duration(waveform, sr, max_seconds):
+    if max_seconds and len(waveform) > max_seconds * sr:
+        raise AudioTooLongError(max_seconds)
+    return waveform
+
+
+# Signal-quality gate (see assess_quality). Frames of 25 ms every 10 ms.
+QUALITY_FRAME = 0.025
+QUALITY_HOP = 0.010
+MIN_SECONDS = 0.5
+# Overall level under which the recording is silent (dB relative to full scale).
+MIN_RMS_DBFS = -60.0
+# A frame is speech when it is this much louder than the noise floor (the 10th
+# percentile of the frame energies) and above MIN_RMS_DBFS.
+SPEECH_MARGIN_DB = 10.0
+MIN_SPEECH_RATIO = 0.05
+# Samples at full scale, as a share of the recording.
+MAX_CLIPPING_RATE = 0.01
+CLIPPING_LEVEL = 0.999
+# Signal-to-noise estimate: the level of the loudest frames (95th percentile) over the
+# noise floor, in dB. Speech in white noise at 0 dB overall SNR gives 6-8 dB, clean
+# recordings 30 dB and more. Under MIN_CONTRAST_DB nothing stands out of the background.
+SPEECH_LEVEL_PERCENTILE = 95
+MIN_SNR_DB = 10.0
+MIN_CONTRAST_DB = 2.0
+
+
+def _speech_frames(waveform, sr):
+    """Level in dB of every frame (``QUALITY_FRAME`` long, every ``QUALITY_HOP``) and which frames are speech."""
+    frame, hop = int(QUALITY_FRAME * sr), int(QUALITY_HOP * sr)
+    padded = waveform if len(waveform) >= frame else np.pad(waveform, (0, frame - len(waveform)))
+    frames = np.lib.stride_tricks.sliding_window_view(padded, frame)[::hop]
+    power = np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / frame
+    frame_db = 10 * np.log10(power + 1e-10)
+    floor_db = np.percentile(frame_db, 10)
+    return frame_db, (frame_db > floor_db + SPEECH_MARGIN_DB) & (frame_db > MIN_RMS_DBFS)
+
+
+def assess_quality(waveform, sr=TARGET_SR):
+    """Cheap checks that a recording can be assessed at all, before any model runs.
+
+    Returns a JSON-serializable verdict: ``ok``, ``problems`` (``{code, message}`` for each
+    failed check: ``too_short``, ``silent``, ``no_speech``, ``clipped``, ``noisy``) and the
+    measures they come from: ``duration`` (s), ``rms_dbfs``, ``speech_ratio`` (share of
+    frames louder than the noise floor by ``SPEECH_MARGIN_DB``), ``clipping_rate`` (share
+    of samples at full scale) and ``snr_db`` (the loudest frames over the noise floor). The
+    frame energies are computed for all frames at once; a minute of audio takes a few
+    milliseconds.
+    """
+    with tracing.span("quality", frames=len(waveform) // 320):
+        waveform = np.asarray(waveform, dtype=np.float32)
+        duration = len(waveform) / sr
+        frame_db, speech = _speech_frames(waveform, sr)
+        rms_dbfs = float(10 * np.log10(np.mean(waveform.astype(np.float64) ** 2) + 1e-10)) if len(waveform) else -100.0
+
+        speech_ratio = float(speech.mean())
+        floor_db, speech_db = np.percentile(frame_db, [10, SPEECH_LEVEL_PERCENTILE])
+        snr_db = float(speech_db - floor_db)
+        clipping_rate = float(np.mean(np.abs(waveform) >= CLIPPING_LEVEL)) if len(waveform) else 0.0
+
+        problems = []
+        if duration < MIN_SECONDS:
+            problems.append(("too_short",
+                             f"the recording lasts {duration:.2f} s, at least {MIN_SECONDS:g} s are needed"))
+        elif rms_dbfs < MIN_RMS_DBFS:
+            problems.append(("silent", f"the recording is almost silent ({rms_dbfs:.0f} dBFS)"))
+        elif snr_db < MIN_CONTRAST_DB:
+            problems.append(("no_speech", "no speech stands out of the background"))
+        elif snr_db < MIN_SNR_DB:
+            problems.append(("noisy", f"the background noise is nearly as loud as the speech ({snr_db:.1f} dB)"))
+        elif speech_ratio < MIN_SPEECH_RATIO:
+            problems.append(("no_speech", "no speech stands out of the background"))
+        if clipping_rate > MAX_CLIPPING_RATE:
+            problems.append(("clipped", f"{clipping_rate:.1%} of the samples are clipped: the input level is too high"))
+        return {
+            "ok": not problems,
+            "problems": [{"code": code, "message": message} for code, message in problems],
+            "duration": round(duration, 3),
+            "rms_dbfs": round(rms_dbfs, 1),
+            "speech_ratio": round(speech_ratio, 3),
+            "clipping_rate": round(clipping_rate, 4),
+            "snr_db": round(snr_db, 1),
+        }
+
+
+# Silence trimming (see trim_silence). OPENPRONOUNCE_TRIM_SILENCE=1 trims the
+# recordings of compare_audio_with_text by default; the server trims unless it is 0.
+TRIM_SILENCE = os.environ.get("OPENPRONOUNCE_TRIM_SILENCE", "")
+# Shortest run of speech frames that counts as speech (a click or a breath is shorter).
+TRIM_MIN_SPEECH = 0.05
+# Kept before the first and after the last speech frame, in seconds.
+TRIM_PADDING = 0.2
+
+
+def trim_enabled(default=False):
+    """Whether ``OPENPRONOUNCE_TRIM_SILENCE`` asks for silence trimming (``default`` when unset)."""
+    if not TRIM_SILENCE:
+        return default
+    return TRIM_SILENCE.lower() not in ("0", "off", "false", "no")
+
+
+class Trimmed(NamedTuple):
+    """A recording without its leading and trailing silence: ``waveform[start:end]`` of the original."""
+    waveform: np.ndarray
+    start: int
+    end: int
+
+
+def trim_silence(waveform, sr=TARGET_SR):
+    """Cut the silence before the first and after the last run of speech frames, keeping
+    ``TRIM_PADDING`` seconds on each side.
+
+    Speech frames are found as in :func:`assess_quality`. The returned waveform is a view
+    of ``waveform``; ``start`` maps its samples (and the frames of the models run on it)
+    back to the original recording. A recording without speech is returned whole.
+    """
+    waveform = np.asarray(waveform, dtype=np.float32)
+    with tracing.span("trim", frames=len(waveform) // 320) as span:
+        _, speech = _speech_frames(waveform, sr)
+        frame, hop, padding = int(QUALITY_FRAME * sr), int(QUALITY_HOP * sr), int(TRIM_PADDING * sr)
+        run = max(1, int(round(TRIM_MIN_SPEECH / QUALITY_HOP)))
+        onsets = np.flatnonzero(np.convolve(speech, np.ones(run, dtype=int), "valid") == run)
+        if not len(onsets):
+            return Trimmed(waveform, 0, len(waveform))
+        start = max(0, int(onsets[0]) * hop - padding)
+        end = min(len(waveform), (int(onsets[-1]) + run - 1) * hop + frame + padding)
+        span.set(trimmed=round((len(waveform) - (end - start)) / sr, 3))
+        return Trimmed(waveform[start:end], start, end)
+
+
 def webm2wav(file_path):
     """Convert a browser-recorded file (webm/ogg/wav/...) to a 16 kHz mono ``*.16k.wav`` file next to it."""
     output_path = os.path.splitext(file_path)[0] + ".16k.wav"
@@ -80,19 +244,32 @@ def text2speech(text, lang="en", filename=None, target_sr=TARGET_SR, *, backend=
     ``(backend, voice, lang, text)`` so that repeated comparisons against the same
     sentence are free.
     """
-    backend, voice = tts.resolve(lang, backend=backend, voice=voice)
-    if filename is None:
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        key = hashlib.sha1(
-            f"{backend}\x00{voice}\x00{lang}\x00{target_sr}\x00{text}".encode("utf-8")
-        ).hexdigest()
-        filename = os.path.join(CACHE_DIR, f"tts-{key}.wav")
-        if os.path.exists(filename):
-            return filename
+    with tracing.span("reference_tts") as span:
+        backend, voice = tts.resolve(lang, backend=backend, voice=voice)
+        cached = filename is None
+        if cached:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            key = hashlib.sha1(
+                f"{backend}\x00{voice}\x00{lang}\x00{target_sr}\x00{text}".encode("utf-8")
+            ).hexdigest()
+            filename = os.path.join(CACHE_DIR, f"tts-{key}.wav")
+            if os.path.exists(filename):
+                metrics.CACHE.inc(cache="tts", result="hit")
+                span.set(cache_hit=True)
+                return filename
+            metrics.CACHE.inc(cache="tts", result="miss")
+        span.set(cache_hit=False)
 
-    logger.info("Synthesizing reference with %s (voice %s, lang %s)", backend, voice, lang)
-    waveform, sr = tts.synthesize(text, lang, backend, voice)
-    if sr != target_sr:
-        waveform = librosa.resample(waveform, orig_sr=sr, target_sr=target_sr)
-    sf.write(filename, waveform, target_sr)
-    return filename
+        logger.info("Synthesizing reference with %s (voice %s, lang %s)", backend, voice, lang)
+        waveform, sr = tts.synthesize(text, lang, backend, voice)
+        if sr != target_sr:
+            waveform = librosa.resample(waveform, orig_sr=sr, target_sr=target_sr)
+        if not cached:
+            sf.write(filename, waveform, target_sr)
+            return filename
+        # Write then rename, so that another process synthesizing the same sentence never
+        # reads a half-written reference from the cache.
+        partial = f"{filename}.{os.getpid()}.{threading.get_ident()}.part"
+        sf.write(partial, waveform, target_sr, format="WAV")
+        os.replace(partial, filename)
+        return filename
@@ -0,0 +1,103 @@
+"""In-process cache of the analysis stages that only depend on the audio.
+
+The learner embeddings, the word transcription, the phone recognition and the prosody
+of a recording do not depend on the expected text. A learner retrying a recording
+against a corrected prompt, or a QA tool scoring one recording against several
+candidate texts, gets them from here; only phonemization, the comparisons, the
+reference voice and the DTW run again. The embeddings of a synthesized reference are
+cached the same way, so a repeated sentence also skips its reference embeddings.
+
+Entries are keyed by :func:`fingerprint` (a hash of the samples, their dtype and the
+sampling rate), the stage and the model that produced them, and evicted least recently
+used first once they take more than ``OPENPRONOUNCE_AUDIO_CACHE_MB`` (default 256;
+``0`` disables the cache). Cached values are shared between analyses: callers must
+not modify them.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from . import metrics
+
+AUDIO_CACHE_MB = float(os.environ.get("OPENPRONOUNCE_AUDIO_CACHE_MB", "256"))
+
+
+def fingerprint(waveform, sampling_rate):
+    """Hash of a waveform: equal for the same samples at the same rate, whatever array holds them."""
+    waveform = np.ascontiguousarray(waveform)
+    digest = hashlib.blake2b(f"{waveform.dtype.str}\x00{waveform.shape}\x00{sampling_rate}\x00".encode(),
+                             digest_size=16)
+    digest.update(memoryview(waveform).cast("B"))
+    return digest.hexdigest()
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value) + 8 * len(value)
+    return 64
+
+
+class AudioCache:
+    """Thread-safe LRU mapping ``(stage, key)`` to a value, bounded by the bytes of its values."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, stage, key):
+        """``(True, value)`` if cached, else ``(False, None)``; counted in ``openpronounce_cache_requests_total``."""
+        with self._lock:
+            entry = self._entries.get((stage, key))
+            if entry is not None:
+                self._entries.move_to_end((stage, key))
+        metrics.CACHE.inc(cache=f"audio_{stage}", result="miss" if entry is None else "hit")
+        return (False, None) if entry is None else (True, entry[0])
+
+    def put(self, stage, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop((stage, key), None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            self._entries[(stage, key)] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+_cache = AudioCache(int(AUDIO_CACHE_MB * 1024 * 1024))
+
+
+def get(stage, key):
+    """Look ``key`` up among the ``stage`` results of the process-wide cache: ``(hit, value)``."""
+    return _cache.get(stage, key)
+
+
+def put(stage, key, value):
+    _cache.put(stage, key, value)
+
+
+def clear():
+    """Forget every cached result (after swapping a model in place, in tests)."""
+    _cache.clear()
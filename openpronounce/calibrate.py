@@ -0,0 +1,340 @@
+"""Refit the score constants on human ratings: ``openpronounce calibrate results.csv``.
+
+The score (:func:`openpronounce.speech.compute_pronunciation_score`) combines three
+components with :data:`~openpronounce.speech.SCORE_WEIGHTS`, the acoustic one mapped
+linearly from ``Language.acoustic_good`` (100) to a "bad" distance (0). Given the
+components of many rated attempts (a CSV with ``acoustic_distance``,
+``phoneme_error_rate``, ``word_error_rate`` and a human score column, as written by
+``benchmarks/speechocean762.py``), this module searches a grid of weights and bounds for
+the best Spearman correlation with the human scores, then cross-validates the choice.
+
+Everything is vectorized: the scores of a chunk of grid points are one broadcast array,
+sorted once along the attempts and ranked within the whole set and every
+cross-validation half from that sort, and the Spearman correlations of the whole chunk
+come from one product with the centred ranks of the human scores.
+"""
+
+import argparse
+import csv
+import sys
+from typing import NamedTuple
+
+import numpy as np
+
+COMPONENTS = ("acoustic_distance", "phoneme_error_rate", "word_error_rate")
+# Default grid: weights on a 0.1 step (summing to 1), "good" distance 3..14, "bad" 12..24.
+WEIGHT_STEP = 0.1
+GOOD = tuple(float(g) for g in range(3, 15))
+BAD = tuple(float(b) for b in range(12, 25))
+# Grid points scored together; bounds the memory to CHUNK x attempts float32 values.
+CHUNK = 512
+
+
+class Grid(NamedTuple):
+    """Grid points as parallel arrays: ``weights`` (n, 3: acoustic, phonemes, words), ``good``, ``bad``."""
+    weights: np.ndarray
+    good: np.ndarray
+    bad: np.ndarray
+
+    def __len__(self):
+        return len(self.good)
+
+    def point(self, i):
+        """``((w_acoustic, w_phonemes, w_words), good, bad)`` of the ``i``-th point, as plain floats."""
+        return tuple(round(float(w), 3) for w in self.weights[i]), float(self.good[i]), float(self.bad[i])
+
+    def find(self, point):
+        """Index of ``((w_acoustic, w_phonemes, w_words), good, bad)`` in the grid (``ValueError`` if absent)."""
+        weights, good, bad = point
+        match = (np.isclose(self.weights, weights).all(axis=1) & np.isclose(self.good, good)
+                 & np.isclose(self.bad, bad))
+        if not match.any():
+            raise ValueError(f"{point} is not in the grid")
+        return int(np.argmax(match))
+
+
+def make_grid(goods=GOOD, bads=BAD, step=WEIGHT_STEP, extra=(), span=None):
+    """Every weight triple on ``step`` with every ``good < bad`` pair, plus the ``extra`` points.
+
+    With ``span``, the pairs are ``(good, good + span)`` instead (``bads`` is ignored). The
+    bounds do not matter without acoustic weight, so those triples get a single pair.
+    """
+    n = round(1 / step)
+    triples = [(round(a * step, 6), round(p * step, 6), round((n - a - p) * step, 6))
+               for a in range(n + 1) for p in range(n + 1 - a)]
+    bounds = [(g, g + span) for g in goods] if span else [(g, b) for g in goods for b in bads if g < b]
+    points = [(w, g, b) for w in triples for g, b in (bounds if w[0] > 0 else bounds[:1])]
+    points += [(tuple(w), g, b) for w, g, b in extra if (tuple(w), g, b) not in points]
+    return Grid(np.array([p[0] for p in points], dtype=np.float64),
+                np.array([p[1] for p in points], dtype=np.float64),
+                np.array([p[2] for p in points], dtype=np.float64))
+
+
+def scores(components, grid):
+    """Scores of every attempt at every grid point, ``(len(grid), attempts)`` float32.
+
+    ``components`` is the ``(acoustic_distance, phoneme_error_rate, word_error_rate)``
+    arrays; same formula as :func:`openpronounce.speech.compute_pronunciation_score`.
+    """
+    distance, per, wer = (np.asarray(c, dtype=np.float32) for c in components)
+    good = grid.good.astype(np.float32)[:, None]
+    bad = grid.bad.astype(np.float32)[:, None]
+    acoustic = np.clip(100 * (1 - (distance - good) / (bad - good)), 0, 100)
+    phonemes = np.clip(100 * (1 - per), 0, 100)
+    words = np.clip(100 * (1 - wer), 0, 100)
+    w = grid.weights.astype(np.float32)
+    return np.clip(w[:, :1] * acoustic + w[:, 1:2] * phonemes + w[:, 2:] * words, 0, 100)
+
+
+def rankdata(a):
+    """Ranks along the last axis, ties getting their average rank (``scipy.stats.rankdata`` per row)."""
+    a = np.asarray(a)
+    rows = a.reshape(-1, a.shape[-1])
+    ties = _sort(rows)
+    ranks = np.empty(rows.shape, dtype=np.float64)
+    np.put_along_axis(ranks, ties[0], _ranks_among(ties, np.ones(rows.shape[1], dtype=bool))[0] / 2, axis=1)
+    return ranks.reshape(a.shape)
+
+
+def _sort(rows):
+    """Sort order of every row, with the first and last sorted position of the tie group of each position."""
+    n = rows.shape[1]
+    order = np.argsort(rows, axis=1)
+    ordered = np.take_along_axis(rows, order, axis=1)
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    ends = np.ones(ordered.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+    positions = np.arange(n)
+    group_start = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+    group_end = np.minimum.accumulate(np.where(ends, positions, n)[:, ::-1], axis=1)[:, ::-1]
+    return order, group_start, group_end
+
+
+def _ranks_among(ties, member):
+    """Twice the ranks, in sorted order, among the columns where ``member`` is true; and the sorted membership.
+
+    The members of a tie group share the average of the ranks they take:
+    ``(before + 1 + through) / 2``, with ``before`` and ``through`` the numbers of members
+    up to the group's start and end. Twice that is an integer. Non-members get a
+    meaningless value.
+    """
+    order, group_start, group_end = ties
+    in_subset = member[order]
+    count = np.cumsum(in_subset, axis=1, dtype=np.int32)
+    before = np.take_along_axis(count, group_start, axis=1) - np.take_along_axis(in_subset, group_start, axis=1)
+    through = np.take_along_axis(count, group_end, axis=1)
+    before += through
+    before += 1
+    return before, in_subset
+
+
+def _centred(ranks):
+    ranks = ranks - ranks.mean(axis=-1, keepdims=True)
+    norm = np.sqrt(np.sum(ranks * ranks, axis=-1, keepdims=True))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return ranks / norm
+
+
+def spearman(x, y):
+    """Spearman correlation of every row of ``x`` (..., n) with ``y`` (n); NaN for a constant row."""
+    return _centred(rankdata(x)) @ _centred(rankdata(y))
+
+
+def grid_spearman(components, human, grid, subsets=None, chunk=CHUNK):
+    """Spearman correlation with ``human`` of the scores at every grid point.
+
+    Returns a ``(len(grid),)`` array, or ``(len(subsets), len(grid))`` with ``subsets``
+    (index arrays of the attempts, e.g. cross-validation folds): the correlation is then
+    computed within each subset.
+
+    The scores of a chunk of grid points are sorted once for all the subsets, and the
+    correlations are computed in sorted order: the centred human ranks of a subset are
+    spread over all the attempts (zero outside the subset) and gathered in each row's
+    order, and the mean rank of ``m`` members is always ``(m + 1) / 2``.
+    """
+    human = np.asarray(human, dtype=np.float64)
+    n = len(human)
+    groups = [np.arange(n)] if subsets is None else [np.asarray(g) for g in subsets]
+    members, targets = [], []
+    for g in groups:
+        member = np.zeros(n, dtype=bool)
+        member[g] = True
+        target = np.zeros(n, dtype=np.float32)
+        target[g] = _centred(rankdata(human[g]))
+        members.append(member)
+        targets.append(target)
+    out = np.empty((len(groups), len(grid)))
+    for start in range(0, len(grid), chunk):
+        part = Grid(*(a[start:start + chunk] for a in grid))
+        ties = _sort(scores(components, part))
+        for k, (member, target) in enumerate(zip(members, targets)):
+            ranks, in_subset = _ranks_among(ties, member)
+            ranks -= member.sum() + 1  # centred, times two: the scale cancels out
+            ranks *= in_subset
+            ranks = ranks.astype(np.float32)
+            norm = np.sqrt(np.einsum("ij,ij->i", ranks, ranks, dtype=np.float64))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out[k, start:start + chunk] = np.einsum("ij,ij->i", ranks, target[ties[0]], dtype=np.float64) / norm
+    return out[0] if subsets is None else out
+
+
+def folds(n, splits=3, seed=0):
+    """Two-fold splits of ``n`` attempts, ``splits`` times: ``[(train, test), ...]``, both halves each way."""
+    out = []
+    for k in range(splits):
+        perm = np.random.RandomState(seed + k).permutation(n)
+        out.append((perm[: n // 2], perm[n // 2:]))
+        out.append((perm[n // 2:], perm[: n // 2]))
+    return out
+
+
+def cross_validate(components, human, grid, splits=3, seed=0, points=()):
+    """Spearman of every grid point on all the attempts, and cross-validated on :func:`folds`.
+
+    Returns ``{"full", "tuned", "held_out"}``: ``full`` is :func:`grid_spearman` on all the
+    attempts, ``tuned`` the held-out Spearman of the best point of each training half (one
+    value per fold), and ``held_out`` maps the grid index of those points, of the best
+    point overall and of ``points`` to their held-out Spearman on every fold.
+
+    The whole grid is scored on all the attempts and on the training halves in one pass;
+    only the points of ``held_out`` are scored on the held-out halves.
+    """
+    pairs = folds(len(human), splits, seed)
+    rho = grid_spearman(components, human, grid, [np.arange(len(human))] + [train for train, _ in pairs])
+    full, train = rho[0], rho[1:]
+    best = [int(i) for i in np.nanargmax(train, axis=1)]
+    keep = sorted({*best, int(np.nanargmax(full)), *(int(i) for i in points)})
+    test = grid_spearman(components, human, Grid(*(a[keep] for a in grid)), [test for _, test in pairs])
+    held_out = {i: [float(v) for v in test[:, k]] for k, i in enumerate(keep)}
+    return {"full": full, "tuned": [held_out[i][k] for k, i in enumerate(best)], "held_out": held_out}
+
+
+def current_constants(lang="en"):
+    """The score constants in use: ``((w_acoustic, w_phonemes, w_words), good, bad)``."""
+    from .languages import get_language
+    from .speech import ACOUSTIC_DISTANCE_SPAN, SCORE_WEIGHTS
+
+    good = get_language(lang).acoustic_good
+    weights = (SCORE_WEIGHTS["acoustic"], SCORE_WEIGHTS["phonemes"], SCORE_WEIGHTS["words"])
+    return weights, good, good + ACOUSTIC_DISTANCE_SPAN
+
+
+def load_results(path, human="human_total", lang=None):
+    """``(components, human scores)`` arrays from a CSV of rated attempts.
+
+    Rows with a missing value are skipped; with ``lang``, so are rows whose ``lang``
+    column (when there is one) names another language.
+    """
+    columns = [[] for _ in COMPONENTS]
+    target = []
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        missing = [c for c in (*COMPONENTS, human) if c not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"{path} has no column {', '.join(missing)}")
+        for row in reader:
+            if lang and row.get("lang", lang) != lang:
+                continue
+            values = [row[c] for c in (*COMPONENTS, human)]
+            if "" in values:
+                continue
+            for column, value in zip(columns, values):
+                column.append(float(value))
+            target.append(float(values[-1]))
+    if len(target) < 4:
+        raise ValueError(f"{path}: {len(target)} usable rows, calibration needs more")
+    return tuple(np.array(c) for c in columns), np.array(target)
+
+
+def calibrate(components, human, grid=None, lang="en", splits=3, seed=0, top=10):
+    """Grid search and cross-validation of the score constants against ``human``.
+
+    Returns ``{"n", "best", "current", "top", "cv"}``: the points are
+    ``{"weights", "good", "bad", "spearman"}`` dicts; ``cv`` has the mean held-out
+    Spearman of the tuned constants (``tuned``), of the best point (``best``) and of the
+    current ones (``current``), with the per-fold values.
+    """
+    current = current_constants(lang)
+    grid = grid if grid is not None else make_grid(extra=[current])
+    current_index = grid.find(current)
+    cv = cross_validate(components, human, grid, splits, seed, points=[current_index])
+    rho = cv["full"]
+    order = np.argsort(-np.nan_to_num(rho, nan=-np.inf), kind="stable")
+
+    def described(i):
+        weights, good, bad = grid.point(i)
+        return {"weights": dict(zip(("acoustic", "phonemes", "words"), weights)), "good": good, "bad": bad,
+                "spearman": round(float(rho[i]), 4)}
+
+    def mean_of(values):
+        return {"mean": round(float(np.mean(values)), 4), "folds": [round(float(v), 4) for v in values]}
+
+    return {
+        "n": len(human),
+        "best": described(order[0]),
+        "current": described(current_index),
+        "top": [described(i) for i in order[:top]],
+        "cv": {"tuned": mean_of(cv["tuned"]), "best": mean_of(cv["held_out"][order[0]]),
+               "current": mean_of(cv["held_out"][current_index])},
+    }
+
+
+def _range(text):
+    start, _, stop = text.partition(":")
+    return tuple(float(v) for v in np.arange(float(start), float(stop or start) + 1e-9, 1.0))
+
+
+def main(argv=None):
+    import json
+
+    from .languages import DEFAULT_LANGUAGE, LANGUAGES
+
+    parser = argparse.ArgumentParser(
+        prog="openpronounce calibrate",
+        description="Refit SCORE_WEIGHTS and Language.acoustic_good on rated attempts (Spearman with the ratings).",
+    )
+    parser.add_argument("csv", help="CSV with acoustic_distance, phoneme_error_rate, word_error_rate and HUMAN columns")
+    parser.add_argument("--human", default="human_total", help="column of the human score (default: %(default)s)")
+    parser.add_argument("--lang", default=DEFAULT_LANGUAGE, choices=sorted(LANGUAGES),
+                        help="language of the attempts, for its current acoustic_good (default: %(default)s)")
+    parser.add_argument("--good", type=_range, default=GOOD, metavar="MIN:MAX",
+                        help="acoustic 'good' distances to try, step 1 (default 3:14)")
+    parser.add_argument("--bad", type=_range, default=BAD, metavar="MIN:MAX",
+                        help="acoustic 'bad' distances to try, step 1 (default 12:24)")
+    parser.add_argument("--keep-span", action="store_true",
+                        help="only try bad = good + ACOUSTIC_DISTANCE_SPAN, to refit acoustic_good of one language")
+    parser.add_argument("--step", type=float, default=WEIGHT_STEP, help="weight step (default %(default)s)")
+    parser.add_argument("--splits", type=int, default=3, help="two-fold cross-validation splits (default 3)")
+    parser.add_argument("--top", type=int, default=10, help="best grid points to list (default 10)")
+    parser.add_argument("--json", action="store_true", help="print the full JSON result instead of a summary")
+    args = parser.parse_args(argv)
+
+    try:
+        components, human = load_results(args.csv, args.human, args.lang)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    current = current_constants(args.lang)
+    grid = make_grid(args.good, args.bad, args.step, extra=[current],
+                     span=current[2] - current[1] if args.keep_span else None)
+    result = calibrate(components, human, grid, lang=args.lang, splits=args.splits, top=args.top)
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0
+
+    print(f"{result['n']} attempts, {len(grid)} grid points, Spearman with {args.human}:")
+    print(f"{'spearman':>9} {'acoustic':>8} {'phonemes':>8} {'words':>6} {'good':>5} {'bad':>5}")
+    for point in result["top"] + [result["current"]]:
+        w = point["weights"]
+        print(f"{point['spearman']:9.4f} {w['acoustic']:8.2f} {w['phonemes']:8.2f} {w['words']:6.2f} "
+              f"{point['good']:5.1f} {point['bad']:5.1f}" + ("  <- current" if point is result["current"] else ""))
+    cv = result["cv"]
+    print(f"\nCross-validation ({2 * args.splits} held-out halves), mean Spearman: tuned on each half "
+          f"{cv['tuned']['mean']:.3f}, best point {cv['best']['mean']:.3f}, current {cv['current']['mean']:.3f}")
+    best = result["best"]
+    print(f"\nSCORE_WEIGHTS = {best['weights']}")
+    print(f"Language({args.lang!r}).acoustic_good = {best['good']:g} (span {best['bad'] - best['good']:g}; "
+          f"ACOUSTIC_DISTANCE_SPAN is shared by all languages)")
+    return 0
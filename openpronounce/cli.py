@@ -1,4 +1,9 @@
-"""Command-line entry point: ``openpronounce <audio> "<expected text>"``."""
+"""Command-line entry point: ``openpronounce <audio> "<expected text>"``.
+
+``openpronounce calibrate results.csv`` refits the score constants instead (see
+:mod:`openpronounce.calibrate`), ``openpronounce rescore artifacts/`` scores saved
+attempts again (see :mod:`openpronounce.rescore`).
+"""
 
 import argparse
 import json
@@ -8,6 +13,15 @@ from .languages import DEFAULT_LANGUAGE, LANGUAGES
 
 
 def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["calibrate"]:
+        from . import calibrate
+
+        return calibrate.main(argv[1:])
+    if argv[:1] == ["rescore"]:
+        from . import rescore
+
+        return rescore.main(argv[1:])
     parser = argparse.ArgumentParser(
         prog="openpronounce",
         description="Score the pronunciation of a recording against the sentence it should contain.",
@@ -18,12 +32,32 @@ def main(argv=None):
                         help="language of the sentence (default: %(default)s)")
     parser.add_argument("--json", action="store_true", help="print the full JSON result instead of a summary")
     parser.add_argument("--no-prosody", action="store_true", help="omit prosody contours from the JSON output")
+    parser.add_argument("--phones-only", action="store_true",
+                        help="skip the word transcription model, estimate the words from the recognized phones")
+    parser.add_argument("--passage", action="store_true",
+                        help="long read-aloud: TEXT is a file (or a text) of several sentences, scored one by one")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write the timing of every stage to FILE as a Chrome trace (chrome://tracing, Perfetto)")
     args = parser.parse_args(argv)
 
+    if args.trace:
+        from . import tracing
+
+        with tracing.collect() as spans:
+            status = _run(args)
+        tracing.write_chrome_trace(spans, args.trace)
+        return status
+    return _run(args)
+
+
+def _run(args):
     from . import audio, speech
 
     sound = audio.load(args.audio)
-    result = speech.compare_audio_with_text(sound, args.text, lang=args.lang)
+    if args.passage:
+        return _passage(sound, args)
+    use_asr = False if args.phones_only else None
+    result = speech.compare_audio_with_text(sound, args.text, lang=args.lang, use_asr=use_asr)
 
     if args.no_prosody:
         result.pop("prosody", None)
@@ -49,5 +83,33 @@ def main(argv=None):
     return 0
 
 
+def _passage(sound, args):
+    import os
+
+    from . import passage
+
+    text = args.text
+    if os.path.isfile(text):
+        with open(text, encoding="utf-8") as f:
+            text = f.read()
+    results = []
+    for sentence in passage.iter_passage(sound, text, lang=args.lang):
+        results.append(sentence)
+        if args.no_prosody:
+            sentence["result"].pop("prosody", None)
+        if not args.json:
+            words = ", ".join(sentence["result"]["differences"]["words_with_errors"]) or "-"
+            print(f"[{sentence['start']:7.2f}s] {sentence['result']['score']:5.1f}  {sentence['text']}  ({words})")
+    result = passage.summarize_passage(results, args.lang)
+
+    if args.json:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return 0
+
+    print(f"Passage score: {result['score']}/100 ({len(results)} sentences)")
+    return 0
+
+
 if __name__ == "__main__":
     sys.exit(main())
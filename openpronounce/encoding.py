@@ -0,0 +1,129 @@
+"""Shaping an analysis result for the wire: field selection, contour downsampling, compact encodings.
+
+A full result carries the pitch and energy contours at frame rate and the DTW-aligned
+phoneme traces, all as lists of floats: tens of kilobytes of JSON for a ten-second
+clip, most of which a client that only shows the score never reads.
+
+- :func:`select_fields` keeps the dotted paths a client asks for (``score,differences.errors``).
+- :func:`downsample_prosody` averages the contours down to a fixed number of points.
+- :func:`encode` serializes to plain JSON, to JSON with the numeric arrays packed as
+  base64 float16 (:data:`COMPACT_JSON`), or to MessagePack with single-precision floats
+  (:data:`MSGPACK`, needs the ``msgpack`` package).
+"""
+
+import base64
+import json
+
+import numpy as np
+
+JSON = "application/json"
+COMPACT_JSON = "application/vnd.openpronounce.compact+json"
+MSGPACK = "application/msgpack"
+MEDIA_TYPES = (JSON, COMPACT_JSON, MSGPACK, "application/x-msgpack")
+
+# The numeric arrays of a result, as dotted paths.
+ARRAY_FIELDS = ("prosody.f0", "prosody.energy", "differences.expected_vector", "differences.transcribed_vector")
+# float16 represents every integer up to 2048 exactly, and 0-300 Hz or 0-250 energy to ~0.1.
+FLOAT16_MAX = 2048
+
+
+def select_fields(result, fields):
+    """Return the parts of ``result`` named in ``fields`` (dotted paths, a list or a comma-separated string).
+
+    ``score`` keeps the top-level score, ``differences.errors`` keeps only the errors of
+    ``differences``, ``prosody`` keeps both contours. Raises ``ValueError`` for a path
+    that is not in the result.
+    """
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(",")]
+    selected = {}
+    for path in filter(None, fields):
+        keys = path.split(".")
+        source, target = result, selected
+        for depth, key in enumerate(keys):
+            if not isinstance(source, dict) or key not in source:
+                raise ValueError(f"unknown field {path!r}")
+            source = source[key]
+            if depth == len(keys) - 1:
+                target[key] = source
+            else:
+                target = target.setdefault(key, {})
+    return selected
+
+
+def downsample(values, points):
+    """Average ``values`` over ``points`` equal bins (unchanged when it is not longer than that)."""
+    values = np.asarray(values, dtype=float)
+    if points <= 0:
+        raise ValueError("points must be positive")
+    if len(values) <= points:
+        return values
+    edges = np.linspace(0, len(values), points + 1).astype(int)
+    return np.add.reduceat(values, edges[:-1]) / np.diff(edges)
+
+
+def downsample_prosody(result, points):
+    """Return ``result`` with ``prosody.f0`` and ``prosody.energy`` averaged down to ``points`` values each."""
+    if "prosody" not in result:
+        return result
+    prosody = {key: downsample(values, points).tolist() if key in ("f0", "energy") else values
+               for key, values in result["prosody"].items()}
+    return {**result, "prosody": prosody}
+
+
+def _pack_array(values):
+    array = np.asarray(values, dtype=np.float32)
+    dtype = "float16" if not len(array) or np.abs(array).max() <= FLOAT16_MAX else "float32"
+    return {"dtype": dtype, "shape": list(array.shape),
+            "data": base64.b64encode(array.astype("<f2" if dtype == "float16" else "<f4").tobytes()).decode("ascii")}
+
+
+def unpack_array(packed):
+    """Decode an array packed by the compact JSON encoding back to a NumPy array."""
+    dtype = "<f2" if packed["dtype"] == "float16" else "<f4"
+    return np.frombuffer(base64.b64decode(packed["data"]), dtype=dtype).astype(np.float32).reshape(packed["shape"])
+
+
+def _map_arrays(result, fn):
+    """Copy ``result`` with ``fn`` applied to each of the :data:`ARRAY_FIELDS` it contains."""
+    out = dict(result)
+    for path in ARRAY_FIELDS:
+        parent_key, key = path.split(".")
+        parent = out.get(parent_key)
+        if isinstance(parent, dict) and key in parent:
+            if parent is result.get(parent_key):
+                parent = out[parent_key] = dict(parent)
+            parent[key] = fn(parent[key])
+    return out
+
+
+def negotiate(accept):
+    """Pick the media type for an ``Accept`` header: the first of :data:`MEDIA_TYPES` it lists, else JSON."""
+    for item in (accept or "").split(","):
+        media_type = item.split(";")[0].strip().lower()
+        if media_type in MEDIA_TYPES:
+            if media_type == "application/x-msgpack":
+                media_type = MSGPACK
+            if media_type != MSGPACK or _msgpack() is not None:
+                return media_type
+    return JSON
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def encode(result, media_type=JSON):
+    """Serialize ``result`` as ``media_type`` (one of :data:`MEDIA_TYPES`). Returns bytes."""
+    if media_type == COMPACT_JSON:
+        return json.dumps(_map_arrays(result, _pack_array), separators=(",", ":")).encode()
+    if media_type in (MSGPACK, "application/x-msgpack"):
+        msgpack = _msgpack()
+        if msgpack is None:
+            raise RuntimeError("MessagePack needs the msgpack package: pip install msgpack")
+        return msgpack.packb(result, use_single_float=True)
+    return json.dumps(result, separators=(",", ":"), ensure_ascii=False).encode()
@@ -0,0 +1,79 @@
+"""Windowed Wav2Vec2 inference: constant peak memory whatever the length of the recording.
+
+Wav2Vec2 attends over the whole input, so feeding a five-minute upload in one pass
+needs memory quadratic in its length. :func:`run_windowed` instead runs the model on
+fixed-size windows that overlap their neighbours, keeps the centre of each window
+(where the model saw enough context on both sides) and stitches the frame outputs back
+into one sequence. Recordings shorter than a window go through in a single pass, as before.
+
+``OPENPRONOUNCE_CHUNK_SECONDS`` sets the window (``0`` disables windowing) and
+``OPENPRONOUNCE_CHUNK_OVERLAP`` the audio shared by two consecutive windows.
+"""
+
+import os
+
+import torch
+
+from .device import get_device
+
+SAMPLING_RATE = 16000
+# Samples per output frame of the Wav2Vec2 feature encoder (20 ms at 16 kHz).
+FRAME_STRIDE = 320
+
+CHUNK_SECONDS = float(os.environ.get("OPENPRONOUNCE_CHUNK_SECONDS", "30"))
+CHUNK_OVERLAP = float(os.environ.get("OPENPRONOUNCE_CHUNK_OVERLAP", "2"))
+
+
+def windows(n_samples, window, overlap):
+    """Split ``n_samples`` into ``(start, end, keep_start, keep_end)`` sample ranges.
+
+    The model runs on ``start:end``; the frames of ``keep_start:keep_end`` are kept.
+    Kept ranges are consecutive and cover the whole input; every window has at least
+    ``overlap / 2`` of context on each side of its kept range (except at the edges of the
+    recording) and at most ``window`` samples. Window starts are multiples of :data:`FRAME_STRIDE`.
+    """
+    context = int(overlap / 2) // FRAME_STRIDE * FRAME_STRIDE
+    window = int(window) // FRAME_STRIDE * FRAME_STRIDE
+    step = window - 2 * context
+    if step <= 0:
+        raise ValueError(f"chunk window ({window} samples) must be longer than the overlap ({2 * context} samples)")
+    if n_samples <= window:
+        return [(0, n_samples, 0, n_samples)]
+    out = []
+    keep_start = 0
+    while keep_start < n_samples:
+        # The first window has no left context, so it keeps more.
+        keep_end = keep_start + (window - context if keep_start == 0 else step)
+        start = keep_start - context
+        if keep_end + context >= n_samples:
+            # Last window: give it a full window of left context rather than a short input.
+            keep_end = n_samples
+            start = min(start, -(-(n_samples - window) // FRAME_STRIDE) * FRAME_STRIDE)
+        out.append((max(0, start), min(n_samples, keep_end + context), keep_start, keep_end))
+        keep_start = keep_end
+    return out
+
+
+def run_windowed(forward, input_values, window=None, overlap=None, sampling_rate=SAMPLING_RATE):
+    """Run ``forward`` over ``input_values`` (``(1, samples)`` tensor) window by window.
+
+    ``forward`` maps a ``(1, samples)`` tensor on the model device to a ``(1, frames, dim)``
+    tensor (logits or hidden states). ``window`` and ``overlap`` are in seconds and default
+    to :data:`CHUNK_SECONDS` and :data:`CHUNK_OVERLAP`; a window of 0 runs the whole input
+    at once. Returns the stitched ``(1, frames, dim)`` tensor on the CPU, with as many
+    frames as a single pass would produce.
+    """
+    window = CHUNK_SECONDS if window is None else window
+    overlap = CHUNK_OVERLAP if overlap is None else overlap
+    device = get_device()
+    n_samples = input_values.shape[-1]
+    with torch.no_grad():
+        if window <= 0 or n_samples <= window * sampling_rate:
+            return forward(input_values.to(device)).cpu()
+        parts = []
+        for start, end, keep_start, keep_end in windows(n_samples, window * sampling_rate, overlap * sampling_rate):
+            frames = forward(input_values[:, start:end].to(device)).cpu()
+            first = (keep_start - start) // FRAME_STRIDE
+            last = None if keep_end == n_samples else (keep_end - start) // FRAME_STRIDE
+            parts.append(frames[:, first:last])
+        return torch.cat(parts, dim=1)
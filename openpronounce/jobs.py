@@ -0,0 +1,324 @@
+"""Asynchronous assessment jobs: a persistent queue for long or bulk analyses.
+
+A job is a list of items (a recording and its expected text), analysed in the
+background by :class:`JobRunner` while the client polls the job or streams its results.
+Jobs live in a SQLite database and the decoded recordings next to it, so a restart
+loses nothing. A running item is leased to the process analysing it, which renews the
+lease while it works; items whose lease ran out (their process died) are queued again,
+so several server processes can share the same directory.
+
+Jobs yield to interactive requests: every item is analysed in the ``batch`` lane of
+:mod:`openpronounce.scheduler`.
+
+``OPENPRONOUNCE_JOBS_DIR`` is where the database and the pending recordings are kept,
+``OPENPRONOUNCE_JOB_WORKERS`` the number of items analysed at the same time and
+``OPENPRONOUNCE_JOB_LEASE`` how long, in seconds, a running item stays leased without
+a renewal.
+"""
+
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from . import audio, passage, scheduler, speech
+from .languages import DEFAULT_LANGUAGE
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.environ.get("OPENPRONOUNCE_JOBS_DIR", os.path.join(audio.CACHE_DIR, "jobs"))
+JOB_WORKERS = int(os.environ.get("OPENPRONOUNCE_JOB_WORKERS", "1"))
+JOB_LEASE = float(os.environ.get("OPENPRONOUNCE_JOB_LEASE", "60"))
+MODES = ("sentence", "passage")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    lang TEXT NOT NULL,
+    mode TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    started REAL,
+    finished REAL,
+    owner TEXT,
+    lease_until REAL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+"""
+
+
+class JobStore:
+    """Jobs and their items in a SQLite database under ``directory``, recordings as ``.npy`` files.
+
+    The items this store claims are leased for ``lease`` seconds (see :meth:`renew`).
+    """
+
+    def __init__(self, directory=None, lease=None):
+        self.directory = directory or JOBS_DIR
+        self.lease = JOB_LEASE if lease is None else lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, "jobs.sqlite")
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(items)")}
+            for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:  # a database of an earlier version
+                    conn.execute(f"ALTER TABLE items ADD COLUMN {column} {kind}")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _audio_path(self, job_id, index):
+        return os.path.join(self.directory, job_id, f"{index}.npy")
+
+    def create(self, items, lang=DEFAULT_LANGUAGE, mode="sentence"):
+        """Queue a job of ``items`` (``(waveform, text)`` pairs, 16 kHz). Returns its id."""
+        if mode not in MODES:
+            raise ValueError(f"unknown mode {mode!r}, expected one of: {', '.join(MODES)}")
+        if not items:
+            raise ValueError("a job needs at least one recording")
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.directory, job_id))
+        for index, (waveform, _) in enumerate(items):
+            np.save(self._audio_path(job_id, index), np.asarray(waveform, dtype=np.float32))
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, created, lang, mode) VALUES (?, ?, ?, ?)",
+                         (job_id, time.time(), lang, mode))
+            conn.executemany("INSERT INTO items (job_id, idx, text, status) VALUES (?, ?, ?, 'pending')",
+                             [(job_id, index, text) for index, (_, text) in enumerate(items)])
+        return job_id
+
+    def get(self, job_id):
+        """Return the job's status and per-item progress, or ``None`` for an unknown id."""
+        with self._connect() as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            items = conn.execute("SELECT idx, status, result, error, started, finished FROM items "
+                                 "WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+        counts = {status: sum(item["status"] == status for item in items)
+                  for status in ("pending", "running", "done", "failed")}
+        if counts["done"] + counts["failed"] == len(items):
+            status = "done"
+        elif counts["pending"] == len(items):
+            status = "queued"
+        else:
+            status = "running"
+        return {
+            "id": job_id,
+            "status": status,
+            "created": job["created"],
+            "lang": job["lang"],
+            "mode": job["mode"],
+            "total": len(items),
+            **counts,
+            "items": [{
+                "index": item["idx"],
+                "status": item["status"],
+                "score": json.loads(item["result"])["score"] if item["result"] else None,
+                "error": item["error"],
+                "seconds": round(item["finished"] - item["started"], 2) if item["finished"] else None,
+            } for item in items],
+        }
+
+    def results(self, job_id):
+        """Return the finished items of ``job_id`` (``index``, ``text``, ``status``, ``result`` or ``error``)."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT idx, text, status, result, error FROM items WHERE job_id = ? "
+                                "AND status IN ('done', 'failed') ORDER BY idx", (job_id,)).fetchall()
+        out = []
+        for row in rows:
+            item = {"index": row["idx"], "text": row["text"], "status": row["status"]}
+            if row["result"] is not None:
+                item["result"] = json.loads(row["result"])
+            else:
+                item["error"] = row["error"]
+            out.append(item)
+        return out
+
+    def claim(self):
+        """Lease the oldest pending item to this store and return it, or ``None`` when the queue is empty.
+
+        The item is a ``(job_id, index, text, lang, mode, waveform)`` tuple. An item whose
+        recording cannot be read is marked failed and the next one is claimed.
+        """
+        while True:
+            row = self._claim_row()
+            if row is None:
+                return None
+            try:
+                waveform = np.load(self._audio_path(row["job_id"], row["idx"]))
+            except Exception as e:  # noqa: BLE001 - recorded on the item, the job goes on
+                logger.exception("job %s item %d: recording unreadable", row["job_id"], row["idx"])
+                self.finish(row["job_id"], row["idx"], error=f"recording unreadable: {e}")
+                continue
+            return row["job_id"], row["idx"], row["text"], row["lang"], row["mode"], waveform
+
+    def _claim_row(self):
+        with self._lock, self._connect() as conn:
+            while True:
+                row = conn.execute("SELECT items.job_id, items.idx, items.text, jobs.lang, jobs.mode FROM items "
+                                   "JOIN jobs ON jobs.id = items.job_id WHERE items.status = 'pending' "
+                                   "ORDER BY jobs.created, items.idx LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                # Another server process may have taken it since the SELECT.
+                now = time.time()
+                claimed = conn.execute("UPDATE items SET status = 'running', started = ?, owner = ?, lease_until = ? "
+                                       "WHERE job_id = ? AND idx = ? AND status = 'pending'",
+                                       (now, self.owner, now + self.lease, row["job_id"], row["idx"])).rowcount
+                if claimed:
+                    return row
+
+    def finish(self, job_id, index, result=None, error=None):
+        """Record the result (or the error) of an item and drop its recording."""
+        with self._connect() as conn:
+            conn.execute("UPDATE items SET status = ?, result = ?, error = ?, finished = ?, lease_until = NULL "
+                         "WHERE job_id = ? AND idx = ?",
+                         ("failed" if error else "done", None if error else json.dumps(result), error, time.time(),
+                          job_id, index))
+            left = conn.execute("SELECT COUNT(*) FROM items WHERE job_id = ? AND status IN ('pending', 'running')",
+                                (job_id,)).fetchone()[0]
+        try:
+            os.remove(self._audio_path(job_id, index))
+        except OSError:
+            pass
+        if not left:
+            shutil.rmtree(os.path.join(self.directory, job_id), ignore_errors=True)
+
+    def release(self, job_id, index):
+        """Give an item this store is running back to the queue, as if it had never been claimed."""
+        with self._connect() as conn:
+            conn.execute("UPDATE items SET status = 'pending', started = NULL, owner = NULL, lease_until = NULL "
+                         "WHERE job_id = ? AND idx = ? AND status = 'running' AND owner = ?",
+                         (job_id, index, self.owner))
+
+    def renew(self):
+        """Extend the lease of the items this store is running. Returns how many."""
+        with self._connect() as conn:
+            return conn.execute("UPDATE items SET lease_until = ? WHERE status = 'running' AND owner = ?",
+                                (time.time() + self.lease, self.owner)).rowcount
+
+    def requeue_expired(self):
+        """Put back in the queue the running items whose lease ran out (their process died). Returns how many."""
+        with self._connect() as conn:
+            return conn.execute("UPDATE items SET status = 'pending', started = NULL, owner = NULL, lease_until = NULL "
+                                "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                                (time.time(),)).rowcount
+
+
+def analyze_item(waveform, text, lang, mode, trim_silence=None):
+    """Analyse one job item: :func:`speech.compare_audio_with_text`, or :func:`passage.assess_passage`.
+
+    ``trim_silence`` applies to sentence items; the segments of a passage are already cut
+    around their sentence (see :data:`passage.SEGMENT_PADDING`) and are not trimmed again.
+    """
+    if mode == "passage":
+        return passage.assess_passage(waveform, text, lang=lang)
+    return speech.compare_audio_with_text(waveform, text, lang=lang, trim_silence=trim_silence)
+
+
+class JobRunner:
+    """Background threads that analyse the queued items of ``store``, one at a time each.
+
+    ``analyze(waveform, text, lang, mode)`` defaults to :func:`analyze_item`.
+    """
+
+    def __init__(self, store, workers=None, analyze=None, poll_interval=1.0):
+        self.store = store
+        self.workers = JOB_WORKERS if workers is None else workers
+        self.analyze = analyze
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        targets = [(self._run, f"openpronounce-job-{n}") for n in range(self.workers)]
+        for target, name in targets + [(self._keep_leases, "openpronounce-job-leases")]:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def notify(self):
+        """Wake the workers up (a job was just queued)."""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_one(self):
+        """Analyse the next pending item in a ``batch`` slot of the scheduler. Returns ``False`` if there is none."""
+        claimed = self.store.claim()
+        if claimed is None:
+            return False
+        job_id, index, text, lang, mode, waveform = claimed
+        result = error = None
+        try:
+            with scheduler.get_scheduler().slot("batch"):
+                result = (self.analyze or analyze_item)(waveform, text, lang, mode)
+        except Exception as e:  # noqa: BLE001 - recorded on the item, the job goes on
+            logger.exception("job %s item %d failed", job_id, index)
+            error = str(e) or type(e).__name__
+        try:
+            self.store.finish(job_id, index, result=result, error=error)
+        except Exception:
+            # Not recorded: queue it again rather than leave it running, its lease renewed forever.
+            self.store.release(job_id, index)
+            raise
+        return True
+
+    def _keep_leases(self):
+        """Renew the leases of the running items, and queue again the items of processes that died."""
+        while True:
+            try:
+                self.store.renew()
+                requeued = self.store.requeue_expired()
+            except Exception:  # noqa: BLE001 - try again at the next renewal
+                logger.exception("job lease renewal failed")
+                requeued = 0
+            if requeued:
+                logger.info("requeued %d job items whose process stopped", requeued)
+                self.notify()
+            if self._stop.wait(self.store.lease / 3):
+                return
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                busy = self.run_one()
+            except Exception:  # noqa: BLE001 - keep the worker alive (database locked, disk full...)
+                logger.exception("job worker error")
+                busy = False
+            if not busy:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
@@ -0,0 +1,205 @@
+"""Prometheus metrics: where the time of an analysis goes, cache efficiency, models and queues.
+
+The stages of the pipeline report to :mod:`openpronounce.tracing`, which this module
+listens to once :func:`observe_stages` is called (by the server, at startup), so the
+latency histograms split an analysis into decode, embeddings, reference TTS, reference
+embeddings, DTW, ASR, phone recognition, phone comparison and prosody, whether it came
+from a request or a job. Elsewhere the spans cost nothing. :func:`render`
+writes every metric in the Prometheus text format (version 0.0.4), which
+``GET /metrics`` serves; the format is simple enough that the ``prometheus_client``
+package is not needed.
+
+Metrics are per process: with several server workers, scrape each of them.
+"""
+
+import threading
+
+from . import tracing
+
+# Seconds, from a cached lookup to a long passage.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+_models = {}
+_models_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A count that only goes up, per combination of labels."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a count kept elsewhere (the statistics of an ``lru_cache``)."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, per combination of labels."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Observations counted in cumulative ``buckets``, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return counts[-1]
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key, (("le", _format_value(bound)),), count))
+                samples.append((f"{self.name}_sum", key, (), total))
+                samples.append((f"{self.name}_count", key, (), counts[-1]))
+        return samples
+
+
+STAGE_SECONDS = Histogram("openpronounce_stage_seconds", "Time spent in each stage of the analysis pipeline.",
+                          ("stage",))
+REQUESTS = Counter("openpronounce_requests_total", "HTTP requests by endpoint, language and status code.",
+                   ("endpoint", "lang", "status"))
+REQUEST_SECONDS = Histogram("openpronounce_request_seconds", "HTTP request latency by endpoint.", ("endpoint",))
+CACHE = Counter("openpronounce_cache_requests_total", "Cache lookups by cache and result (hit or miss).",
+                ("cache", "result"))
+MODELS_LOADED = Gauge("openpronounce_models_loaded", "Number of models loaded in this process.")
+MODEL_BYTES = Gauge("openpronounce_model_bytes", "Memory taken by the parameters and buffers of a loaded model.",
+                    ("model", "device"))
+QUEUE_DEPTH = Gauge("openpronounce_queue_depth", "Requests waiting for an inference slot, per priority lane.",
+                    ("priority",))
+INFERENCE_RUNNING = Gauge("openpronounce_inference_running", "Analyses holding an inference slot, per priority lane.",
+                          ("priority",))
+
+
+def _observe_stage(span):
+    STAGE_SECONDS.observe(span.duration, stage=span.name)
+
+
+def observe_stages(enabled=True):
+    """Record (or stop recording) the duration of every pipeline stage in :data:`STAGE_SECONDS`."""
+    if enabled and _observe_stage not in tracing._hooks:
+        tracing.add_hook(_observe_stage)
+    elif not enabled and _observe_stage in tracing._hooks:
+        tracing.remove_hook(_observe_stage)
+
+
+def register_model(name, model):
+    """Report ``model`` (a torch module) as loaded under ``name``; called by the model loaders."""
+    with _models_lock:
+        _models[name] = model
+
+
+def _model_bytes(model):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors), str(tensors[0].device) if tensors else "cpu"
+
+
+def _collect():
+    """Refresh the metrics whose values live elsewhere: lexicon caches, loaded models, scheduler queues."""
+    from . import phones, scheduler, speech
+
+    for name, cache in (("lexicon", speech._phonemize_word), ("expected_phones", phones._expected_phones_by_word)):
+        info = cache.cache_info()
+        CACHE.set_total(info.hits, cache=name, result="hit")
+        CACHE.set_total(info.misses, cache=name, result="miss")
+
+    with _models_lock:
+        models = dict(_models)
+    MODELS_LOADED.set(len(models))
+    MODEL_BYTES.clear()
+    for name, model in models.items():
+        size, device = _model_bytes(model)
+        MODEL_BYTES.set(size, model=name, device=device)
+
+    for priority, lane in scheduler.get_scheduler().stats()["classes"].items():
+        QUEUE_DEPTH.set(lane["queued"], priority=priority)
+        INFERENCE_RUNNING.set(lane["running"], priority=priority)
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    _collect()
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
@@ -0,0 +1,227 @@
+"""Long-passage assessment: split the text into sentences, locate them in the audio, score them in parallel.
+
+A one-to-three-minute read-aloud is too long for a single :func:`openpronounce.speech.compare_audio_with_text`
+call: Wav2Vec2 attention grows quadratically with the recording and the DTW against the
+reference reading becomes huge. Instead, the expected phones of the whole passage are
+force-aligned (CTC Viterbi) on the posteriors of the phone model, which gives the frame
+range of every sentence; each sentence is then cut out and scored on its own, several
+at a time.
+"""
+
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from . import phones, speech, tracing
+from .inference import FRAME_STRIDE
+from .languages import DEFAULT_LANGUAGE, get_language
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+
+# Sentences scored at the same time. Each one runs the Wav2Vec2 models on a few seconds
+# of audio; torch releases the GIL, so threads are enough.
+PASSAGE_WORKERS = int(os.environ.get("OPENPRONOUNCE_PASSAGE_WORKERS", "2"))
+# Audio kept before the first and after the last phone of the passage, in seconds.
+# Between two sentences, the silence is split in the middle.
+SEGMENT_PADDING = 0.25
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?;…])\s+|\n\s*")
+_WORD_RE = re.compile(r"\b[\w']+\b")
+
+
+def split_sentences(text):
+    """Split ``text`` into sentences on final punctuation and line breaks, dropping those without words."""
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text)]
+    return [s for s in sentences if _WORD_RE.search(s)]
+
+
+def ctc_forced_align(log_posteriors, targets, blank_id=0):
+    """Viterbi CTC alignment of ``targets`` in ``log_posteriors`` (frames x vocab).
+
+    ``targets`` is a sequence of labels, each a tuple of the token ids that may stand
+    for it (a normalized phone can come from several tokens); a label scores the best
+    of its tokens on every frame. Returns the ``(start, end)`` frame range of every
+    label, or ``None`` when no alignment exists (fewer frames than the targets need).
+    """
+    log_posteriors = np.asarray(log_posteriors, dtype=np.float64)
+    n_frames, n_labels = len(log_posteriors), len(targets)
+    if not n_labels:
+        return []
+    if not n_frames:
+        return None
+    n_states = 2 * n_labels + 1
+    emissions = np.empty((n_frames, n_states))
+    emissions[:, 0::2] = log_posteriors[:, [blank_id]]
+    for k, ids in enumerate(targets):
+        emissions[:, 2 * k + 1] = log_posteriors[:, list(ids)].max(axis=1)
+    # A label can be entered straight from the previous label (skipping the blank in
+    # between) unless both are the same token, which CTC would collapse.
+    can_skip = np.zeros(n_states, dtype=bool)
+    can_skip[3::2] = [targets[k] != targets[k - 1] for k in range(1, n_labels)]
+
+    score = np.full(n_states, -np.inf)
+    score[:2] = emissions[0, :2]
+    backpointers = np.zeros((n_frames, n_states), dtype=np.int8)
+    states = np.arange(n_states)
+    candidates = np.full((3, n_states), -np.inf)
+    for t in range(1, n_frames):
+        candidates[0] = score
+        candidates[1, 1:] = score[:-1]
+        candidates[2, 2:] = np.where(can_skip[2:], score[:-2], -np.inf)
+        step = candidates.argmax(axis=0)
+        score = candidates[step, states] + emissions[t]
+        backpointers[t] = step
+
+    state = n_states - 1 if score[-1] >= score[-2] else n_states - 2
+    if not np.isfinite(score[state]):
+        return None
+    path = np.empty(n_frames, dtype=np.int64)
+    for t in range(n_frames - 1, -1, -1):
+        path[t] = state
+        state -= backpointers[t, state]
+
+    spans = []
+    for k in range(n_labels):
+        frames = np.flatnonzero(path == 2 * k + 1)
+        spans.append((int(frames[0]), int(frames[-1]) + 1))
+    return spans
+
+
+def _proportional_bounds(weights, n_frames):
+    """Split ``n_frames`` into consecutive ranges proportional to ``weights``."""
+    edges = np.concatenate([[0], np.cumsum(np.maximum(weights, 1))])
+    edges = np.round(edges / edges[-1] * n_frames).astype(int)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:])]
+
+
+def locate_sentences(audio_waveform, sentences, sampling_rate=SAMPLING_RATE, lang=DEFAULT_LANGUAGE):
+    """Return the ``(start, end)`` sample range of every sentence of ``sentences`` in ``audio_waveform``.
+
+    The expected phones of all the sentences are force-aligned on the phone model
+    posteriors. Silence between two sentences is split in the middle, and the first and
+    last sentences get :data:`SEGMENT_PADDING` of context. Phones the model has no token
+    for are skipped; when the alignment is impossible, the audio is split in proportion
+    to the number of phones of each sentence.
+    """
+    lang = get_language(lang).code
+    processor, _ = phones._load_model()
+    log_posteriors = phones.phone_log_posteriors(audio_waveform, sampling_rate)
+    token_ids = phones._token_ids_by_phone(phones.phone_vocab(), lang)
+    n_frames = len(log_posteriors)
+
+    targets, owners = [], []
+    for index, sentence in enumerate(sentences):
+        _, groups = phones.get_expected_phones(sentence, lang)
+        for phone in (p for g in groups for p in g):
+            if phone in token_ids:
+                targets.append(tuple(token_ids[phone]))
+                owners.append(index)
+
+    spans = ctc_forced_align(log_posteriors, targets, processor.tokenizer.pad_token_id)
+    counts = np.bincount(owners, minlength=len(sentences))
+    if spans is None or not targets:
+        logger.warning("forced alignment failed on %d frames, splitting the passage proportionally", n_frames)
+        frame_bounds = _proportional_bounds(counts, n_frames)
+    else:
+        frame_bounds = []
+        for index in range(len(sentences)):
+            own = [span for span, owner in zip(spans, owners) if owner == index]
+            frame_bounds.append((own[0][0], own[-1][1]) if own else None)
+        # A sentence without alignable phones takes the gap between its neighbours.
+        for index, bounds in enumerate(frame_bounds):
+            if bounds is None:
+                before = next((b[1] for b in reversed(frame_bounds[:index]) if b is not None), 0)
+                after = next((b[0] for b in frame_bounds[index + 1:] if b is not None), n_frames)
+                frame_bounds[index] = (before, max(before, after))
+
+    padding = int(SEGMENT_PADDING * sampling_rate)
+    bounds = [(start * FRAME_STRIDE, end * FRAME_STRIDE) for start, end in frame_bounds]
+    out = []
+    for index, (start, end) in enumerate(bounds):
+        if index > 0:
+            start = (bounds[index - 1][1] + start) // 2
+        else:
+            start = max(0, start - padding)
+        if index + 1 < len(bounds):
+            end = (end + bounds[index + 1][0]) // 2
+        else:
+            end = min(len(audio_waveform), end + padding)
+        out.append((start, max(start, end)))
+    return out
+
+
+def iter_passage(audio_waveform, text_reference, sampling_rate=SAMPLING_RATE, lang=DEFAULT_LANGUAGE,
+                 workers=None):
+    """Score every sentence of ``text_reference`` in ``audio_waveform``, yielding results as they complete.
+
+    Yields one dict per sentence, in completion order: ``index`` (position of the
+    sentence in the passage), ``text``, ``start`` and ``end`` (seconds) and ``result``
+    (the output of :func:`openpronounce.speech.compare_audio_with_text` on that segment).
+    ``workers`` sentences are scored at the same time (default :data:`PASSAGE_WORKERS`).
+    """
+    lang = get_language(lang).code
+    sentences = split_sentences(text_reference)
+    if not sentences:
+        return
+    bounds = locate_sentences(audio_waveform, sentences, sampling_rate, lang)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers or PASSAGE_WORKERS), thread_name_prefix="passage")
+    try:
+        futures = {
+            tracing.submit(pool, speech.compare_audio_with_text, audio_waveform[start:end], sentence, sampling_rate,
+                           lang=lang): index
+            for index, (sentence, (start, end)) in enumerate(zip(sentences, bounds))
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            start, end = bounds[index]
+            yield {
+                "index": index,
+                "text": sentences[index],
+                "start": round(start / sampling_rate, 3),
+                "end": round(end / sampling_rate, 3),
+                "result": future.result(),
+            }
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def summarize_passage(sentence_results, lang=DEFAULT_LANGUAGE):
+    """Aggregate per-sentence results (from :func:`iter_passage`, any order) into a passage result.
+
+    The passage ``score`` is the mean of the sentence scores weighted by their number
+    of words; ``differences.errors`` lists the errors of every sentence in reading
+    order, each with the ``sentence`` index it belongs to.
+    """
+    sentence_results = sorted(sentence_results, key=lambda s: s["index"])
+    weights = [max(1, len(_WORD_RE.findall(s["text"]))) for s in sentence_results]
+    scores = [s["result"]["score"] for s in sentence_results]
+    score = round(float(np.average(scores, weights=weights)), 2) if scores else 0.0
+
+    errors, words_with_errors = [], []
+    for s in sentence_results:
+        for error in s["result"]["differences"]["errors"]:
+            errors.append(dict(error, sentence=s["index"]))
+        words_with_errors.extend(s["result"]["differences"]["words_with_errors"])
+    words_with_errors = list(dict.fromkeys(words_with_errors))
+    feedback = speech._feedback(words_with_errors)
+
+    return {
+        "score": score,
+        "language": get_language(lang).code,
+        "differences": {"errors": errors, "words_with_errors": words_with_errors, "feedback": feedback},
+        "feedback": feedback,
+        "sentences": sentence_results,
+    }
+
+
+def assess_passage(audio_waveform, text_reference, sampling_rate=SAMPLING_RATE, lang=DEFAULT_LANGUAGE,
+                   workers=None):
+    """Assess a long read-aloud passage sentence by sentence. See :func:`iter_passage` and :func:`summarize_passage`."""
+    results = list(iter_passage(audio_waveform, text_reference, sampling_rate, lang, workers))
+    return summarize_passage(results, lang)
@@ -6,9 +6,12 @@ words without going through a word transcription (which silently "corrects" what
 the learner said).
 """
 
+import hashlib
+import io
 import logging
 import os
 import re
+import threading
 from functools import lru_cache
 from typing import NamedTuple
 
@@ -18,8 +21,9 @@ import torch
 from phonemizer import phonemize
 from phonemizer.separator import Separator
 
+from . import metrics, tracing
 from .device import get_device
-
+from .inference import FRAME_STRIDE, run_windowed
 from .languages import DEFAULT_LANGUAGE, get_language
 
 logger = logging.getLogger(__name__)
@@ -43,6 +47,11 @@ FINAL_DELETION_COST = 0.5
 # something else is not a confident error (Goodness-of-Pronunciation style); the
 # confidence decreases linearly from 1 (posterior 0) to 0 (posterior at this value).
 PHONE_PLAUSIBLE_POSTERIOR = 0.05
+# Without the word ASR (phones-only mode), a word counts as misread for the word error
+# rate when nothing is heard for it or when its phones are further than this share of
+# its length from every accepted pronunciation; the word model would map closer
+# attempts to the right word.
+WORD_MISREAD_THRESHOLD = 0.5
 
 # Recognizer tokens that are not phones of any supported language: Mandarin tone
 # numbers, aspiration marks and two-letter spellings of English diphthongs.
@@ -125,14 +134,24 @@ def is_enabled():
     return PHONE_MODEL_NAME not in ("", "0", "off", "false", "no")
 
 
-@lru_cache(maxsize=1)
+_load_lock = threading.Lock()
+
+
 def _load_model():
+    """Load the phone recognizer's processor and model on first use (cached, thread-safe)."""
+    with _load_lock:
+        return _load_checkpoint()
+
+
+@lru_cache(maxsize=1)
+def _load_checkpoint():
     from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 
     logger.info("Loading %s", PHONE_MODEL_NAME)
     processor = Wav2Vec2Processor.from_pretrained(PHONE_MODEL_NAME)
     model = Wav2Vec2ForCTC.from_pretrained(PHONE_MODEL_NAME).to(get_device())
     model.eval()
+    metrics.register_model(PHONE_MODEL_NAME, model)
     return processor, model
 
 
@@ -181,6 +200,66 @@ class PhoneRecognition(NamedTuple):
     log_posteriors: np.ndarray
     vocab: tuple
 
+    def to_bytes(self):
+        """Compact serialization: a compressed ``.npz`` with the log posteriors as float16 and a vocabulary id.
+
+        The vocabulary itself is not included; :func:`register_vocab` (or the ``vocab``
+        argument of :meth:`from_bytes`) provides it when reading.
+        """
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **self.to_arrays())
+        return buffer.getvalue()
+
+    def to_arrays(self):
+        """The arrays of :meth:`to_bytes`, to store next to other arrays in one file."""
+        return {
+            "phones": np.array(self.phones, dtype=str),
+            "confidences": np.asarray(self.confidences, dtype=np.float32),
+            "spans": np.asarray(self.spans, dtype=np.int32).reshape(-1, 2),
+            "log_posteriors": np.asarray(self.log_posteriors, dtype=np.float16),
+            "vocab_id": np.array(register_vocab(self.vocab)),
+        }
+
+    @classmethod
+    def from_bytes(cls, data, vocab=None):
+        """Inverse of :meth:`to_bytes`. ``ValueError`` if the vocabulary is unknown and not given."""
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls.from_arrays(arrays, vocab)
+
+    @classmethod
+    def from_arrays(cls, arrays, vocab=None):
+        vocab_id = str(arrays["vocab_id"])
+        if vocab is None:
+            vocab = _vocabs.get(vocab_id)
+            if vocab is None:
+                raise ValueError(f"unknown phone vocabulary {vocab_id}: pass it or register it with register_vocab()")
+        elif vocab_id_of(vocab) != vocab_id:
+            raise ValueError(f"the recognition was decoded with vocabulary {vocab_id}, not {vocab_id_of(vocab)}")
+        return cls(
+            [str(p) for p in arrays["phones"]],
+            [float(c) for c in arrays["confidences"]],
+            [(int(start), int(end)) for start, end in arrays["spans"]],
+            arrays["log_posteriors"].astype(np.float32),
+            tuple(vocab),
+        )
+
+
+# Phone vocabularies by id, to read serialized recognitions (see PhoneRecognition.to_bytes).
+_vocabs = {}
+
+
+def vocab_id_of(vocab):
+    """Short stable id of a phone vocabulary (tokens indexed by id)."""
+    return hashlib.sha1("\x00".join(vocab).encode("utf-8")).hexdigest()[:12]
+
+
+def register_vocab(vocab):
+    """Make ``vocab`` known to :meth:`PhoneRecognition.from_bytes`; returns its id."""
+    vocab = tuple(vocab)
+    vocab_id = vocab_id_of(vocab)
+    _vocabs.setdefault(vocab_id, vocab)
+    return vocab_id
+
 
 def _is_special(token):
     return token.startswith("<") and token.endswith(">")
@@ -217,12 +296,14 @@ def decode_ctc(log_posteriors, vocab, blank_id=0, lang=DEFAULT_LANGUAGE, normali
 
 
 def phone_log_posteriors(audio_waveform, sampling_rate=SAMPLING_RATE):
-    """Frame-level log posteriors of the phone model for a waveform, as a ``(frames, vocab)`` numpy array."""
+    """Frame-level log posteriors of the phone model for a waveform, as a ``(frames, vocab)`` numpy array.
+
+    Long recordings are processed in overlapping windows (see :mod:`openpronounce.inference`).
+    """
     processor, model = _load_model()
     inputs = processor(audio_waveform, sampling_rate=sampling_rate, return_tensors="pt", padding=True)
-    with torch.no_grad():
-        logits = model(inputs.input_values.to(get_device())).logits[0]
-    return torch.log_softmax(logits.float(), dim=-1).cpu().numpy()
+    logits = run_windowed(lambda x: model(x).logits, inputs.input_values)[0]
+    return torch.log_softmax(logits.float(), dim=-1).numpy()
 
 
 @lru_cache(maxsize=1)
@@ -235,9 +316,84 @@ def phone_vocab():
 
 def recognize_phones(audio_waveform, sampling_rate=SAMPLING_RATE, normalize=True, lang=DEFAULT_LANGUAGE):
     """Recognize the phones of a 16 kHz waveform with their confidences and frame posteriors."""
-    processor, _ = _load_model()
-    log_posteriors = phone_log_posteriors(audio_waveform, sampling_rate)
-    return decode_ctc(log_posteriors, phone_vocab(), processor.tokenizer.pad_token_id, lang, normalize)
+    with tracing.span("phone_recognition", frames=len(audio_waveform) // FRAME_STRIDE):
+        processor, _ = _load_model()
+        log_posteriors = phone_log_posteriors(audio_waveform, sampling_rate)
+        return decode_ctc(log_posteriors, phone_vocab(), processor.tokenizer.pad_token_id, lang, normalize)
+
+
+class StreamingRecognizer:
+    """Incremental phone recognition of a recording that is still being made.
+
+    Audio is appended with :meth:`feed`. :meth:`update` runs the phone model on the
+    trailing window only: ``context`` seconds of audio already decoded, then everything
+    after it. Frames further than ``lookahead`` seconds from the end of the audio will
+    not change much any more and are committed; the others are tentative and recomputed
+    on the next update. Each update therefore costs a bounded amount of compute, and
+    :meth:`finish` only has the last ``lookahead + step`` seconds left to decode once the
+    speaker stops.
+    """
+
+    def __init__(self, lang=DEFAULT_LANGUAGE, context=2.0, lookahead=1.0, step=0.5, sampling_rate=SAMPLING_RATE):
+        self.lang = lang
+        self.sampling_rate = sampling_rate
+        self.context = int(context * sampling_rate) // FRAME_STRIDE * FRAME_STRIDE
+        self.lookahead = int(lookahead * sampling_rate) // FRAME_STRIDE * FRAME_STRIDE
+        self.step = int(step * sampling_rate)
+        self._chunks = []
+        self._n_samples = 0
+        self._decoded_samples = 0
+        self._committed = []
+        self._committed_samples = 0
+        self._tentative = None
+
+    def feed(self, samples):
+        """Append 16 kHz mono samples. Returns ``True`` when enough new audio arrived for an :meth:`update`."""
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(samples):
+            self._chunks.append(samples)
+            self._n_samples += len(samples)
+        return self._n_samples - self._decoded_samples >= self.step
+
+    def _audio(self):
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0] if self._chunks else np.zeros(0, dtype=np.float32)
+
+    def _run(self, final):
+        audio_waveform = self._audio()
+        end = len(audio_waveform)
+        start = max(0, self._committed_samples - self.context)
+        # The model needs at least one frame worth of audio (400 samples receptive field).
+        if end - start < 2 * FRAME_STRIDE:
+            return
+        log_posteriors = phone_log_posteriors(audio_waveform[start:end], self.sampling_rate)
+        first = (self._committed_samples - start) // FRAME_STRIDE
+        commit_until = end if final else max(self._committed_samples, end - self.lookahead)
+        last = len(log_posteriors)
+        if not final:
+            last = min(last, first + (commit_until - self._committed_samples) // FRAME_STRIDE)
+        self._committed.append(log_posteriors[first:last])
+        self._committed_samples += (last - first) * FRAME_STRIDE
+        self._tentative = log_posteriors[last:]
+        self._decoded_samples = end
+
+    def _recognition(self, frames):
+        processor, _ = _load_model()
+        log_posteriors = np.concatenate(frames) if frames else np.zeros((0, len(phone_vocab())), dtype=np.float32)
+        return decode_ctc(log_posteriors, phone_vocab(), processor.tokenizer.pad_token_id, self.lang)
+
+    def update(self):
+        """Decode the audio received so far; returns the current :class:`PhoneRecognition` (committed and tentative frames)."""
+        self._run(final=False)
+        tentative = [self._tentative] if self._tentative is not None else []
+        return self._recognition(self._committed + tentative)
+
+    def finish(self):
+        """Decode the remaining audio and return the :class:`PhoneRecognition` of the whole recording."""
+        self._run(final=True)
+        self._tentative = None
+        return self._recognition(self._committed)
 
 
 def transcribe_phones(audio_waveform, sampling_rate=SAMPLING_RATE, normalize=True, lang=DEFAULT_LANGUAGE,
@@ -459,6 +615,7 @@ def _word_reports(heard_phones, text_reference, lang=DEFAULT_LANGUAGE):
     return reports
 
 
+@tracing.span("phone_comparison")
 def compare_phones(heard_phones, text_reference, lang=DEFAULT_LANGUAGE):
     """Compare recognized phones with the phones expected for ``text_reference`` in ``lang``, word by word.
 
@@ -475,7 +632,10 @@ def compare_phones(heard_phones, text_reference, lang=DEFAULT_LANGUAGE):
     (same shape as the text-based errors: ``position``, ``word``, ``expected``,
     ``actual``, ``actual_word``, plus ``phone_distance``, ``confidence`` (0-1, how sure
     we are the word is mispronounced) and ``phones``, a per-phone list of
-    ``{expected, heard, confidence}``) and ``words_with_errors``.
+    ``{expected, heard, confidence}``) and ``words_with_errors``. ``word_error_rate`` and
+    ``heard_text`` estimate from the phones what a word transcription would give (misread
+    words over expected words, and the words heard right with ``/phones/`` for the
+    others), see :data:`WORD_MISREAD_THRESHOLD`.
     """
     _, heard, heard_confidences = _as_recognition(heard_phones)
     words, groups = get_expected_phones(text_reference, lang)
@@ -487,8 +647,17 @@ def compare_phones(heard_phones, text_reference, lang=DEFAULT_LANGUAGE):
 
     errors = []
     words_with_errors = []
-    for report in _word_reports(heard_phones, text_reference, lang):
+    heard_words = []
+    misread = 0
+    reports = _word_reports(heard_phones, text_reference, lang)
+    for report in reports:
         edits, length = report["weighted_edits"], len(report["expected"])
+        if report["actual"] and report["distance"] <= length * WORD_MISREAD_THRESHOLD:
+            heard_words.append(report["word"])
+        else:
+            misread += 1
+            if report["actual"]:
+                heard_words.append(f"/{''.join(report['actual'])}/")
         if report["distance"] and (edits / length >= PHONE_ERROR_THRESHOLD or edits >= PHONE_ERROR_MIN_EDITS):
             errors.append({
                 "position": report["position"],
@@ -509,4 +678,6 @@ def compare_phones(heard_phones, text_reference, lang=DEFAULT_LANGUAGE):
         "phone_error_rate": round(phone_error_rate, 4),
         "errors": errors,
         "words_with_errors": words_with_errors,
+        "word_error_rate": round(misread / max(1, len(reports)), 4),
+        "heard_text": " ".join(heard_words),
     }
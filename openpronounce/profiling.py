@@ -0,0 +1,103 @@
+"""Profile a single assessment on real traffic: Python and torch profiles written to disk.
+
+Set ``OPENPRONOUNCE_PROFILE_DIR`` to a directory, then send ``X-Profile: 1`` with a
+``POST /pronunciation``: that request runs under both :mod:`cProfile` and
+``torch.profiler``, and the reports are written to the directory, named after the time,
+the request id (``X-Request-ID``, or a generated one) and a hash of the input audio and
+text, so the same slow sentence can be found again:
+
+- ``<name>.prof``: the :mod:`cProfile` statistics (``python -m pstats``, snakeviz);
+- ``<name>.txt``: the hottest Python functions by cumulative and own time, then the
+  torch operators by CPU time;
+- ``<name>.torch.json``: the torch profile as a Chrome trace.
+
+cProfile only sees the thread it runs in, so a profiled analysis runs its stages one
+after the other (:func:`openpronounce.stages.sequential`), and one request is profiled
+at a time: a request asking for a profile while another one is being profiled runs
+normally. Without ``OPENPRONOUNCE_PROFILE_DIR`` the header is ignored.
+"""
+
+import cProfile
+import hashlib
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+from . import stages
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get("OPENPRONOUNCE_PROFILE_DIR", "")
+# Rows of each table of the text report.
+REPORT_ROWS = 40
+
+_lock = threading.Lock()
+
+
+def enabled():
+    return bool(PROFILE_DIR)
+
+
+def input_hash(audio_waveform, text=""):
+    """Short hash of a waveform and its expected text, to recognize the same input across reports."""
+    digest = hashlib.sha1(np.ascontiguousarray(audio_waveform, dtype=np.float32).tobytes())
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def _safe(tag):
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(tag))[:64]
+
+
+@contextmanager
+def profile(request_id, digest, directory=None):
+    """Profile the block with cProfile and torch.profiler and write the reports to ``directory``.
+
+    ``directory`` defaults to :data:`PROFILE_DIR`. Yields the path of the reports without
+    their extension, or ``None`` when another profile is running (the block then runs
+    unprofiled).
+    """
+    if not _lock.acquire(blocking=False):
+        logger.info("profile of request %s skipped: another request is being profiled", request_id)
+        yield None
+        return
+    try:
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{_safe(request_id)}-{_safe(digest)}")
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        python_profile = cProfile.Profile()
+        with stages.sequential(), torch.profiler.profile(activities=activities) as torch_profile:
+            python_profile.enable()
+            try:
+                yield stem
+            finally:
+                python_profile.disable()
+        _write_reports(stem, python_profile, torch_profile)
+        logger.info("profile of request %s written to %s.*", request_id, stem)
+    finally:
+        _lock.release()
+
+
+def _write_reports(stem, python_profile, torch_profile):
+    python_profile.dump_stats(f"{stem}.prof")
+    torch_profile.export_chrome_trace(f"{stem}.torch.json")
+    text = io.StringIO()
+    stats = pstats.Stats(python_profile, stream=text)
+    for order in ("cumulative", "tottime"):
+        text.write(f"=== Python, by {order} time ===\n")
+        stats.sort_stats(order).print_stats(REPORT_ROWS)
+    text.write("=== torch operators, by CPU time ===\n")
+    text.write(torch_profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=REPORT_ROWS))
+    text.write("\n")
+    with open(f"{stem}.txt", "w", encoding="utf-8") as f:
+        f.write(text.getvalue())
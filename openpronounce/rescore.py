@@ -0,0 +1,176 @@
+"""Re-score saved attempts without the models: ``openpronounce rescore artifacts/``.
+
+The score of an attempt depends on three model outputs (the phone recognition, the word
+transcription and the acoustic distance to the reference voice) and on rules applied to
+them: :func:`openpronounce.phones.compare_phones` (``PHONE_ERROR_THRESHOLD``,
+``NEAR_PHONE_COST``, ``ALTERNATE_PRONUNCIATIONS``...), the word comparison and
+:func:`openpronounce.speech.compute_pronunciation_score`. ``compare_audio_with_text(...,
+artifacts=path)`` saves the model outputs to a compressed ``.npz`` (a few kB per
+attempt, the log posteriors as float16); :func:`rescore` applies the current rules to
+them again, so a rule change is evaluated on every stored attempt in the time it takes
+to align phones, without audio or models.
+
+A recording trimmed of its silence (``trim_silence``) was analysed from sample
+``offset`` on: frame ``f`` of the phone recognition starts at sample
+``offset + f * FRAME_STRIDE`` of the original recording.
+
+The phone vocabulary is written once per directory (``vocab-<id>.json``) rather than in
+every file. The server saves the artifacts of every ``/pronunciation`` request when
+``OPENPRONOUNCE_ARTIFACTS_DIR`` is set.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from . import phones, speech
+
+ARTIFACTS_DIR = os.environ.get("OPENPRONOUNCE_ARTIFACTS_DIR") or None
+# Bumped when the content of the artifacts changes.
+FORMAT_VERSION = 2
+
+
+def save(path, text, lang, acoustic_distance, distance, transcription, recognition=None, score=None, offset=0):
+    """Write the model outputs of one attempt to ``path`` (``.npz``), atomically."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    meta = {
+        "version": FORMAT_VERSION,
+        "text": text,
+        "lang": lang,
+        "acoustic_distance": float(acoustic_distance),
+        "distance": int(distance),
+        "transcription": transcription,
+        "score": score,
+        "offset": int(offset),
+    }
+    arrays = {"meta": np.array(json.dumps(meta, ensure_ascii=False))}
+    if recognition is not None:
+        arrays.update({f"recognition_{k}": v for k, v in recognition.to_arrays().items()})
+        _save_vocab(directory, recognition.vocab)
+    partial = f"{path}.{os.getpid()}.part"
+    with open(partial, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(partial, path)
+
+
+def _save_vocab(directory, vocab):
+    vocab_path = os.path.join(directory, f"vocab-{phones.register_vocab(vocab)}.json")
+    if not os.path.exists(vocab_path):
+        partial = f"{vocab_path}.{os.getpid()}.part"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump(list(vocab), f, ensure_ascii=False)
+        os.replace(partial, vocab_path)
+
+
+def load(path):
+    """Read an artifact file: its metadata dict, with the :class:`~openpronounce.phones.PhoneRecognition`
+    (or ``None``) under ``recognition``."""
+    with np.load(path) as arrays:
+        meta = json.loads(str(arrays["meta"]))
+        meta.setdefault("offset", 0)  # version 1: saved before silence trimming
+        if meta["version"] > FORMAT_VERSION:
+            raise ValueError(f"{path}: artifacts version {meta['version']} is newer than this version of openpronounce")
+        recognition = None
+        if "recognition_vocab_id" in arrays:
+            fields = {k[len("recognition_"):]: arrays[k] for k in arrays.files if k.startswith("recognition_")}
+            recognition = phones.PhoneRecognition.from_arrays(fields, _load_vocab(path, str(fields["vocab_id"])))
+    meta["recognition"] = recognition
+    return meta
+
+
+def _load_vocab(path, vocab_id):
+    vocab_path = os.path.join(os.path.dirname(os.path.abspath(path)), f"vocab-{vocab_id}.json")
+    if os.path.exists(vocab_path):
+        with open(vocab_path, encoding="utf-8") as f:
+            return tuple(json.load(f))
+    return None  # registered in this process, or a ValueError from from_arrays
+
+
+def rescore(artifacts):
+    """Score an attempt again from its artifacts (a path or the dict of :func:`load`) with the current rules.
+
+    Returns the result of :func:`~openpronounce.speech.compare_audio_with_text` without
+    ``prosody``, plus ``previous_score``: the score when the artifacts were saved.
+    """
+    if not isinstance(artifacts, dict):
+        artifacts = load(artifacts)
+    text, lang = artifacts["text"], artifacts["lang"]
+    differences = None  # phones-only analysis
+    if artifacts["transcription"] is not None:
+        differences = speech.compare_transcriptions(artifacts["transcription"], text, lang)
+    phone_result = None
+    if artifacts["recognition"] is not None:
+        phone_result = phones.compare_phones(artifacts["recognition"], text, lang)
+    result = speech._assemble(artifacts["acoustic_distance"], artifacts["distance"], differences, phone_result, lang)
+    result["previous_score"] = artifacts["score"]
+    return result
+
+
+def _paths(inputs):
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                yield from (os.path.join(root, name) for name in sorted(files) if name.endswith(".npz"))
+        else:
+            yield path
+
+
+def _rescore_path(path):
+    try:
+        result = rescore(path)
+    except Exception as e:  # noqa: BLE001 - one bad file must not stop a million
+        return {"path": path, "error": f"{type(e).__name__}: {e}"}
+    return {"path": path, "previous_score": result.pop("previous_score"), "score": result["score"], "result": result}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="openpronounce rescore",
+        description="Score saved attempts again with the current rules, without the models.",
+    )
+    parser.add_argument("paths", nargs="+", help="artifact files (.npz) or directories of them")
+    parser.add_argument("--out", help="write one JSON line per attempt (path, previous_score, score, result) to OUT")
+    parser.add_argument("--workers", type=int, default=1, help="processes (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    paths = list(_paths(args.paths))
+    if args.workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(args.workers)
+        rows = executor.map(_rescore_path, paths, chunksize=64)
+    else:
+        executor = None
+        rows = map(_rescore_path, paths)
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else None
+    changed = failed = 0
+    deltas = []
+    try:
+        for row in rows:
+            if out is not None:
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            if "error" in row:
+                failed += 1
+                print(f"{row['path']}: {row['error']}", file=sys.stderr)
+                continue
+            if row["previous_score"] is not None:
+                deltas.append(row["score"] - row["previous_score"])
+                changed += row["score"] != row["previous_score"]
+    finally:
+        if out is not None:
+            out.close()
+        if executor is not None:
+            executor.shutdown()
+
+    print(f"{len(paths)} attempts, {failed} failed, {changed} scores changed")
+    if deltas:
+        deltas = np.asarray(deltas, dtype=float)
+        print(f"score change: mean {deltas.mean():+.2f}, mean absolute {np.abs(deltas).mean():.2f}, "
+              f"min {deltas.min():+.0f}, max {deltas.max():+.0f}")
+    return 1 if failed else 0
@@ -0,0 +1,154 @@
+"""Results of recent analyses, so that a retried request costs no inference.
+
+Mobile clients on flaky networks send the same ``/pronunciation`` upload again when an
+answer gets lost. With ``OPENPRONOUNCE_RESULT_CACHE_MB`` set, the server keeps the
+results of the last analyses for ``OPENPRONOUNCE_RESULT_CACHE_TTL`` seconds (default
+600), keyed by :func:`analysis_key` (the decoded audio, the expected text, the language
+and everything else the result depends on: models, reference voice, thresholds and
+score constants) or by the client's ``Idempotency-Key`` header. An entry under an
+idempotency key keeps the :func:`payload_digest` of its request (upload, text,
+language): the same key sent with another payload is refused rather than answered with
+another request's result. A retry arriving while the first analysis is still running
+waits for that analysis instead of starting its own.
+
+The cache lives in the event loop of the server: :meth:`ResultCache.get_or_compute`
+is a coroutine and needs no lock.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from . import __version__, audiocache, metrics, phones, pitch, speech, tts
+from .languages import get_language
+
+RESULT_CACHE_MB = float(os.environ.get("OPENPRONOUNCE_RESULT_CACHE_MB", "0"))
+RESULT_CACHE_TTL = float(os.environ.get("OPENPRONOUNCE_RESULT_CACHE_TTL", "600"))
+
+
+def configuration(lang):
+    """What the result of an analysis in ``lang`` depends on, besides the audio and the text."""
+    backend, voice = tts.resolve(lang)
+    return {
+        "version": __version__,
+        "language": repr(get_language(lang)),
+        "models": [speech.MODEL_NAME, phones.PHONE_MODEL_NAME, phones.is_enabled()],
+        "tts": [backend, voice],
+        "pitch": pitch.PITCH_METHOD,
+        "speech": [speech.WORD_ERROR_THRESHOLD, speech.SCORE_WEIGHTS, speech.ACOUSTIC_DISTANCE_GOOD,
+                   speech.ACOUSTIC_DISTANCE_BAD],
+        "phones": [phones.PHONE_ERROR_THRESHOLD, phones.PHONE_ERROR_MIN_EDITS, phones.NEAR_PHONE_COST,
+                   phones.FINAL_EXTRA_COST, phones.FINAL_DELETION_COST, phones.PHONE_PLAUSIBLE_POSTERIOR,
+                   phones.ALTERNATE_PRONUNCIATIONS.get(lang, {})],
+    }
+
+
+class IdempotencyConflictError(ValueError):
+    """The key is already used by a request with another payload."""
+
+
+def payload_digest(upload, text, lang):
+    """Hash of an uploaded file (read in chunks, then rewound), the expected text and the language."""
+    digest = hashlib.sha256(json.dumps([text, lang], ensure_ascii=False).encode("utf-8"))
+    for chunk in iter(lambda: upload.read(1 << 20), b""):
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def analysis_key(waveform, sampling_rate, text, lang):
+    """Key of the result of analysing ``waveform`` against ``text`` in ``lang`` with the current configuration."""
+    content = json.dumps([audiocache.fingerprint(waveform, sampling_rate), text, lang, configuration(lang)],
+                         ensure_ascii=False, sort_keys=True, default=repr)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _size(result):
+    return len(json.dumps(result, default=repr))
+
+
+class ResultCache:
+    """Results by key for ``ttl`` seconds, least recently used evicted past ``max_bytes``, computations shared."""
+
+    def __init__(self, max_bytes, ttl, size=_size, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._size = size
+        self._clock = clock
+        self._entries = OrderedDict()  # key: (expiry, size, result, payload digest)
+        self._pending = {}  # key: (task computing it, payload digest)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, digest=None):
+        """The cached result for ``key``, or ``None``.
+
+        Raises :class:`IdempotencyConflictError` when it was cached for another ``digest``.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self._clock():
+            self._remove(key)
+            return None
+        _check_digest(entry[3], digest)
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, result, digest=None):
+        size = self._size(result)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (self._clock() + self.ttl, size, result, digest)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self.nbytes -= self._entries.pop(key)[1]
+
+    async def get_or_compute(self, key, compute, digest=None):
+        """``(result, status)``: the cached result (``hit``), the one of a running computation for the same
+        key (``shared``), or the result of ``await compute()`` (``miss``), cached when it returns.
+
+        The computation runs in its own task: a caller that goes away does not cancel it for
+        the others. Its exceptions reach every caller waiting for it and are not cached.
+        ``digest`` identifies the payload behind ``key`` (see :func:`payload_digest`): a
+        cached or running entry of the same key with another digest raises
+        :class:`IdempotencyConflictError`.
+        """
+        result = self.get(key, digest)
+        if result is not None:
+            metrics.CACHE.inc(cache="result", result="hit")
+            return result, "hit"
+        pending = self._pending.get(key)
+        if pending is not None:
+            _check_digest(pending[1], digest)
+            metrics.CACHE.inc(cache="result", result="shared")
+            return await asyncio.shield(pending[0]), "shared"
+        metrics.CACHE.inc(cache="result", result="miss")
+        task = asyncio.ensure_future(compute())
+        self._pending[key] = (task, digest)
+        task.add_done_callback(lambda done: self._finished(key, done, digest))
+        return await asyncio.shield(task), "miss"
+
+    def _finished(self, key, task, digest):
+        del self._pending[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result(), digest)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+
+def _check_digest(expected, digest):
+    if expected != digest:
+        raise IdempotencyConflictError("this Idempotency-Key was already used for another request")
@@ -0,0 +1,235 @@
+"""Priority lanes in front of the inference workers: learners on screen first, bulk work in the gaps.
+
+Every analysis takes one of a fixed number of slots (``OPENPRONOUNCE_INFERENCE_SLOTS``)
+for as long as it runs. Requests wait for a slot in the queue of their class:
+
+- ``interactive``: someone is waiting for the answer (``/pronunciation``, the web demo);
+- ``batch``: bulk and background work (jobs, ``/speech2text``, ``/tts`` pre-warming).
+
+When a slot frees up and both queues are waiting, the next request comes from the
+class with the smallest virtual time, which grows by ``1 / weight`` per request served
+(stride scheduling): with the default weights of 4 and 1, batch gets one slot in five
+under contention and never starves. ``OPENPRONOUNCE_INTERACTIVE_RESERVED`` slots (one
+by default, when there are at least two) are never given to batch work, so a
+long-running bulk item cannot hold every slot while a learner waits.
+
+Queues are bounded (``OPENPRONOUNCE_MAX_QUEUE`` per class): past that,
+:class:`QueueFullError` asks the caller to come back later rather than piling up work.
+The time spent waiting is recorded per class, see :meth:`Scheduler.stats`.
+
+Threads wait with :meth:`Scheduler.acquire`; coroutines wait with
+:meth:`Scheduler.acquire_async`, which holds no thread while queued. Optional work
+(the partial results of the live socket) takes a slot with :meth:`Scheduler.try_acquire`
+only when one is free, and is skipped otherwise.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+CLASSES = ("interactive", "batch")
+
+INFERENCE_SLOTS = int(os.environ.get("OPENPRONOUNCE_INFERENCE_SLOTS", "2"))
+INTERACTIVE_RESERVED = int(os.environ.get("OPENPRONOUNCE_INTERACTIVE_RESERVED", "1"))
+MAX_QUEUE = int(os.environ.get("OPENPRONOUNCE_MAX_QUEUE", "64"))
+WEIGHTS = {"interactive": 4.0, "batch": 1.0}
+# Waits kept per class for the percentiles of stats().
+WAIT_SAMPLES = 1000
+
+
+class QueueFullError(RuntimeError):
+    """Too many requests of this class are already waiting for a slot."""
+
+
+class _Ticket:
+    __slots__ = ("priority", "enqueued", "granted", "notify")
+
+    def __init__(self, priority, notify=None):
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.notify = notify  # called when granted, for waiters that are not blocked on the condition
+
+
+class Scheduler:
+    """Weighted fair sharing of ``slots`` concurrent analyses between the :data:`CLASSES`."""
+
+    def __init__(self, slots=None, weights=None, reserved=None, max_queue=None):
+        self.slots = max(1, INFERENCE_SLOTS if slots is None else slots)
+        self.weights = dict(WEIGHTS if weights is None else weights)
+        reserved = INTERACTIVE_RESERVED if reserved is None else reserved
+        self.reserved = max(0, min(reserved, self.slots - 1))
+        self.max_queue = MAX_QUEUE if max_queue is None else max_queue
+        self._condition = threading.Condition()
+        self._queues = {c: deque() for c in CLASSES}
+        self._running = {c: 0 for c in CLASSES}
+        self._pass = {c: 0.0 for c in CLASSES}
+        self._virtual_time = 0.0
+        self._waits = {c: deque(maxlen=WAIT_SAMPLES) for c in CLASSES}
+        self._served = {c: 0 for c in CLASSES}
+        self._rejected = {c: 0 for c in CLASSES}
+
+    def _check(self, priority):
+        if priority not in CLASSES:
+            raise ValueError(f"unknown priority {priority!r}, expected one of: {', '.join(CLASSES)}")
+
+    def acquire(self, priority="interactive"):
+        """Wait for a slot in the ``priority`` class. Returns the function that gives it back.
+
+        Raises :class:`QueueFullError` when :attr:`max_queue` requests of that class already wait.
+        """
+        ticket = _Ticket(priority)
+        with self._condition:
+            self._enqueue(ticket)
+            self._condition.wait_for(lambda: ticket.granted)
+        return self._releaser(priority)
+
+    async def acquire_async(self, priority="interactive"):
+        """:meth:`acquire` for coroutines: the wait happens on the event loop, not in a thread.
+
+        A waiter cancelled while queued leaves the queue; one cancelled as its slot was
+        granted gives the slot back.
+        """
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+            except RuntimeError:  # the loop is closed: nobody is waiting any more
+                pass
+
+        ticket = _Ticket(priority, notify)
+        with self._condition:
+            self._enqueue(ticket)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._condition:
+                if ticket.granted:
+                    self._running[priority] -= 1
+                    self._dispatch()
+                else:
+                    self._queues[priority].remove(ticket)
+            raise
+        return self._releaser(priority)
+
+    def try_acquire(self, priority="interactive"):
+        """Take a slot of the ``priority`` class if one is free right now, without queueing.
+
+        Returns the function that gives it back, or ``None`` when the slot would have to be
+        waited for (all slots busy, requests of that class already queued, or the slots
+        left are reserved). Such a grant counts as served but not in the queue waits.
+        """
+        self._check(priority)
+        with self._condition:
+            if (sum(self._running.values()) >= self.slots or self._queues[priority]
+                    or not self._may_run(priority)):
+                return None
+            self._pass[priority] = max(self._pass[priority], self._virtual_time) + 1.0 / self.weights[priority]
+            self._running[priority] += 1
+            self._served[priority] += 1
+        return self._releaser(priority)
+
+    def _enqueue(self, ticket):
+        """Queue ``ticket`` and grant what can be. Called with the condition held."""
+        priority = ticket.priority
+        self._check(priority)
+        queue = self._queues[priority]
+        if self.max_queue and len(queue) >= self.max_queue:
+            self._rejected[priority] += 1
+            raise QueueFullError(f"too many {priority} requests waiting, try again later")
+        if not queue and not self._running[priority]:
+            # A class coming back from idle starts at the current virtual time, without
+            # the credit it would have accumulated while nobody asked for it.
+            self._pass[priority] = max(self._pass[priority], self._virtual_time)
+        queue.append(ticket)
+        self._dispatch()
+
+    def _releaser(self, priority):
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            with self._condition:
+                self._running[priority] -= 1
+                self._dispatch()
+
+        return release
+
+    @contextmanager
+    def slot(self, priority="interactive"):
+        """Hold a slot of the ``priority`` class for the duration of the block (see :meth:`acquire`)."""
+        release = self.acquire(priority)
+        try:
+            yield
+        finally:
+            release()
+
+    def _dispatch(self):
+        """Grant free slots to waiting tickets. Called with the condition held."""
+        granted = False
+        while sum(self._running.values()) < self.slots:
+            ready = [c for c in CLASSES if self._queues[c] and self._may_run(c)]
+            if not ready:
+                break
+            priority = min(ready, key=lambda c: self._pass[c])
+            ticket = self._queues[priority].popleft()
+            ticket.granted = True
+            if ticket.notify is not None:
+                ticket.notify()
+            granted = True
+            self._running[priority] += 1
+            self._served[priority] += 1
+            self._waits[priority].append(time.monotonic() - ticket.enqueued)
+            self._virtual_time = self._pass[priority]
+            self._pass[priority] += 1.0 / self.weights[priority]
+        if granted:
+            self._condition.notify_all()
+
+    def _may_run(self, priority):
+        if priority == "interactive":
+            return True
+        return self._running[priority] < self.slots - self.reserved
+
+    def stats(self):
+        """Queue length, running count, requests served and rejected, and wait percentiles (ms) per class."""
+        with self._condition:
+            out = {"slots": self.slots, "reserved": self.reserved, "classes": {}}
+            for c in CLASSES:
+                waits = sorted(self._waits[c])
+                out["classes"][c] = {
+                    "weight": self.weights[c],
+                    "queued": len(self._queues[c]),
+                    "running": self._running[c],
+                    "served": self._served[c],
+                    "rejected": self._rejected[c],
+                    **{f"wait_p{q}_ms": round(1000 * _percentile(waits, q), 1) for q in (50, 95, 99)},
+                }
+        return out
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide scheduler, configured from the environment on first use."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Scheduler()
+        return _default
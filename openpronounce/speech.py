@@ -1,7 +1,10 @@
 """Pronunciation assessment: Wav2Vec2 embeddings, phonemization, alignment and scoring."""
 
 import logging
+import os
 import re
+import threading
+import time
 from functools import lru_cache
 
 import Levenshtein
@@ -13,8 +16,9 @@ from phonemizer import phonemize
 from scipy.spatial.distance import euclidean
 from sklearn.preprocessing import MinMaxScaler
 
-from . import audio, phones
+from . import audio, audiocache, metrics, phones, pitch, stages, tracing
 from .device import get_device
+from .inference import FRAME_STRIDE, run_windowed
 from .languages import DEFAULT_LANGUAGE, get_language
 
 logger = logging.getLogger(__name__)
@@ -26,24 +30,42 @@ SAMPLING_RATE = 16000
 # ratio of edited phonemes over the number of expected phonemes.
 WORD_ERROR_THRESHOLD = 0.4
 
+# OPENPRONOUNCE_WORD_ASR=0: phones-only mode, the word transcription model of the
+# language is neither loaded nor run (see compare_audio_with_text).
+WORD_ASR = os.environ.get("OPENPRONOUNCE_WORD_ASR", "1")
+
+
+def asr_enabled():
+    return WORD_ASR.lower() not in ("", "0", "off", "false", "no")
+
 
 # ---------------------------------------------------------------------------
 # Models (loaded lazily, once)
 # ---------------------------------------------------------------------------
 
-@lru_cache(maxsize=None)
+_load_locks = {}
+
+
 def _load_models(model_name=MODEL_NAME):
     """Load a Wav2Vec2 processor and CTC model on first use (cached per checkpoint).
 
     ``Wav2Vec2ForCTC`` embeds a ``Wav2Vec2Model`` (``.wav2vec2``), so a single
     checkpoint serves both transcription (CTC head) and embedding extraction.
+    Thread-safe: concurrent stages asking for the same checkpoint load it once.
     """
+    with _load_locks.setdefault(model_name, threading.Lock()):
+        return _load_checkpoint(model_name)
+
+
+@lru_cache(maxsize=None)
+def _load_checkpoint(model_name):
     from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 
     logger.info("Loading %s", model_name)
     processor = Wav2Vec2Processor.from_pretrained(model_name)
     model_ctc = Wav2Vec2ForCTC.from_pretrained(model_name).to(get_device())
     model_ctc.eval()
+    metrics.register_model(model_name, model_ctc)
     return processor, model_ctc
 
 
@@ -65,16 +87,19 @@ def _get_model():
 # ---------------------------------------------------------------------------
 
 def extract_embeddings(audio_waveform, sampling_rate=SAMPLING_RATE):
-    """Extract raw Wav2Vec2 hidden states, shape (frames, features)."""
+    """Extract raw Wav2Vec2 hidden states, shape (frames, features).
+
+    Long recordings are processed in overlapping windows (see :mod:`openpronounce.inference`).
+    """
     inputs = _get_processor()(audio_waveform, sampling_rate=sampling_rate, return_tensors="pt", padding=True)
     input_values = inputs.input_values
     if len(input_values.shape) > 2:
         input_values = input_values.squeeze(0)
 
-    with torch.no_grad():
-        features = _get_model()(input_values.to(get_device())).last_hidden_state  # (batch, time, features)
+    model = _get_model()
+    features = run_windowed(lambda x: model(x).last_hidden_state, input_values)  # (batch, time, features)
 
-    return features.squeeze(0).cpu().numpy()
+    return features.squeeze(0).numpy()
 
 
 def transcribe(audio_waveform, lang=DEFAULT_LANGUAGE):
@@ -82,12 +107,13 @@ def transcribe(audio_waveform, lang=DEFAULT_LANGUAGE):
 
     The English model emits upper-case text; the other checkpoints emit lower-case.
     """
-    processor = _get_processor(lang)
-    inputs = processor(audio_waveform, sampling_rate=SAMPLING_RATE, return_tensors="pt", padding=True)
-    with torch.no_grad():
-        logits = _get_model_ctc(lang)(inputs.input_values.to(get_device())).logits
-    predicted_ids = torch.argmax(logits, dim=-1).cpu()
-    return processor.batch_decode(predicted_ids)[0]
+    with tracing.span("asr", frames=len(audio_waveform) // FRAME_STRIDE):
+        processor = _get_processor(lang)
+        inputs = processor(audio_waveform, sampling_rate=SAMPLING_RATE, return_tensors="pt", padding=True)
+        model = _get_model_ctc(lang)
+        logits = run_windowed(lambda x: model(x).logits, inputs.input_values)
+        predicted_ids = torch.argmax(logits, dim=-1)
+        return processor.batch_decode(predicted_ids)[0]
 
 
 def clean_transcription(text):
@@ -356,7 +382,7 @@ def compute_pronunciation_score(acoustic_distance, phoneme_error_rate, word_erro
 
 
 def compare_audio_with_text(audio_1, text_reference, sampling_rate=SAMPLING_RATE, use_phone_model=None,
-                            lang=DEFAULT_LANGUAGE):
+                            lang=DEFAULT_LANGUAGE, timings=False, artifacts=None, use_asr=None, trim_silence=None):
     """Assess how well ``audio_1`` (16 kHz mono waveform) pronounces ``text_reference``.
 
     ``lang`` selects the language (see :data:`openpronounce.languages.LANGUAGES`);
@@ -364,33 +390,178 @@ def compare_audio_with_text(audio_1, text_reference, sampling_rate=SAMPLING_RATE
 
     Returns a JSON-serializable dict with ``score`` (0-100), ``distance``,
     ``differences`` (per-word errors, phonemes, feedback), ``transcribe``,
-    ``language`` and ``prosody`` (``f0`` and ``energy`` contours).
+    ``language`` and ``prosody`` (``f0`` and ``energy`` contours). With ``timings=True``,
+    also ``timings``: the total and every stage with its start, duration, thread and
+    attributes, in milliseconds (see :mod:`openpronounce.tracing`).
+
+    With ``artifacts`` (a ``.npz`` path), the model outputs the score is computed from
+    (phone recognition, transcription, acoustic distance) are saved there, to re-score
+    the attempt later without the models (see :mod:`openpronounce.rescore`). A failure
+    to save them is logged; the result is returned all the same.
 
     When the phone recognizer is enabled (default, see :mod:`openpronounce.phones`),
     ``differences.errors`` and ``differences.phoneme_error_rate`` come from phones
     recognized directly in the audio; otherwise they are derived from the word
-    transcription.
+    transcription. ``use_asr=False`` (default: ``OPENPRONOUNCE_WORD_ASR``) skips the word
+    transcription model: ``transcribe`` and ``differences.word_error_rate`` are then
+    estimated from the phones (see :func:`openpronounce.phones.compare_phones`), which
+    saves a model per language and a forward pass, and needs the phone recognizer. The
+    parts of ``differences`` that come from the transcription keep their keys but are
+    empty: ``word_distance`` and ``phoneme_distance`` are ``None``, ``expected_phonemes``,
+    ``transcribed_phonemes``, ``expected_vector`` and ``transcribed_vector`` are ``[]``.
+
+    ``trim_silence=True`` (default: ``OPENPRONOUNCE_TRIM_SILENCE``, off) cuts the silence
+    at both ends of the recording and of the reference voice before the models and the
+    DTW (see :func:`openpronounce.audio.trim_silence`); the result then has ``trimmed``,
+    the ``start`` and ``end`` in seconds of the part of the recording that was analysed.
     """
+    args = (audio_1, text_reference, sampling_rate, use_phone_model, lang, artifacts, use_asr, trim_silence)
+    if not timings:
+        return _compare_audio_with_text(*args)
+    start = time.perf_counter()
+    with tracing.collect() as spans:
+        result = _compare_audio_with_text(*args)
+    result["timings"] = tracing.summarize(spans, origin=start, end=time.perf_counter())
+    return result
+
+
+# The stages that only depend on the audio reuse their results for a recording already
+# analysed, whatever the expected text (see openpronounce.audiocache).
+
+def _embeddings_stage(name, audio_waveform, sampling_rate, fingerprint=None):
+    with tracing.span(name, frames=len(audio_waveform) // FRAME_STRIDE) as span:
+        key = (fingerprint or audiocache.fingerprint(audio_waveform, sampling_rate), MODEL_NAME)
+        hit, embeddings = audiocache.get("embeddings", key)
+        span.set(cache_hit=hit)
+        if not hit:
+            embeddings = extract_embeddings(audio_waveform, sampling_rate)
+            audiocache.put("embeddings", key, embeddings)
+        return embeddings
+
+
+def _prosody_stage(audio_waveform, sampling_rate, fingerprint):
+    with tracing.span("prosody", frames=len(audio_waveform) // FRAME_STRIDE) as span:
+        key = (fingerprint, pitch.PITCH_METHOD)
+        hit, prosody = audiocache.get("prosody", key)
+        span.set(cache_hit=hit)
+        if not hit:
+            prosody = extract_energy(audio_waveform), interpolate_f0(extract_f0(audio_waveform, sampling_rate))
+            audiocache.put("prosody", key, prosody)
+        return prosody
+
+
+def _model_output(stage, span_name, key, frames, compute):
+    """``compute()``, which runs in its own ``span_name`` span, or its cached result under a span of that name."""
+    hit, value = audiocache.get(stage, key)
+    if hit:
+        with tracing.span(span_name, frames=frames, cache_hit=True):
+            return value
+    value = compute()
+    audiocache.put(stage, key, value)
+    return value
+
+
+def _dtw_stage(embeddings_1, embeddings_2):
+    with tracing.span("dtw", frames=len(embeddings_1), reference_frames=len(embeddings_2)):
+        return fastdtw(embeddings_1, embeddings_2, dist=euclidean)
+
+
+def _phones_stage(audio_waveform, sampling_rate, text_reference, lang, fingerprint):
+    recognition = _model_output(
+        "phones", "phone_recognition", (fingerprint, phones.PHONE_MODEL_NAME, lang),
+        len(audio_waveform) // FRAME_STRIDE, lambda: phones.recognize_phones(audio_waveform, sampling_rate, lang=lang))
+    return recognition, phones.compare_phones(recognition, text_reference, lang)
+
+
+def _transcription_stage(audio_waveform, text_reference, lang, fingerprint):
+    transcription = _model_output(
+        "asr", "asr", (fingerprint, get_language(lang).asr_model), len(audio_waveform) // FRAME_STRIDE,
+        lambda: transcribe(audio_waveform, lang))
+    return transcription, compare_transcriptions(transcription, text_reference, lang)
+
+
+def _reference_audio(text_reference, lang, sampling_rate, trim_silence):
+    reference = audio.load(audio.text2speech(text_reference, lang=lang), sr=sampling_rate)
+    return audio.trim_silence(reference, sampling_rate).waveform if trim_silence else reference
+
+
+def _compare_audio_with_text(audio_1, text_reference, sampling_rate, use_phone_model, lang, artifacts=None,
+                             use_asr=None, trim_silence=None):
     if use_phone_model is None:
         use_phone_model = phones.is_enabled()
+    if use_asr is None:
+        use_asr = asr_enabled()
+    if not use_asr and not use_phone_model:
+        raise ValueError("without the word transcription (phones-only mode), the phone recognizer must be enabled")
+    if trim_silence is None:
+        trim_silence = audio.trim_enabled()
     lang = get_language(lang).code
-
-    emb_1 = extract_embeddings(audio_1, sampling_rate)
-
-    reference_file = audio.text2speech(text_reference, lang=lang)
-    audio_2 = audio.load(reference_file, sr=sampling_rate)
-    emb_2 = extract_embeddings(audio_2, sampling_rate)
-
-    distance, path = fastdtw(emb_1, emb_2, dist=euclidean)
+    trimmed = None
+    if trim_silence:
+        trimmed = audio.trim_silence(audio_1, sampling_rate)
+        audio_1 = trimmed.waveform
+    fingerprint = audiocache.fingerprint(audio_1, sampling_rate)
+
+    # Independent stages run concurrently (see openpronounce.stages), the models
+    # sharing the cores; the results are the same as one after the other.
+    model_threads = stages.model_threads(1 + use_phone_model + use_asr)
+    graph = {
+        "reference_audio": stages.Stage(
+            lambda: _reference_audio(text_reference, lang, sampling_rate, trim_silence)),
+        "embeddings": stages.Stage(
+            lambda: _embeddings_stage("embeddings", audio_1, sampling_rate, fingerprint), threads=model_threads),
+    }
+    if use_phone_model:
+        graph["phones"] = stages.Stage(
+            lambda: _phones_stage(audio_1, sampling_rate, text_reference, lang, fingerprint), threads=model_threads)
+    if use_asr:
+        graph["transcription"] = stages.Stage(
+            lambda: _transcription_stage(audio_1, text_reference, lang, fingerprint), threads=model_threads)
+    graph.update({
+        "prosody": stages.Stage(lambda: _prosody_stage(audio_1, sampling_rate, fingerprint)),
+        "reference_embeddings": stages.Stage(
+            lambda audio_2: _embeddings_stage("reference_embeddings", audio_2, sampling_rate),
+            after=("reference_audio",), threads=model_threads),
+        "alignment": stages.Stage(_dtw_stage, after=("embeddings", "reference_embeddings")),
+    })
+    results = stages.run_stages(graph)
+
+    distance, path = results["alignment"]
     acoustic_distance = distance / max(1, len(path))
-    distance = int(distance)
-
-    transcription = transcribe(audio_1, lang)
-    differences = compare_transcriptions(transcription, text_reference, lang)
+    transcription, differences = results["transcription"] if use_asr else (None, None)
+    recognition, phone_result = results["phones"] if use_phone_model else (None, None)
+
+    result = _assemble(acoustic_distance, int(distance), differences, phone_result, lang)
+    energy, f0 = results["prosody"]
+    result["prosody"] = {
+        "f0": f0.tolist(),
+        "energy": energy.tolist(),
+    }
+    if trimmed is not None:
+        result["trimmed"] = {"start": round(trimmed.start / sampling_rate, 3),
+                             "end": round(trimmed.end / sampling_rate, 3)}
+    if artifacts is not None:
+        from . import rescore  # rescore imports this module
 
-    if use_phone_model:
-        recognition = phones.recognize_phones(audio_1, sampling_rate, lang=lang)
-        phone_result = phones.compare_phones(recognition, text_reference, lang)
+        try:
+            rescore.save(artifacts, text_reference, lang, acoustic_distance, result["distance"], transcription,
+                         recognition, result["score"], offset=trimmed.start if trimmed is not None else 0)
+        except Exception:  # noqa: BLE001 - optional: a full disk must not fail the assessment
+            logger.exception("saving the artifacts to %s failed", artifacts)
+    return result
+
+
+def _assemble(acoustic_distance, distance, differences, phone_result, lang):
+    """The result of an analysis from the word comparison (``None`` in phones-only mode) and, if any,
+    the phone comparison."""
+    if differences is None:
+        # Same keys as the word comparison, so clients and field selection need no special case.
+        differences = {
+            "word_error_rate": phone_result["word_error_rate"], "transcribe": phone_result["heard_text"],
+            "word_distance": None, "phoneme_distance": None, "expected_phonemes": [], "transcribed_phonemes": [],
+            "expected_vector": [], "transcribed_vector": [],
+        }
+    if phone_result is not None:
         differences.update({
             "errors": phone_result["errors"],
             "words_with_errors": phone_result["words_with_errors"],
@@ -405,9 +576,6 @@ def compare_audio_with_text(audio_1, text_reference, sampling_rate=SAMPLING_RATE
         acoustic_distance, differences["phoneme_error_rate"], differences["word_error_rate"], lang
     )
 
-    energy = extract_energy(audio_1)
-    f0 = interpolate_f0(extract_f0(audio_1, sampling_rate))
-
     return {
         "score": score,
         "distance": distance,
@@ -416,10 +584,6 @@ def compare_audio_with_text(audio_1, text_reference, sampling_rate=SAMPLING_RATE
         "feedback": differences["feedback"],
         "transcribe": differences["transcribe"],
         "language": lang,
-        "prosody": {
-            "f0": f0.tolist(),
-            "energy": energy.tolist(),
-        },
     }
 
 
@@ -428,9 +592,8 @@ def compare_audio_with_text(audio_1, text_reference, sampling_rate=SAMPLING_RATE
 # ---------------------------------------------------------------------------
 
 def extract_f0(audio_waveform, sr=SAMPLING_RATE):
-    """Fundamental frequency (pitch) contour, unvoiced frames set to 0."""
-    f0, _, _ = librosa.pyin(audio_waveform, fmin=50, fmax=300, sr=sr)
-    return np.nan_to_num(f0)
+    """Fundamental frequency (pitch) contour, unvoiced frames set to 0 (tracker: ``OPENPRONOUNCE_PITCH``)."""
+    return pitch.extract_f0(audio_waveform, sr)
 
 
 def extract_energy(audio_waveform):
@@ -0,0 +1,133 @@
+"""Run the independent stages of an analysis at the same time, on a shared thread pool.
+
+An analysis is a handful of stages (learner embeddings, reference voice, transcription,
+phone recognition, prosody) of which few depend on each other. They spend their time in
+torch and NumPy, which release the GIL, so threads are enough to overlap them.
+:func:`run_stages` takes the stages as a small dependency graph and starts each one as
+soon as its inputs are ready.
+
+A stage can carry an intra-op thread budget for torch: with two models running at once,
+each gets half of the cores instead of both asking for all of them. The budget is set
+in the worker thread for the duration of the stage; it is per thread with the OpenMP
+builds of torch (Linux, Windows), but process-wide with the native thread pool of some
+other builds, where it only limits oversubscription approximately.
+
+``OPENPRONOUNCE_STAGE_WORKERS`` sizes the pool; ``1`` runs the stages one after the other
+in the calling thread, as before.
+"""
+
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, NamedTuple, Optional
+
+import torch
+
+from . import tracing
+
+STAGE_WORKERS = int(os.environ.get("OPENPRONOUNCE_STAGE_WORKERS", "4"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_sequential = contextvars.ContextVar("openpronounce_sequential_stages", default=False)
+
+
+class Stage(NamedTuple):
+    """One step of an analysis.
+
+    ``fn`` is called with the results of the stages named in ``after``, in that order.
+    ``threads`` is the torch intra-op thread budget while it runs (``None``: unchanged).
+    """
+
+    fn: Callable
+    after: tuple = ()
+    threads: Optional[int] = None
+
+
+def model_threads(concurrent_models=2):
+    """Intra-op budget for one of ``concurrent_models`` models running at once (at least 1)."""
+    return max(1, torch.get_num_threads() // concurrent_models)
+
+
+@contextmanager
+def sequential():
+    """Run the stages started in this context in the calling thread (for a profiler that only sees it)."""
+    token = _sequential.set(True)
+    try:
+        yield
+    finally:
+        _sequential.reset(token)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="openpronounce-stage")
+        return _executor
+
+
+def _call(stage, args):
+    if stage.threads is None:
+        return stage.fn(*args)
+    previous = torch.get_num_threads()
+    torch.set_num_threads(stage.threads)
+    try:
+        return stage.fn(*args)
+    finally:
+        torch.set_num_threads(previous)
+
+
+def _check(stages):
+    """Raise ``ValueError`` for a dependency on an unknown or later stage (which also rules out cycles)."""
+    seen = set()
+    for name, stage in stages.items():
+        missing = [dep for dep in stage.after if dep not in seen]
+        if missing:
+            raise ValueError(f"stage {name!r} depends on {missing}, which must be declared before it")
+        seen.add(name)
+
+
+def run_stages(stages, parallel=None):
+    """Run ``stages`` (``{name: Stage}``, dependencies declared first) and return ``{name: result}``.
+
+    Stages start as soon as the stages they depend on are done, in declaration order among
+    the ready ones, so declare the longest first. The first exception raised by a stage is
+    re-raised once the stages already running have finished; the others are not started.
+    With ``parallel=False`` (default: :data:`STAGE_WORKERS` above 1, outside a
+    :func:`sequential` block), the stages run in order in the calling thread, without
+    thread budgets.
+    """
+    _check(stages)
+    parallel = STAGE_WORKERS > 1 and not _sequential.get() if parallel is None else parallel
+    results = {}
+    if not parallel:
+        for name, stage in stages.items():
+            results[name] = stage.fn(*(results[dep] for dep in stage.after))
+        return results
+
+    executor = _get_executor()
+    waiting = dict(stages)
+    running = {}
+    error = None
+    while waiting or running:
+        if error is None:
+            for name, stage in list(waiting.items()):
+                if all(dep in results for dep in stage.after):
+                    del waiting[name]
+                    args = [results[dep] for dep in stage.after]
+                    running[tracing.submit(executor, _call, stage, args)] = name
+        if not running:
+            break
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            try:
+                results[name] = future.result()
+            except Exception as e:  # noqa: BLE001 - re-raised below, once nothing is left running
+                error = error or e
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,153 @@
+"""Instrumentation hooks: the stages of an analysis report their timings here.
+
+Every stage of the pipeline (decoding, reference voice, embeddings, DTW, transcription,
+phone recognition and comparison, prosody) runs inside a :func:`span`, which records
+its start and end times, the thread it ran in and a few attributes: ``frames`` (length
+of the input in 20 ms model frames) and ``cache_hit`` where a cache was looked up.
+Finished spans go to:
+
+- the hooks registered with :func:`add_hook` (:mod:`openpronounce.metrics` registers
+  one when the server starts), in the thread that ran the stage;
+- every :func:`collect` block the calling context is in, including stages run on the
+  thread pools of :mod:`openpronounce.stages` and :mod:`openpronounce.passage`.
+
+``compare_audio_with_text(..., timings=True)`` uses :func:`collect` to return a
+``timings`` block. With no hook and no :func:`collect` block (the CLI, the library),
+a span reads the clock nowhere and records nothing: it checks that nobody listens and
+runs the block. :func:`write_chrome_trace` saves spans as a Chrome trace
+(``chrome://tracing``, Perfetto).
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+
+_hooks = []
+_collectors = contextvars.ContextVar("openpronounce_tracing_collectors", default=())
+
+
+class Span(NamedTuple):
+    """A finished stage: ``start`` and ``end`` in :func:`time.perf_counter` seconds."""
+
+    name: str
+    start: float
+    end: float
+    thread: str
+    attributes: dict
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+def add_hook(hook):
+    """Call ``hook(span)`` with every finished :class:`Span`, in the thread that ran it."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+class _Attributes(dict):
+    """The attributes of a span being recorded; :meth:`set` adds to them."""
+
+    def set(self, **attributes):
+        self.update(attributes)
+
+
+class _Discard:
+    """Stands in for :class:`_Attributes` when nobody listens: the attributes go nowhere."""
+
+    def set(self, **attributes):
+        pass
+
+
+_DISCARD = _Discard()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the block (or, as a decorator, each call) as the stage ``name``.
+
+    Yields an object whose ``set(**attributes)`` adds attributes known only inside the
+    block (``cache_hit``...). A span is recorded even when the block raises.
+    """
+    collectors = _collectors.get()
+    if not collectors and not _hooks:
+        yield _DISCARD
+        return
+    recorded = _Attributes(attributes)
+    start = time.perf_counter()
+    try:
+        yield recorded
+    finally:
+        finished = Span(name, start, time.perf_counter(), threading.current_thread().name, dict(recorded))
+        for collector in collectors:
+            collector.append(finished)
+        for hook in list(_hooks):
+            hook(finished)
+
+
+@contextmanager
+def collect():
+    """Gather the spans finished in this context (and the stage threads it starts) into the yielded list.
+
+    Blocks nest: a span goes to the list of every enclosing block.
+    """
+    spans = []
+    token = _collectors.set(_collectors.get() + (spans,))
+    try:
+        yield spans
+    finally:
+        _collectors.reset(token)
+
+
+def submit(executor, fn, *args, **kwargs):
+    """``executor.submit`` that runs ``fn`` in a copy of the caller's context, so its spans are collected."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def summarize(spans, origin=None, end=None):
+    """Spans as a JSON-friendly ``timings`` block, times in ms from ``origin`` (default: the first start).
+
+    ``total_ms`` runs from ``origin`` to ``end`` (default: the last end).
+    """
+    spans = sorted(spans, key=lambda s: s.start)
+    if origin is None:
+        origin = spans[0].start if spans else 0.0
+    if end is None:
+        end = max((s.end for s in spans), default=origin)
+    return {
+        "total_ms": round(1000 * (end - origin), 2),
+        "stages": [{
+            "name": s.name,
+            "start_ms": round(1000 * (s.start - origin), 2),
+            "duration_ms": round(1000 * s.duration, 2),
+            "thread": s.thread,
+            **s.attributes,
+        } for s in spans],
+    }
+
+
+def chrome_trace(spans):
+    """Spans as a Chrome trace event dict (complete events, one row per thread)."""
+    threads = {}
+    events = []
+    for s in sorted(spans, key=lambda s: s.start):
+        tid = threads.setdefault(s.thread, len(threads) + 1)
+        events.append({"name": s.name, "cat": "openpronounce", "ph": "X", "pid": os.getpid(), "tid": tid,
+                       "ts": round(s.start * 1e6, 3), "dur": round(s.duration * 1e6, 3), "args": s.attributes})
+    events += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": thread}}
+               for thread, tid in threads.items()]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(spans, path):
+    """Write ``spans`` to ``path`` as Chrome trace JSON (open it in ``chrome://tracing`` or ui.perfetto.dev)."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(chrome_trace(spans), f)
@@ -0,0 +1,118 @@
+"""Model preloading and warm-up, so that the first request of a fresh worker is not the slow one.
+
+Models are otherwise loaded lazily: the first analysis pays for two 1.2 GB checkpoints
+and for the first run of every torch kernel. :func:`preload` loads the models needed by
+a list of languages in parallel threads and runs one inference on each, on a short
+synthetic recording; :func:`status` reports where every model is, for a readiness probe.
+
+``OPENPRONOUNCE_PRELOAD`` (``en,fr``...) lists the languages the server preloads at startup.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import phones, speech
+from .languages import get_language
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_RATE = 16000
+
+PRELOAD = [code.strip() for code in os.environ.get("OPENPRONOUNCE_PRELOAD", "").split(",") if code.strip()]
+
+# Load state per checkpoint: "loading", "warming", "ready" or "failed".
+_states = {}
+_lock = threading.Lock()
+
+
+def warmup_audio(seconds=2.0, sampling_rate=SAMPLING_RATE):
+    """A deterministic voiced-like signal (harmonics of 150 Hz with a little noise), long enough for every model."""
+    t = np.arange(int(seconds * sampling_rate)) / sampling_rate
+    signal = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 6))
+    noise = np.random.default_rng(0).standard_normal(len(t))
+    return (0.1 * signal / np.abs(signal).max() + 0.005 * noise).astype(np.float32)
+
+
+def models_for(langs):
+    """Return ``{checkpoint: (load, [warm-up calls])}`` for the models ``langs`` need.
+
+    Every language needs its transcription checkpoint (unless the word ASR is off), the
+    English one serves the acoustic embeddings, and the phone recognizer (when enabled)
+    is shared by all.
+    A warm-up call takes the warm-up waveform.
+    """
+    models = {}
+    for code in langs:
+        lang = get_language(code)
+        if not speech.asr_enabled():
+            continue
+        load = (lambda name=lang.asr_model: speech._load_models(name))
+        _, warm = models.setdefault(lang.asr_model, (load, []))
+        warm.append(lambda sound, lang=lang.code: speech.transcribe(sound, lang))
+    if langs:
+        load = (lambda: speech._load_models(speech.MODEL_NAME))
+        _, warm = models.setdefault(speech.MODEL_NAME, (load, []))
+        warm.append(speech.extract_embeddings)
+        if phones.is_enabled():
+            models[phones.PHONE_MODEL_NAME] = (phones._load_model, [phones.recognize_phones])
+    return models
+
+
+def _set(name, **fields):
+    with _lock:
+        _states.setdefault(name, {}).update(fields)
+
+
+def _load_and_warm(name, load, warm, sound):
+    started = time.monotonic()
+    try:
+        _set(name, state="loading")
+        load()
+        _set(name, state="warming", load_seconds=round(time.monotonic() - started, 2))
+        for call in warm:
+            call(sound)
+        _set(name, state="ready", seconds=round(time.monotonic() - started, 2))
+        logger.info("%s ready in %.1f s", name, time.monotonic() - started)
+    except Exception as e:  # noqa: BLE001 - reported by status(), the server keeps running
+        logger.exception("preloading %s failed", name)
+        _set(name, state="failed", error=str(e))
+
+
+def preload(langs=None, wait=False):
+    """Load and warm up the models of ``langs`` (default :data:`PRELOAD`), one thread per model.
+
+    Returns the threads; with ``wait=True``, returns once every model is ready or failed.
+    Raises ``ValueError`` for an unknown language, before anything is loaded.
+    """
+    langs = PRELOAD if langs is None else list(langs)
+    models = models_for(langs)
+    sound = warmup_audio()
+    threads = []
+    for name, (load, warm) in models.items():
+        _set(name, state="pending", error=None)
+        thread = threading.Thread(target=_load_and_warm, args=(name, load, warm, sound),
+                                  name=f"openpronounce-preload-{name}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    if wait:
+        for thread in threads:
+            thread.join()
+    return threads
+
+
+def status():
+    """Return ``{"ready", "models"}``: ``ready`` is ``True`` once every preloaded model is warm
+    (and when nothing was preloaded); ``models`` maps each checkpoint to its state."""
+    with _lock:
+        models = {name: dict(fields) for name, fields in _states.items()}
+    return {"ready": all(m["state"] == "ready" for m in models.values()), "models": models}
+
+
+def reset():
+    """Forget the load states (the models themselves stay cached)."""
+    with _lock:
+        _states.clear()
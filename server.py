@@ -3,83 +3,574 @@
 Run with: uvicorn server:app --host 0.0.0.0 --port 8000
 """
 
+import asyncio
+import json
 import logging
 import os
 import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
-from fastapi.responses import FileResponse
+import numpy as np
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 
-from openpronounce import __version__, audio, speech
+from openpronounce import (__version__, audio, encoding, jobs, metrics, passage, phones, profiling, rescore,
+                           resultcache, scheduler, speech, warmup)
 from openpronounce.languages import DEFAULT_LANGUAGE, LANGUAGES, get_language
 
 logger = logging.getLogger("openpronounce.server")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Largest request body accepted, in megabytes (0: no limit); recordings are also capped
+# in duration by OPENPRONOUNCE_MAX_SECONDS (see openpronounce.audio).
+MAX_UPLOAD_BYTES = int(float(os.environ.get("OPENPRONOUNCE_MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# How often GET /jobs/{id}/results?follow=true looks for newly finished items.
+JOB_POLL_SECONDS = 1.0
+# Leading and trailing silence is cut before the analysis unless OPENPRONOUNCE_TRIM_SILENCE=0.
+TRIM_SILENCE = audio.trim_enabled(default=True)
+# Recordings that fail openpronounce.audio.assess_quality get a 422 without inference.
+QUALITY_GATE = os.environ.get("OPENPRONOUNCE_QUALITY_GATE", "1").lower() not in ("", "0", "off", "false", "no")
+
+# Results of recent /pronunciation requests, for retries (off unless OPENPRONOUNCE_RESULT_CACHE_MB is set).
+_result_cache = (resultcache.ResultCache(int(resultcache.RESULT_CACHE_MB * 1024 * 1024), resultcache.RESULT_CACHE_TTL)
+                 if resultcache.RESULT_CACHE_MB > 0 else None)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # GET /metrics reports the time spent in each stage of the pipeline.
+    metrics.observe_stages()
+    # Load and warm up the models of OPENPRONOUNCE_PRELOAD in the background; /ready tells when they are done.
+    warmup.preload()
+    # Background jobs (POST /jobs) survive restarts: the runner picks up where the last process stopped.
+    app.state.job_runner = jobs.JobRunner(jobs.JobStore(), analyze=_analyze_job_item).start()
+    yield
+    app.state.job_runner.stop(timeout=5)
+
+
+def _analyze_job_item(waveform, text, lang, mode):
+    """:func:`jobs.analyze_item` with the silence trimming of the server, as for ``/pronunciation``."""
+    return jobs.analyze_item(waveform, text, lang, mode, trim_silence=TRIM_SILENCE)
+
+
 app = FastAPI(
     title="OpenPronounce",
     description="Phoneme-level pronunciation assessment (Wav2Vec2 + DTW). English by default, see /languages.",
     version=__version__,
+    lifespan=lifespan,
 )
+
+
+class UploadLimitMiddleware:
+    """Answer 413 to a request whose body exceeds ``max_bytes``, without reading it all.
+
+    A declared ``Content-Length`` over the limit is refused before the body is read; a
+    chunked body is counted as it arrives and the request fails as soon as it goes over.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes:
+            return await self.app(scope, receive, send)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse({"detail": self._detail()}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    def _detail(self):
+        return f"upload larger than {self.max_bytes / 1024 / 1024:g} MB"
+
+
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
+
+class MetricsMiddleware:
+    """Count HTTP requests by endpoint, language and status, and time them (see :mod:`openpronounce.metrics`).
+
+    The endpoint is the route template (``/jobs/{job_id}``), the language the ``lang``
+    an endpoint validated (``request.state.lang``), empty for the others.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "other")
+            lang = scope.get("state", {}).get("lang", "")
+            metrics.REQUESTS.inc(endpoint=endpoint, lang=lang, status=status)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+
+
+app.add_middleware(MetricsMiddleware)
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
 
-def _save_upload_as_wav(upload: UploadFile) -> str:
+def _save_upload(upload: UploadFile) -> str:
+    """Copy ``upload`` to a temporary file chunk by chunk; 413 past :data:`MAX_UPLOAD_BYTES`."""
     suffix = os.path.splitext(upload.filename or "")[1] or ".webm"
     fd, path = tempfile.mkstemp(suffix=suffix, prefix="openpronounce-upload-")
-    with os.fdopen(fd, "wb") as buffer:
-        buffer.write(upload.file.read())
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while chunk := upload.file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if MAX_UPLOAD_BYTES and size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413,
+                                        detail=f"upload larger than {MAX_UPLOAD_BYTES / 1024 / 1024:g} MB")
+                buffer.write(chunk)
+    except BaseException:
+        _remove(path)
+        raise
+    return path
+
+
+def _remove(path):
     try:
-        return audio.webm2wav(path)
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _load_upload(upload: UploadFile):
+    """Decode an uploaded recording to a 16 kHz waveform. 413 when it is too large or too long."""
+    path = _save_upload(upload)
+    try:
+        return audio.load(path, max_seconds=audio.MAX_SECONDS)
+    except audio.AudioTooLongError as e:
+        raise HTTPException(status_code=413, detail=str(e)) from e
+    except Exception:
+        logger.exception("decoding the upload failed")
+        raise HTTPException(status_code=500, detail="Something went wrong")
     finally:
-        try:
-            os.remove(path)
-        except OSError:
-            pass
+        _remove(path)
 
 
-def _validate_lang(lang: str) -> str:
+def _unusable(sound):
+    """The :func:`audio.assess_quality` verdict of a recording that cannot be assessed, else ``None``."""
+    if not QUALITY_GATE:
+        return None
+    quality = audio.assess_quality(sound)
+    return None if quality["ok"] else quality
+
+
+def _quality_message(quality):
+    return "; ".join(problem["message"] for problem in quality["problems"])
+
+
+def _load_assessable(upload: UploadFile):
+    """:func:`_load_upload`, then 422 with the ``quality`` verdict when the recording cannot be assessed."""
+    sound = _load_upload(upload)
+    quality = _unusable(sound)
+    if quality is not None:
+        raise HTTPException(status_code=422, detail={"message": _quality_message(quality), "quality": quality})
+    return sound
+
+
+def _validate_lang(lang: str, request: Request = None) -> str:
+    """The code of ``lang`` (422 if unknown), recorded on ``request`` for the request metrics."""
     try:
-        return get_language(lang).code
+        code = get_language(lang).code
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e)) from e
+    if request is not None:
+        request.state.lang = code
+    return code
+
+
+def _priority(request: Request, default: str) -> str:
+    """The lane of a request: the ``priority`` query parameter, else the ``X-Priority`` header, else ``default``."""
+    priority = request.query_params.get("priority") or request.headers.get("x-priority") or default
+    if priority not in scheduler.CLASSES:
+        raise HTTPException(status_code=422, detail=f"priority must be one of: {', '.join(scheduler.CLASSES)}")
+    return priority
+
+
+async def _acquire(priority: str):
+    """Wait for an inference slot in the ``priority`` lane (503 when its queue is full). Returns the release function."""
+    try:
+        return await scheduler.get_scheduler().acquire_async(priority)
+    except scheduler.QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"}) from e
+
+
+async def _scheduled(priority: str, fn, *args, **kwargs):
+    """Run ``fn`` in the thread pool once a slot of the ``priority`` lane is free."""
+    release = await _acquire(priority)
+    try:
+        return await run_in_threadpool(fn, *args, **kwargs)
+    finally:
+        release()
 
 
 @app.post("/pronunciation")
-async def api_analyze_pronunciation(file: UploadFile = File(...), expected_text: str = Form(...),
-                                    lang: str = Form(DEFAULT_LANGUAGE)):
-    """Score ``file`` against ``expected_text`` in ``lang``. Returns the full analysis (score, errors, prosody)."""
-    lang = _validate_lang(lang)
+async def api_analyze_pronunciation(request: Request, file: UploadFile = File(...), expected_text: str = Form(...),
+                                    lang: str = Form(DEFAULT_LANGUAGE), fields: str = Form(""),
+                                    prosody_points: int = Form(0)):
+    """Score ``file`` against ``expected_text`` in ``lang``. Returns the full analysis (score, errors, prosody).
+
+    ``fields`` (``score,differences.errors``...) keeps only those parts of the result,
+    ``prosody_points`` averages the pitch and energy contours down to that many points.
+    The ``Accept`` header picks the encoding: JSON (default), compact JSON with the
+    numeric arrays as base64 float16, or MessagePack (see :mod:`openpronounce.encoding`).
+    Runs in the ``interactive`` lane unless ``priority=batch`` (query or ``X-Priority``).
+    With ``OPENPRONOUNCE_PROFILE_DIR`` set, ``X-Profile: 1`` profiles the analysis (see
+    :mod:`openpronounce.profiling`); the response names the report in ``X-Profile-Report``.
+    With ``OPENPRONOUNCE_ARTIFACTS_DIR`` set, the model outputs are saved to re-score the
+    attempt later (see :mod:`openpronounce.rescore`); ``X-Artifacts`` names the file.
+    With ``OPENPRONOUNCE_RESULT_CACHE_MB`` set, a retry of a recent request (same audio,
+    text and language, or same ``Idempotency-Key`` header) gets the result of the first
+    one, waiting for it if it is still running; ``X-Result-Cache`` tells ``hit``,
+    ``shared`` or ``miss`` (see :mod:`openpronounce.resultcache`). An ``Idempotency-Key``
+    sent again with another upload, text or language gets a 422.
+    A recording that cannot be assessed (too short, silent, no speech, clipped, noisy: see
+    :func:`openpronounce.audio.assess_quality`) gets a 422 whose ``detail`` holds the
+    ``quality`` verdict, before any model runs (``OPENPRONOUNCE_QUALITY_GATE=0``: off).
+    """
+    lang = _validate_lang(lang, request)
+    priority = _priority(request, "interactive")
+    profile_id = _profile_id(request)
+    artifacts = _artifacts_path()
+    if prosody_points < 0:
+        raise HTTPException(status_code=422, detail="prosody_points must be positive")
+    cache = _result_cache if profile_id is None else None
+    key = digest = sound = report = None
+    if cache is not None and request.headers.get("idempotency-key"):
+        key = "idempotency:" + request.headers["idempotency-key"]
+        digest = await run_in_threadpool(resultcache.payload_digest, file.file, expected_text, lang)
+    else:
+        sound = await run_in_threadpool(_load_assessable, file)
+        if cache is not None:
+            key = resultcache.analysis_key(sound, speech.SAMPLING_RATE, expected_text, lang)
+
+    async def analyze():
+        nonlocal sound, report
+        if sound is None:
+            sound = await run_in_threadpool(_load_assessable, file)
+        release = await _acquire(priority)
+        try:
+            result, report = await run_in_threadpool(_analyze, sound, expected_text, lang, profile_id, artifacts)
+        except Exception:
+            logger.exception("pronunciation analysis failed")
+            raise HTTPException(status_code=500, detail="Something went wrong")
+        finally:
+            release()
+        return result
+
+    if cache is None:
+        result, status = await analyze(), None
+    else:
+        try:
+            result, status = await cache.get_or_compute(key, analyze, digest)
+        except resultcache.IdempotencyConflictError as e:
+            raise HTTPException(status_code=422, detail=str(e)) from e
+    response = _encoded_response(result, request, fields, prosody_points)
+    if report:
+        response.headers["X-Profile-Report"] = os.path.basename(report)
+    if artifacts and status in (None, "miss") and os.path.exists(artifacts):  # not when saving them failed
+        response.headers["X-Artifacts"] = os.path.relpath(artifacts, rescore.ARTIFACTS_DIR)
+    if status:
+        response.headers["X-Result-Cache"] = status
+    return response
+
+
+def _artifacts_path():
+    """Where to save the model outputs of a request (one directory per day), or ``None`` when disabled."""
+    if not rescore.ARTIFACTS_DIR:
+        return None
+    return os.path.join(rescore.ARTIFACTS_DIR, time.strftime("%Y%m%d"), f"{uuid.uuid4().hex}.npz")
+
+
+def _profile_id(request: Request):
+    """The id to tag a profile with when the request asks for one and profiling is enabled, else ``None``."""
+    if not profiling.enabled() or request.headers.get("x-profile", "").lower() not in ("1", "true", "yes"):
+        return None
+    return request.headers.get("x-request-id") or uuid.uuid4().hex
+
+
+def _analyze(sound, expected_text, lang, profile_id=None, artifacts=None):
+    """Run the analysis, under the profilers with a ``profile_id``. Returns the result and the report path or None."""
+    kwargs = {"trim_silence": TRIM_SILENCE}
+    if artifacts:
+        kwargs["artifacts"] = artifacts
+    if profile_id is None:
+        return speech.compare_audio_with_text(sound, expected_text, lang=lang, **kwargs), None
+    with profiling.profile(profile_id, profiling.input_hash(sound, expected_text)) as report:
+        result = speech.compare_audio_with_text(sound, expected_text, lang=lang, **kwargs)
+    return result, report
+
+
+def _encoded_response(result, request, fields="", prosody_points=0):
+    if prosody_points:
+        result = encoding.downsample_prosody(result, prosody_points)
+    if fields.strip():
+        try:
+            result = encoding.select_fields(result, fields)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e)) from e
+    media_type = encoding.negotiate(request.headers.get("accept"))
+    return Response(encoding.encode(result, media_type), media_type=media_type)
+
+
+@app.websocket("/ws/pronunciation")
+async def ws_pronunciation(websocket: WebSocket):
+    """Assess a recording while it is being made.
+
+    The client sends a JSON message ``{"expected_text", "lang", "sample_rate"}``, then the
+    audio as binary messages (mono float32 little-endian PCM at ``sample_rate``), then
+    ``{"type": "end"}``. The server answers ``{"type": "partial", "heard_phones"}`` while
+    the audio comes in and an interactive inference slot is free, and
+    ``{"type": "result", "score", "differences", "language"}``
+    (phones only: no transcription, acoustic distance or prosody) after ``end``.
+    """
+    await websocket.accept()
+    try:
+        init = await websocket.receive_json()
+        expected_text = str(init.get("expected_text") or "")
+        lang = get_language(init.get("lang") or DEFAULT_LANGUAGE).code
+        sample_rate = int(init.get("sample_rate") or audio.TARGET_SR)
+        if not expected_text.strip() or not phones.is_enabled():
+            raise ValueError("expected_text is required and the phone recognizer must be enabled")
+    except (ValueError, TypeError, KeyError) as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1003)
+        return
+    except WebSocketDisconnect:
+        return
+
+    resampler = None
+    if sample_rate != audio.TARGET_SR:
+        import soxr
+
+        resampler = soxr.ResampleStream(sample_rate, audio.TARGET_SR, 1, dtype="float32")
+    recognizer = phones.StreamingRecognizer(lang=lang)
+    heard = []
+    received = 0
     try:
-        wav_file = _save_upload_as_wav(file)
-        sound = audio.load(wav_file)
-        return speech.compare_audio_with_text(sound, expected_text, lang=lang)
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                samples = np.frombuffer(message["bytes"], dtype="<f4")
+                received += len(samples)
+                if audio.MAX_SECONDS and received > audio.MAX_SECONDS * sample_rate:
+                    detail = str(audio.AudioTooLongError(audio.MAX_SECONDS))
+                    await websocket.send_json({"type": "error", "detail": detail})
+                    await websocket.close(code=1009)
+                    return
+                if resampler is not None:
+                    samples = resampler.resample_chunk(samples)
+                # Partials are a bonus: they run only when an interactive slot is free,
+                # the audio keeps piling up and the next chunk tries again.
+                release = recognizer.feed(samples) and scheduler.get_scheduler().try_acquire("interactive")
+                if release:
+                    try:
+                        recognition = await run_in_threadpool(recognizer.update)
+                    finally:
+                        release()
+                    if recognition.phones != heard:
+                        heard = recognition.phones
+                        await websocket.send_json({"type": "partial", "heard_phones": heard})
+            elif json.loads(message.get("text") or "{}").get("type") == "end":
+                break
+        if resampler is not None:
+            recognizer.feed(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+        release = await scheduler.get_scheduler().acquire_async("interactive")
+        try:
+            recognition = await run_in_threadpool(recognizer.finish)
+            result = await run_in_threadpool(phones.compare_phones, recognition, expected_text, lang)
+        finally:
+            release()
+        await websocket.send_json({"type": "result", **_phone_only_result(result, lang)})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except scheduler.QueueFullError as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1013)
     except Exception:
-        logger.exception("pronunciation analysis failed")
-        raise HTTPException(status_code=500, detail="Something went wrong")
+        logger.exception("streaming analysis failed")
+        await websocket.send_json({"type": "error", "detail": "Something went wrong"})
+        await websocket.close(code=1011)
+
+
+def _phone_only_result(phone_result, lang):
+    """Shape a :func:`phones.compare_phones` result like the ``differences`` of a full analysis."""
+    phone_error_rate = phone_result["phone_error_rate"]
+    return {
+        "score": round(100 * min(1.0, max(0.0, 1 - phone_error_rate)), 2),
+        "language": lang,
+        "differences": {
+            "errors": phone_result["errors"],
+            "words_with_errors": phone_result["words_with_errors"],
+            "phoneme_error_rate": phone_error_rate,
+            "expected_phones": phone_result["expected_phones"],
+            "heard_phones": phone_result["heard_phones"],
+            "heard_phones_confidence": phone_result["heard_phones_confidence"],
+            "feedback": speech._feedback(phone_result["words_with_errors"]),
+        },
+    }
+
+
+@app.post("/passage")
+async def api_analyze_passage(request: Request, file: UploadFile = File(...), expected_text: str = Form(...),
+                              lang: str = Form(DEFAULT_LANGUAGE)):
+    """Score a long read-aloud ``file`` against ``expected_text`` sentence by sentence.
+
+    Streams NDJSON: one ``{"type": "sentence", ...}`` line per sentence as soon as it is
+    scored (completion order, see ``index``), then a ``{"type": "passage", ...}`` line
+    with the aggregated score and errors. Holds an ``interactive`` slot (see ``/pronunciation``)
+    until the last sentence is scored. The sentence segments are cut around their phones
+    by the forced alignment, so ``OPENPRONOUNCE_TRIM_SILENCE`` does not apply to them.
+    """
+    lang = _validate_lang(lang, request)
+    priority = _priority(request, "interactive")
+    sound = await run_in_threadpool(_load_assessable, file)
+    release = await _acquire(priority)
+
+    def lines():
+        results = []
+        try:
+            try:
+                for sentence in passage.iter_passage(sound, expected_text, lang=lang):
+                    results.append(sentence)
+                    yield json.dumps({"type": "sentence", **sentence}, ensure_ascii=False) + "\n"
+            finally:
+                release()
+            summary = passage.summarize_passage(results, lang)
+            summary.pop("sentences")
+            yield json.dumps({"type": "passage", **summary}, ensure_ascii=False) + "\n"
+        except Exception:
+            logger.exception("passage analysis failed")
+            yield json.dumps({"type": "error", "detail": "Something went wrong"}) + "\n"
+
+    # The background task releases the slot if the client goes away before the stream starts.
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+
+@app.post("/jobs", status_code=202)
+async def api_create_job(request: Request, files: list[UploadFile] = File(...),
+                         expected_text: list[str] = Form(...), lang: str = Form(DEFAULT_LANGUAGE),
+                         mode: str = Form("sentence")):
+    """Queue the analysis of one or several recordings; returns the job id right away.
+
+    Send ``files`` and ``expected_text`` once per recording (or a single text for all of
+    them). ``mode`` is ``sentence`` (``/pronunciation`` result per item) or ``passage``
+    (``/passage`` summary per item). Jobs run in the background, after interactive
+    requests, and survive a restart of the server. When a recording fails the quality
+    gate (see ``/pronunciation``), the job is refused with a 422 whose ``detail.items``
+    gives the ``index`` and the ``quality`` verdict of each failing recording.
+    """
+    lang = _validate_lang(lang, request)
+    if mode not in jobs.MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of: {', '.join(jobs.MODES)}")
+    if len(expected_text) not in (1, len(files)):
+        raise HTTPException(status_code=422, detail="send one expected_text per file, or a single one for all")
+    texts = expected_text * len(files) if len(expected_text) == 1 else expected_text
+    sounds = [await run_in_threadpool(_load_upload, file) for file in files]
+    unusable = [{"index": index, "quality": quality}
+                for index, quality in enumerate([await run_in_threadpool(_unusable, sound) for sound in sounds])
+                if quality is not None]
+    if unusable:
+        message = "; ".join(f"recording {item['index']}: {_quality_message(item['quality'])}" for item in unusable)
+        raise HTTPException(status_code=422, detail={"message": message, "items": unusable})
+    runner = request.app.state.job_runner
+    job_id = await run_in_threadpool(runner.store.create, list(zip(sounds, texts)), lang, mode)
+    runner.notify()
+    return {"id": job_id, "status": "queued", "total": len(files),
+            "status_url": f"/jobs/{job_id}", "results_url": f"/jobs/{job_id}/results"}
+
+
+@app.get("/jobs/{job_id}")
+async def api_job_status(request: Request, job_id: str):
+    """Status of a job and of each of its items (``pending``, ``running``, ``done`` or ``failed``)."""
+    job = await run_in_threadpool(request.app.state.job_runner.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    return job
+
+
+@app.get("/jobs/{job_id}/results")
+async def api_job_results(request: Request, job_id: str, follow: bool = False):
+    """Finished items of a job as NDJSON, by index. With ``follow=true``, the others follow as they finish."""
+    store = request.app.state.job_runner.store
+    if await run_in_threadpool(store.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+
+    async def lines():
+        sent = set()
+        while True:
+            job = await run_in_threadpool(store.get, job_id)
+            for item in await run_in_threadpool(store.results, job_id):
+                if item["index"] not in sent:
+                    sent.add(item["index"])
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+            if not follow or job["status"] == "done":
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @app.post("/speech2text")
-async def api_speech2text(file: UploadFile = File(...), lang: str = Form(DEFAULT_LANGUAGE)):
-    """Transcribe ``file`` with the Wav2Vec2 model of ``lang``."""
-    lang = _validate_lang(lang)
+async def api_speech2text(request: Request, file: UploadFile = File(...), lang: str = Form(DEFAULT_LANGUAGE)):
+    """Transcribe ``file`` with the Wav2Vec2 model of ``lang`` (``batch`` lane by default)."""
+    lang = _validate_lang(lang, request)
+    priority = _priority(request, "batch")
+    sound = await run_in_threadpool(_load_upload, file)
     try:
-        wav_file = _save_upload_as_wav(file)
-        sound = audio.load(wav_file)
-        return {"transcript": speech.transcribe(sound, lang)}
+        return {"transcript": await _scheduled(priority, speech.transcribe, sound, lang)}
+    except HTTPException:
+        raise
     except Exception:
         logger.exception("transcription failed")
         raise HTTPException(status_code=500, detail="Something went wrong")
 
 
 @app.post("/phonemes")
-async def api_phonemes(text: str = Form(...), lang: str = Form(DEFAULT_LANGUAGE)):
+async def api_phonemes(request: Request, text: str = Form(...), lang: str = Form(DEFAULT_LANGUAGE)):
     """Return the IPA phonemes of ``text`` in ``lang`` and the word each phoneme belongs to."""
-    lang = _validate_lang(lang)
+    lang = _validate_lang(lang, request)
     try:
         phonemes, words = speech.get_phonemes_with_word_mapping(text, lang)
         return {"phonemes": phonemes, "words": list(words.values())}
@@ -89,11 +580,14 @@ async def api_phonemes(text: str = Form(...), lang: str = Form(DEFAULT_LANGUAGE)
 
 
 @app.post("/tts")
-async def api_tts(text: str = Form(...), lang: str = Form(DEFAULT_LANGUAGE)):
-    """Return a 16 kHz wav reference pronunciation of ``text`` in ``lang``."""
-    lang = _validate_lang(lang)
+async def api_tts(request: Request, text: str = Form(...), lang: str = Form(DEFAULT_LANGUAGE)):
+    """Return a 16 kHz wav reference pronunciation of ``text`` in ``lang`` (``batch`` lane by default)."""
+    lang = _validate_lang(lang, request)
+    priority = _priority(request, "batch")
     try:
-        return FileResponse(audio.text2speech(text, lang=lang), media_type="audio/wav")
+        return FileResponse(await _scheduled(priority, audio.text2speech, text, lang=lang), media_type="audio/wav")
+    except HTTPException:
+        raise
     except Exception:
         logger.exception("tts failed")
         raise HTTPException(status_code=500, detail="Something went wrong")
@@ -106,11 +600,36 @@ async def api_languages():
     return {"default": DEFAULT_LANGUAGE, "languages": languages}
 
 
+@app.get("/queue")
+async def api_queue():
+    """Inference slots and, per priority lane, queued and running requests and queue wait percentiles."""
+    return scheduler.get_scheduler().stats()
+
+
+@app.get("/metrics")
+async def api_metrics():
+    """Prometheus metrics: per-stage latency histograms, requests, caches, loaded models, queues."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once every model of ``OPENPRONOUNCE_PRELOAD`` is loaded and warm, 503 before."""
+    state = warmup.status()
+    if state["ready"]:
+        label = "ready"
+    elif any(m["state"] == "failed" for m in state["models"].values()):
+        label = "failed"
+    else:
+        label = "loading"
+    return JSONResponse({"status": label, "models": state["models"]}, status_code=200 if state["ready"] else 503)
+
+
 @app.get("/")
 async def home(request: Request):
     return templates.TemplateResponse(request=request, name="index.html", context={})
@@ -2,7 +2,8 @@
  * Microphone recorder built on MediaRecorder.
  *
  * Emits DOM events on `document`:
- *   record:start          recording began
+ *   record:start          detail: { sampleRate }  recording began
+ *   record:pcm            detail: { samples }     raw mono float32 audio, only with start({ pcm: true })
  *   record:stop           recording ended (user, timeout or silence)
  *   record:silence        recording ended because of silence
  *   record:ready          detail: { blob }  the webm blob is available
@@ -21,13 +22,18 @@ class AudioRecorder {
         this.silenceDuration = silenceDuration;
         this.maxDuration = maxDuration;
         this.started = false;
+        this.pcmNode = null;
     }
 
     static isSupported() {
         return Boolean(navigator.mediaDevices && navigator.mediaDevices.getUserMedia && window.MediaRecorder);
     }
 
-    async start() {
+    static supportsPcm() {
+        return Boolean(window.AudioWorkletNode);
+    }
+
+    async start({ pcm = false } = {}) {
         if (this.started) {
             this.stop();
             return;
@@ -55,6 +61,9 @@ class AudioRecorder {
         this.analyser = this.audioContext.createAnalyser();
         this.analyser.fftSize = 256;
         source.connect(this.analyser);
+        if (pcm && AudioRecorder.supportsPcm()) {
+            await this.tapPcm(source);
+        }
 
         this.audioChunks = [];
         this.mediaRecorder = new MediaRecorder(this.stream);
@@ -69,7 +78,7 @@ class AudioRecorder {
         this.mediaRecorder.onstart = () => {
             requestAnimationFrame(() => this.checkSilence());
             this.maxTimer = setTimeout(() => this.stop(), this.maxDuration);
-            this.emit('record:start');
+            this.emit('record:start', { sampleRate: this.audioContext.sampleRate });
         };
 
         this.started = true;
@@ -89,6 +98,11 @@ class AudioRecorder {
             this.stream.getTracks().forEach(track => track.stop());
             this.stream = null;
         }
+        if (this.pcmNode) {
+            this.pcmNode.port.postMessage('flush');
+            this.pcmNode.port.onmessage = null;
+            this.pcmNode = null;
+        }
         if (this.audioContext && this.audioContext.state !== 'closed') {
             this.audioContext.close();
         }
@@ -100,6 +114,52 @@ class AudioRecorder {
         this.emit('record:stop');
     }
 
+    /**
+     * Forward the raw microphone samples as record:pcm events, in blocks of ~85 ms
+     * (4096 samples at 48 kHz), through an AudioWorklet that only copies its input.
+     */
+    async tapPcm(source) {
+        const code = `
+            class PcmTap extends AudioWorkletProcessor {
+                constructor() {
+                    super();
+                    this.buffer = new Float32Array(4096);
+                    this.length = 0;
+                    this.port.onmessage = () => this.flush();
+                }
+                flush() {
+                    if (this.length) {
+                        this.port.postMessage(this.buffer.slice(0, this.length));
+                        this.length = 0;
+                    }
+                }
+                process(inputs) {
+                    const channel = inputs[0] && inputs[0][0];
+                    if (channel) {
+                        if (this.length + channel.length > this.buffer.length) {
+                            this.flush();
+                        }
+                        this.buffer.set(channel, this.length);
+                        this.length += channel.length;
+                    }
+                    return true;
+                }
+            }
+            registerProcessor('pcm-tap', PcmTap);`;
+        const url = URL.createObjectURL(new Blob([code], { type: 'application/javascript' }));
+        try {
+            await this.audioContext.audioWorklet.addModule(url);
+        } finally {
+            URL.revokeObjectURL(url);
+        }
+        this.pcmNode = new AudioWorkletNode(this.audioContext, 'pcm-tap');
+        this.pcmNode.port.onmessage = (event) => this.emit('record:pcm', { samples: event.data });
+        // The node must reach the destination to be processed; a muted gain keeps it silent.
+        const mute = this.audioContext.createGain();
+        mute.gain.value = 0;
+        source.connect(this.pcmNode).connect(mute).connect(this.audioContext.destination);
+    }
+
     isRecording() {
         return this.started;
     }
@@ -135,3 +195,83 @@ class AudioRecorder {
         document.dispatchEvent(new CustomEvent(name, { detail }));
     }
 }
+
+
+/**
+ * Live assessment over a WebSocket (/ws/pronunciation): raw audio goes up while the
+ * learner speaks, the phones heard so far come back, and the phone-level result
+ * arrives shortly after end().
+ *
+ * Emits DOM events on `document`:
+ *   stream:partial        detail: { heard_phones }
+ *   stream:result         detail: { score, differences, language }
+ *   stream:error          detail: { detail }  the caller should fall back to POST /pronunciation
+ */
+class PronunciationStream {
+    constructor({ expectedText, lang, sampleRate }) {
+        this.init = { expected_text: expectedText, lang, sample_rate: sampleRate };
+        this.queue = [];
+        this.done = false;
+        const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+        this.socket = new WebSocket(`${scheme}://${location.host}/ws/pronunciation`);
+        this.socket.binaryType = 'arraybuffer';
+        this.socket.onopen = () => {
+            this.socket.send(JSON.stringify(this.init));
+            this.queue.forEach(message => this.socket.send(message));
+            this.queue = [];
+        };
+        this.socket.onmessage = (event) => this.onMessage(event);
+        this.socket.onerror = () => this.fail('connection error');
+        this.socket.onclose = () => this.fail('connection closed');
+    }
+
+    static isSupported() {
+        return Boolean(window.WebSocket) && AudioRecorder.supportsPcm();
+    }
+
+    send(samples) {
+        this.post(samples.buffer);
+    }
+
+    end() {
+        this.post(JSON.stringify({ type: 'end' }));
+    }
+
+    post(message) {
+        if (this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(message);
+        } else if (this.socket.readyState === WebSocket.CONNECTING) {
+            this.queue.push(message);
+        }
+    }
+
+    onMessage(event) {
+        let message;
+        try {
+            message = JSON.parse(event.data);
+        } catch (err) {
+            return;
+        }
+        if (message.type === 'partial') {
+            this.emit('stream:partial', message);
+        } else if (message.type === 'result') {
+            this.done = true;
+            this.emit('stream:result', message);
+        } else if (message.type === 'error') {
+            this.fail(message.detail);
+        }
+    }
+
+    fail(detail) {
+        if (this.done) {
+            return;
+        }
+        this.done = true;
+        this.emit('stream:error', { detail });
+        this.socket.close();
+    }
+
+    emit(name, detail) {
+        document.dispatchEvent(new CustomEvent(name, { detail }));
+    }
+}
@@ -30,6 +30,7 @@
     const PHONE_WRONG_THRESHOLD = 0.5;
     const COLORS = { you: '#ea580c', reference: '#2f6fb3', good: '#10b981', mid: '#f59e0b', bad: '#ef4444' };
     const LANG_STORAGE_KEY = 'openpronounce.lang';
+    const LIVE_STORAGE_KEY = 'openpronounce.live';
 
     const RECORD_ERRORS = {
         insecure: 'Recording needs a secure page (https or localhost). You can still upload a file.',
@@ -56,6 +57,8 @@
         chartsDirty: false,
         busy: false,
         loadingTimers: [],
+        live: false,
+        stream: null,
     };
 
     let recorder;
@@ -75,14 +78,27 @@
         $('language-select').addEventListener('change', onLanguageChange);
         $('expected-text').addEventListener('input', hideTextHint);
 
+        setupLiveToggle();
+
         $('record-btn').addEventListener('click', onRecordClick);
         document.addEventListener('record:start', onRecordStart);
         document.addEventListener('record:stop', onRecordStop);
         document.addEventListener('record:silence', () => silenceSound.play().catch(() => { }));
+        document.addEventListener('record:pcm', (e) => {
+            if (state.stream) {
+                state.stream.send(e.detail.samples);
+            }
+        });
         document.addEventListener('record:ready', (e) => {
             setAudio(e.detail.blob, 'recording.webm', false);
-            analyze();
+            // A live take gets its result over the socket; the upload is only the fallback
+            if (!state.stream) {
+                analyze();
+            }
         });
+        document.addEventListener('stream:partial', onStreamPartial);
+        document.addEventListener('stream:result', onStreamResult);
+        document.addEventListener('stream:error', onStreamError);
         document.addEventListener('record:error', (e) => {
             showRecordError(RECORD_ERRORS[e.detail && e.detail.reason] || RECORD_ERRORS.unknown);
         });
@@ -214,10 +230,15 @@
             return;
         }
         hideRecordError();
-        recorder.start();
+        recorder.start({ pcm: state.live });
     }
 
-    function onRecordStart() {
+    function onRecordStart(e) {
+        if (state.live && e.detail && e.detail.sampleRate) {
+            state.stream = new PronunciationStream({
+                expectedText: expectedText(), lang: state.lang, sampleRate: e.detail.sampleRate,
+            });
+        }
         const btn = $('record-btn');
         btn.classList.add('is-recording');
         btn.setAttribute('aria-label', 'Stop recording');
@@ -248,6 +269,50 @@
         $('record-timer').textContent = '00:00';
         clearInterval(timerInterval);
         timerInterval = null;
+        if (state.stream) {
+            state.stream.end();
+            state.busy = true;
+            $('record-btn').disabled = true;
+            setView('loading');
+        }
+    }
+
+    // ---------------------------------------------------------------- live mode
+
+    function setupLiveToggle() {
+        const toggle = $('live-toggle');
+        if (!PronunciationStream.isSupported()) {
+            toggle.closest('label').classList.add('hidden');
+            return;
+        }
+        toggle.checked = state.live = localStorage.getItem(LIVE_STORAGE_KEY) === '1';
+        toggle.addEventListener('change', () => {
+            state.live = toggle.checked;
+            localStorage.setItem(LIVE_STORAGE_KEY, state.live ? '1' : '0');
+        });
+    }
+
+    function onStreamPartial(e) {
+        if (recorder.isRecording() && e.detail.heard_phones.length) {
+            $('record-hint').textContent = `/${e.detail.heard_phones.join(' ')}/`;
+        }
+    }
+
+    function onStreamResult(e) {
+        state.stream = null;
+        state.busy = false;
+        $('record-btn').disabled = false;
+        renderResult(e.detail);
+    }
+
+    function onStreamError() {
+        // Live feedback is a bonus: score the recording the usual way
+        state.stream = null;
+        state.busy = false;
+        $('record-btn').disabled = false;
+        if (state.blob && !recorder.isRecording()) {
+            analyze();
+        }
     }
 
     function showRecordError(message) {
@@ -498,7 +563,11 @@
 
     function renderHeard(data) {
         const transcript = (data.transcribe || '').trim();
-        $('transcript').textContent = transcript ? transcript.toLowerCase() : 'nothing we could recognize';
+        if (data.transcribe === undefined) {
+            $('transcript').textContent = 'not transcribed in live mode';
+        } else {
+            $('transcript').textContent = transcript ? transcript.toLowerCase() : 'nothing we could recognize';
+        }
 
         const heard = data.differences.heard_phones || [];
         const confidences = data.differences.heard_phones_confidence || [];
@@ -634,7 +703,12 @@
             const formData = new FormData();
             formData.append('text', expectedText());
             formData.append('lang', state.lang);
-            const response = await fetch('/tts', { method: 'POST', body: formData });
+            // A learner is waiting on this one: skip the batch lane /tts defaults to
+            const response = await fetch('/tts', {
+                method: 'POST',
+                body: formData,
+                headers: { 'X-Priority': 'interactive' },
+            });
             if (!response.ok) {
                 throw new Error('tts failed');
             }
@@ -671,6 +745,8 @@
         const expected = diff.expected_vector || [];
         const heard = diff.transcribed_vector || [];
         const n = Math.max(expected.length, heard.length);
+        // Empty in the phones-only mode, which has no transcription to trace.
+        $('phoneme-trace').classList.toggle('hidden', n === 0);
         lineChart('phoneme-chart', Array.from({ length: n }, (_, i) => i + 1), [
             { label: 'Reference', data: expected, borderColor: COLORS.reference },
             { label: 'You', data: heard, borderColor: COLORS.you },
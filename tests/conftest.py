@@ -0,0 +1,21 @@
+from unittest.mock import patch
+
+import pytest
+
+from openpronounce import audiocache
+
+
+@pytest.fixture(autouse=True)
+def empty_audio_cache():
+    """The models are mocked: results cached by an earlier test for the same waveform must not leak in."""
+    audiocache.clear()
+    yield
+
+
+@pytest.fixture
+def without_quality_gate():
+    """For server tests that upload silent placeholder audio to a mocked analysis."""
+    import server
+
+    with patch.object(server, "QUALITY_GATE", False):
+        yield
@@ -11,6 +11,8 @@ import soundfile as sf
 
 from openpronounce import audio, tts
 
+ASSETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+
 
 def sine(sr, seconds=0.5, freq=440.0):
     t = np.arange(int(sr * seconds)) / sr
@@ -50,6 +52,30 @@ class TestLoad(unittest.TestCase):
         out = audio.webm2wav(webm)
         self.assertTrue(out.endswith("rec.16k.wav"))
 
+    def test_max_seconds(self):
+        self.assertEqual(len(audio.load(self.path, max_seconds=1)), len(audio.load(self.path)))
+        with self.assertRaises(audio.AudioTooLongError) as raised:
+            audio.load(self.path, max_seconds=0.25)
+        self.assertIsInstance(raised.exception, ValueError)
+        self.assertEqual(raised.exception.max_seconds, 0.25)
+
+    def test_max_seconds_stops_decoding_without_a_header_duration(self):
+        with patch.object(audio.sf, "info", side_effect=RuntimeError("no header")), \
+                patch.object(audio.librosa, "load", wraps=audio.librosa.load) as mock_load:
+            with self.assertRaises(audio.AudioTooLongError):
+                audio.load(self.path, max_seconds=0.25)
+        self.assertEqual(mock_load.call_args.kwargs["duration"], 1.25)
+
+    @unittest.skipUnless(shutil.which("ffmpeg"), "ffmpeg not installed")
+    def test_ffmpeg_decoding_is_capped(self):
+        long_file = os.path.join(self.tmp.name, "long.webm")
+        subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "sine=duration=30", "-c:a", "libopus",
+                        long_file], check=True)
+        self.assertLess(len(audio._decode_with_ffmpeg(long_file, audio.TARGET_SR, max_seconds=5)),
+                        7 * audio.TARGET_SR)
+        with self.assertRaises(audio.AudioTooLongError):
+            audio.load(long_file, max_seconds=5)
+
     def test_webm2wav_unreadable_file(self):
         bad = os.path.join(self.tmp.name, "bad.webm")
         with open(bad, "wb") as f:
@@ -163,5 +189,49 @@ class TestText2Speech(unittest.TestCase):
         self.assert_16k_mono_wav(target)
 
 
+class TestQuality(unittest.TestCase):
+
+    def speech(self, seconds=2.0, level=0.3, noise=0.003):
+        """A 150 Hz tone switched on and off twice a second over a little noise."""
+        t = np.arange(int(16000 * seconds)) / 16000
+        voiced = level * np.sin(2 * np.pi * 150 * t) * (np.sin(2 * np.pi * 2 * t) > 0)
+        return (voiced + noise * np.random.default_rng(0).standard_normal(len(t))).astype(np.float32)
+
+    def problems(self, waveform):
+        quality = audio.assess_quality(waveform)
+        self.assertEqual(quality["ok"], not quality["problems"])
+        return [problem["code"] for problem in quality["problems"]]
+
+    def test_speech_passes(self):
+        quality = audio.assess_quality(self.speech())
+        self.assertTrue(quality["ok"])
+        self.assertAlmostEqual(quality["speech_ratio"], 0.5, delta=0.1)
+        self.assertGreater(quality["snr_db"], 20)
+
+    def test_unusable_recordings(self):
+        self.assertEqual(self.problems(self.speech(seconds=0.3)), ["too_short"])
+        self.assertEqual(self.problems(np.zeros(32000, dtype=np.float32)), ["silent"])
+        self.assertEqual(self.problems(self.speech(level=0.0, noise=0.1)), ["no_speech"])
+        self.assertEqual(self.problems(np.clip(self.speech() * 10, -1, 1)), ["clipped"])
+
+    def test_noisy_when_the_background_is_close_to_the_speech(self):
+        speech = audio.load(os.path.join(ASSETS, "harvard.wav"))
+        rng = np.random.default_rng(0)
+        for snr_db in (0, -5):  # white noise at this overall signal-to-noise ratio
+            noise = rng.standard_normal(len(speech)) * np.sqrt(np.mean(speech ** 2) / 10 ** (snr_db / 10))
+            self.assertEqual(self.problems((speech + noise).astype(np.float32)), ["noisy"])
+
+    def test_trim_silence(self):
+        silence = np.zeros(16000, dtype=np.float32)
+        waveform = np.concatenate([silence, self.speech(noise=0.0), silence])
+        waveform[100:140] = 0.9  # a click before the speech is not speech
+        trimmed = audio.trim_silence(waveform)
+        # the tone is last on from 1.5 to 1.75 s of the speech; 0.2 s of padding, within a frame
+        self.assertAlmostEqual(trimmed.start / 16000, 1.0 - audio.TRIM_PADDING, delta=audio.QUALITY_FRAME)
+        self.assertAlmostEqual(trimmed.end / 16000, 2.75 + audio.TRIM_PADDING, delta=audio.QUALITY_FRAME)
+        np.testing.assert_array_equal(trimmed.waveform, waveform[trimmed.start:trimmed.end])
+        self.assertEqual(audio.trim_silence(silence), (silence, 0, 16000))
+
+
 if __name__ == "__main__":
     unittest.main()
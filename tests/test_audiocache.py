@@ -0,0 +1,60 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from openpronounce import audiocache, speech
+
+
+class TestAudioCache(unittest.TestCase):
+
+    def test_fingerprint(self):
+        sound = np.random.default_rng(0).standard_normal(16000).astype(np.float32)
+        self.assertEqual(audiocache.fingerprint(sound, 16000), audiocache.fingerprint(sound.copy(), 16000))
+        self.assertNotEqual(audiocache.fingerprint(sound, 16000), audiocache.fingerprint(sound, 8000))
+        self.assertNotEqual(audiocache.fingerprint(sound, 16000),
+                            audiocache.fingerprint(sound.astype(np.float64), 16000))
+
+    def test_least_recently_used_is_evicted_past_the_byte_budget(self):
+        cache = audiocache.AudioCache(max_bytes=2500)
+        for key in "abc":
+            cache.put("embeddings", key, np.zeros(1000, dtype=np.uint8))
+        self.assertEqual(cache.get("embeddings", "a"), (False, None))
+        self.assertTrue(cache.get("embeddings", "b")[0])  # now the most recently used
+        cache.put("embeddings", "d", np.zeros(1000, dtype=np.uint8))
+        self.assertEqual([cache.get("embeddings", key)[0] for key in "bcd"], [True, False, True])
+        self.assertEqual(cache.nbytes, 2000)
+        cache.put("embeddings", "e", np.zeros(3000, dtype=np.uint8))  # larger than the cache: not kept
+        self.assertEqual(len(cache), 2)
+
+
+class TestAnalysisReuse(unittest.TestCase):
+
+    @patch("openpronounce.speech.phones.recognize_phones", return_value=["h", "ə", "l", "oʊ"])
+    @patch("openpronounce.speech.interpolate_f0", side_effect=lambda f0: f0)
+    @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0]))
+    @patch("openpronounce.speech.transcribe", return_value="HELLO")
+    @patch("openpronounce.speech.audio.load", side_effect=lambda path, sr=16000: np.full(8000, len(path), np.float32))
+    @patch("openpronounce.speech.audio.text2speech", side_effect=lambda text, lang: f"{text}.wav")
+    @patch("openpronounce.speech.extract_embeddings", side_effect=lambda sound, sr: np.zeros((10, 4)))
+    def test_same_audio_against_another_text_skips_the_models(self, extract_embeddings, text2speech, _load, transcribe,
+                                                              extract_energy, _f0, _interp, recognize_phones):
+        sound = np.random.default_rng(0).standard_normal(16000).astype(np.float32)
+        first = speech.compare_audio_with_text(sound, "hello", use_phone_model=True)
+        second = speech.compare_audio_with_text(sound.copy(), "yellow", use_phone_model=True)
+        self.assertEqual(first["transcribe"], second["transcribe"])
+        self.assertEqual(first["prosody"], second["prosody"])
+        self.assertEqual([c.args[0] for c in text2speech.call_args_list], ["hello", "yellow"])
+        # learner once, and the two reference voices (of different lengths of file name)
+        self.assertEqual(extract_embeddings.call_count, 3)
+        for model in (transcribe, recognize_phones, extract_energy):
+            self.assertEqual(model.call_count, 1)
+
+        speech.compare_audio_with_text(sound[::-1].copy(), "hello", use_phone_model=True)
+        self.assertEqual(transcribe.call_count, 2)
+        self.assertEqual(extract_embeddings.call_count, 4)  # the reference of "hello" is cached too
+
+
+if __name__ == "__main__":
+    unittest.main()
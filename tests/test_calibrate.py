@@ -0,0 +1,82 @@
+import contextlib
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from scipy.stats import rankdata, spearmanr
+
+from openpronounce import calibrate, cli
+
+
+def synthetic(n=400, seed=0):
+    """Components and human scores that follow the acoustic distance and the phone errors."""
+    rng = np.random.default_rng(seed)
+    distance = rng.normal(10, 2, n)
+    per = np.clip(rng.normal(0.3, 0.2, n), 0, 1.2)
+    wer = np.round(rng.uniform(0, 1, n), 1)
+    human = np.clip(np.round(16 - distance - 6 * per + rng.normal(0, 0.5, n)), 0, 10)
+    return (distance, per, wer), human
+
+
+class TestRanks(unittest.TestCase):
+
+    def test_rankdata_matches_scipy_with_ties(self):
+        x = np.random.default_rng(1).integers(0, 4, (5, 40)).astype(float)
+        np.testing.assert_allclose(calibrate.rankdata(x), np.vstack([rankdata(row) for row in x]))
+
+    def test_grid_spearman_matches_scipy_on_subsets(self):
+        components, human = synthetic()
+        grid = calibrate.make_grid(goods=(4.0, 6.0), bads=(15.0,), step=0.25)
+        subset = np.random.default_rng(2).permutation(len(human))[:150]
+        rho = calibrate.grid_spearman(components, human, grid, subsets=[np.arange(len(human)), subset], chunk=7)
+        for i in range(len(grid)):
+            scores = calibrate.scores(components, calibrate.Grid(*(a[i:i + 1] for a in grid)))[0]
+            self.assertAlmostEqual(rho[0, i], spearmanr(scores, human).correlation, places=5)
+            self.assertAlmostEqual(rho[1, i], spearmanr(scores[subset], human[subset]).correlation, places=5)
+
+
+class TestCalibrate(unittest.TestCase):
+
+    def test_grid(self):
+        grid = calibrate.make_grid(goods=(5.0, 6.0), bads=(15.0,), step=0.5, extra=[((0.3, 0.4, 0.3), 6.0, 15.0)])
+        # 6 weight triples, 2 bound pairs except for the 3 triples without acoustic weight, plus the extra point
+        self.assertEqual(len(grid), 3 * 2 + 3 + 1)
+        np.testing.assert_allclose(grid.weights.sum(axis=1), 1)
+        self.assertEqual(grid.point(grid.find(((0.3, 0.4, 0.3), 6.0, 15.0))), ((0.3, 0.4, 0.3), 6.0, 15.0))
+        with self.assertRaises(ValueError):
+            grid.find(((0.3, 0.4, 0.3), 7.0, 15.0))
+
+    def test_finds_the_weights_that_follow_the_ratings(self):
+        components, human = synthetic()
+        grid = calibrate.make_grid(goods=(4.0, 6.0), bads=(12.0, 15.0), step=0.25,
+                                   extra=[calibrate.current_constants()])
+        result = calibrate.calibrate(components, human, grid)
+        self.assertEqual(result["best"]["weights"]["words"], 0)
+        self.assertGreater(result["best"]["spearman"], result["current"]["spearman"])
+        self.assertEqual(len(result["cv"]["tuned"]["folds"]), 6)
+        self.assertGreater(result["cv"]["tuned"]["mean"], result["cv"]["current"]["mean"])
+
+    def test_cli(self):
+        components, human = synthetic(n=60)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "results.csv")
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow([*calibrate.COMPONENTS, "human_total"])
+                writer.writerows(zip(*components, human))
+                writer.writerow(["", 0.1, 0.1, 5])  # skipped
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                status = cli.main(["calibrate", path, "--good", "5:6", "--bad", "15:15", "--step", "0.5", "--json"])
+        self.assertEqual(status, 0)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result["n"], 60)
+        self.assertEqual(set(result["best"]), {"weights", "good", "bad", "spearman"})
+
+
+if __name__ == "__main__":
+    unittest.main()
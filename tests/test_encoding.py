@@ -0,0 +1,128 @@
+import io
+import json
+import unittest
+from unittest.mock import patch
+
+import msgpack
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import encoding
+
+
+def full_result(frames=500):
+    rng = np.random.default_rng(0)
+    return {
+        "score": 87.5,
+        "distance": 120,
+        "differences": {
+            "errors": [{"word": "world", "position": 1}],
+            "expected_vector": [104.0, 601.0, 108.0, 111.0] * 20,
+            "transcribed_vector": [104.0, 601.0, 601.0, 111.0] * 20,
+            "phoneme_error_rate": 0.2,
+        },
+        "transcribe": "HELLO WORD",
+        "prosody": {"f0": (100 + 50 * rng.random(frames)).tolist(), "energy": (250 * rng.random(frames)).tolist()},
+    }
+
+
+class TestSelectFields(unittest.TestCase):
+
+    def test_dotted_paths(self):
+        result = full_result()
+        self.assertEqual(encoding.select_fields(result, "score, differences.errors"),
+                         {"score": 87.5, "differences": {"errors": [{"word": "world", "position": 1}]}})
+        self.assertEqual(encoding.select_fields(result, ["prosody"]), {"prosody": result["prosody"]})
+
+    def test_unknown_field(self):
+        for fields in ("scores", "score.value", "differences.nope"):
+            with self.assertRaises(ValueError):
+                encoding.select_fields(full_result(), fields)
+
+
+class TestDownsample(unittest.TestCase):
+
+    def test_bin_means(self):
+        np.testing.assert_allclose(encoding.downsample(np.arange(10), 5), [0.5, 2.5, 4.5, 6.5, 8.5])
+        self.assertEqual(len(encoding.downsample(np.arange(1001), 100)), 100)
+        np.testing.assert_array_equal(encoding.downsample([1, 2, 3], 10), [1, 2, 3])
+
+    def test_prosody_only(self):
+        result = full_result()
+        small = encoding.downsample_prosody(result, 50)
+        self.assertEqual(len(small["prosody"]["f0"]), 50)
+        self.assertEqual(len(small["differences"]["expected_vector"]), 80)
+        self.assertEqual(len(result["prosody"]["f0"]), 500)  # input untouched
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_compact_json_round_trip(self):
+        result = full_result()
+        body = json.loads(encoding.encode(result, encoding.COMPACT_JSON))
+        f0 = encoding.unpack_array(body["prosody"]["f0"])
+        np.testing.assert_allclose(f0, result["prosody"]["f0"], atol=0.1)
+        np.testing.assert_array_equal(encoding.unpack_array(body["differences"]["expected_vector"]),
+                                      result["differences"]["expected_vector"])
+        self.assertEqual(body["differences"]["errors"], result["differences"]["errors"])
+        self.assertIsInstance(result["prosody"]["f0"], list)  # input untouched
+        self.assertLess(len(encoding.encode(result, encoding.COMPACT_JSON)),
+                        len(encoding.encode(result)) / 3)
+
+    def test_large_values_stay_float32(self):
+        packed = json.loads(encoding.encode({"prosody": {"f0": [4000.5]}}, encoding.COMPACT_JSON))
+        self.assertEqual(packed["prosody"]["f0"]["dtype"], "float32")
+        self.assertEqual(encoding.unpack_array(packed["prosody"]["f0"]).tolist(), [4000.5])
+
+    def test_msgpack(self):
+        result = full_result()
+        decoded = msgpack.unpackb(encoding.encode(result, encoding.MSGPACK))
+        self.assertEqual(decoded["score"], 87.5)
+        np.testing.assert_allclose(decoded["prosody"]["energy"], result["prosody"]["energy"], rtol=1e-6)
+
+    def test_negotiate(self):
+        self.assertEqual(encoding.negotiate(None), encoding.JSON)
+        self.assertEqual(encoding.negotiate("text/html, */*"), encoding.JSON)
+        self.assertEqual(encoding.negotiate("application/x-msgpack"), encoding.MSGPACK)
+        self.assertEqual(encoding.negotiate(f"{encoding.COMPACT_JSON};q=1, application/json;q=0.5"),
+                         encoding.COMPACT_JSON)
+        with patch.object(encoding, "_msgpack", return_value=None):
+            self.assertEqual(encoding.negotiate("application/msgpack"), encoding.JSON)
+
+
+@pytest.mark.usefixtures("without_quality_gate")
+class TestPronunciationEndpoint(unittest.TestCase):
+
+    def post(self, headers=None, **data):
+        import soundfile as sf
+
+        buf = io.BytesIO()
+        sf.write(buf, np.zeros(16000, dtype="float32"), 16000, format="WAV")
+        buf.seek(0)
+        return TestClient(server.app).post("/pronunciation", files={"file": ("rec.wav", buf, "audio/wav")},
+                                           data={"expected_text": "hello world", **data}, headers=headers or {})
+
+    @patch("server.speech.compare_audio_with_text", side_effect=lambda *a, **k: full_result())
+    def test_fields_points_and_encodings(self, _):
+        self.assertEqual(self.post().json(), json.loads(json.dumps(full_result())))
+        self.assertEqual(self.post(fields="score,transcribe").json(), {"score": 87.5, "transcribe": "HELLO WORD"})
+        self.assertEqual(len(self.post(prosody_points="20").json()["prosody"]["energy"]), 20)
+
+        response = self.post(headers={"Accept": "application/msgpack"}, fields="prosody", prosody_points="10")
+        self.assertEqual(response.headers["content-type"], "application/msgpack")
+        self.assertEqual(len(msgpack.unpackb(response.content)["prosody"]["f0"]), 10)
+
+        response = self.post(headers={"Accept": encoding.COMPACT_JSON})
+        self.assertTrue(response.headers["content-type"].startswith(encoding.COMPACT_JSON))
+        self.assertEqual(response.json()["prosody"]["f0"]["dtype"], "float16")
+
+    @patch("server.speech.compare_audio_with_text", side_effect=lambda *a, **k: full_result())
+    def test_bad_parameters(self, _):
+        self.assertEqual(self.post(fields="score,nope").status_code, 422)
+        self.assertEqual(self.post(prosody_points="-1").status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
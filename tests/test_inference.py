@@ -0,0 +1,111 @@
+import os
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import torch
+
+from openpronounce import inference, phones
+from openpronounce.inference import FRAME_STRIDE
+
+ASSETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+
+
+def phone_model_is_cached():
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return False
+    return isinstance(try_to_load_from_cache(phones.PHONE_MODEL_NAME, "config.json"), str)
+
+
+class LocalModel(torch.nn.Module):
+    """Stand-in for Wav2Vec2 with the same framing (400-sample receptive field, stride 320)
+    and a receptive field of a few frames, so windowed and full outputs must match exactly."""
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv1d(1, 8, kernel_size=400, stride=FRAME_STRIDE)
+        self.context = torch.nn.Conv1d(8, 8, kernel_size=5, padding=2)
+
+    def forward(self, x):
+        return self.context(self.conv(x.unsqueeze(1))).transpose(1, 2)
+
+
+class TestWindows(unittest.TestCase):
+
+    def test_short_input_is_a_single_window(self):
+        self.assertEqual(inference.windows(1000, 16000, 3200), [(0, 1000, 0, 1000)])
+
+    def test_kept_ranges_cover_the_input(self):
+        for n_samples in (16001, 50000, 16000 * 7 + 123, 16000 * 30):
+            windows = inference.windows(n_samples, 16000, 3200)
+            self.assertEqual(windows[0][2], 0)
+            self.assertEqual(windows[-1][3], n_samples)
+            for (_, _, _, end), (_, _, start, _) in zip(windows, windows[1:]):
+                self.assertEqual(end, start)
+            for start, end, keep_start, keep_end in windows:
+                self.assertLessEqual(end - start, 16000)
+                self.assertEqual(start % FRAME_STRIDE, 0)
+                self.assertLessEqual(start, keep_start)
+                self.assertGreaterEqual(end, keep_end)
+            for start, _, keep_start, _ in windows[1:]:
+                self.assertGreaterEqual(keep_start - start, 1600)
+
+    def test_overlap_must_fit_in_the_window(self):
+        with self.assertRaises(ValueError):
+            inference.windows(100000, 16000, 16000)
+
+
+class TestRunWindowed(unittest.TestCase):
+
+    def setUp(self):
+        self.model = LocalModel()
+        self.input_values = torch.randn(1, 16000 * 7 + 123)
+
+    def test_windowed_output_matches_a_single_pass(self):
+        with torch.no_grad():
+            full = self.model(self.input_values)
+        with patch("openpronounce.inference.get_device", return_value=torch.device("cpu")):
+            windowed = inference.run_windowed(self.model, self.input_values, window=2, overlap=0.5)
+        self.assertEqual(windowed.shape, full.shape)
+        torch.testing.assert_close(windowed, full, rtol=1e-4, atol=1e-5)
+
+    def test_disabled_or_short_input_runs_once(self):
+        calls = []
+
+        def forward(x):
+            calls.append(x.shape[-1])
+            return self.model(x)
+
+        with patch("openpronounce.inference.get_device", return_value=torch.device("cpu")):
+            inference.run_windowed(forward, self.input_values, window=0)
+            inference.run_windowed(forward, self.input_values, window=10)
+            inference.run_windowed(forward, self.input_values, window=2, overlap=0.5)
+        self.assertEqual(calls[:2], [self.input_values.shape[-1]] * 2)
+        self.assertTrue(all(n <= 32000 for n in calls[2:]))
+        self.assertGreater(len(calls), 5)
+
+
+@unittest.skipUnless(phone_model_is_cached(), "phone model not downloaded")
+class TestPhonePosteriors(unittest.TestCase):
+    """Windowed inference of the real phone model stays close to a single pass."""
+
+    def test_posterior_mismatch_is_bounded(self):
+        from openpronounce import audio
+
+        for name in ("harvard.wav", "mispronounced_audio.wav"):
+            sound = audio.load(os.path.join(ASSETS, name))
+            with patch.object(inference, "CHUNK_SECONDS", 0):
+                full = phones.phone_log_posteriors(sound)
+            with patch.object(inference, "CHUNK_SECONDS", 6), patch.object(inference, "CHUNK_OVERLAP", 2):
+                windowed = phones.phone_log_posteriors(sound)
+            self.assertEqual(windowed.shape, full.shape)
+            mismatch = np.abs(np.exp(windowed) - np.exp(full)).sum(axis=1)
+            self.assertLess(mismatch.mean(), 0.05, name)
+            self.assertGreater((windowed.argmax(axis=1) == full.argmax(axis=1)).mean(), 0.97, name)
+
+
+if __name__ == "__main__":
+    unittest.main()
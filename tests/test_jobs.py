@@ -0,0 +1,210 @@
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import jobs, scheduler
+
+
+class TestJobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = jobs.JobStore(self.tmp.name)
+
+    def test_items_go_through_the_queue_in_order(self):
+        job_id = self.store.create([(np.zeros(100), "one"), (np.ones(50), "two")], lang="fr")
+        self.assertEqual(self.store.get(job_id)["status"], "queued")
+
+        first = self.store.claim()
+        self.assertEqual(first[:5], (job_id, 0, "one", "fr", "sentence"))
+        self.assertEqual(len(first[5]), 100)
+        self.assertEqual(self.store.get(job_id)["status"], "running")
+        self.store.finish(job_id, 0, result={"score": 80.0})
+
+        second = self.store.claim()
+        np.testing.assert_array_equal(second[5], np.ones(50))
+        self.store.finish(job_id, 1, error="decoding failed")
+        self.assertIsNone(self.store.claim())
+
+        job = self.store.get(job_id)
+        self.assertEqual((job["status"], job["done"], job["failed"]), ("done", 1, 1))
+        self.assertEqual([item["score"] for item in job["items"]], [80.0, None])
+        self.assertEqual(self.store.results(job_id), [
+            {"index": 0, "text": "one", "status": "done", "result": {"score": 80.0}},
+            {"index": 1, "text": "two", "status": "failed", "error": "decoding failed"},
+        ])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, job_id)))  # recordings dropped
+
+    def test_items_of_a_dead_process_are_requeued(self):
+        job_id = self.store.create([(np.zeros(10), "one")])
+        crashed = jobs.JobStore(self.tmp.name, lease=0.05)
+        crashed.claim()
+        other = jobs.JobStore(self.tmp.name)
+        self.assertEqual(other.requeue_expired(), 0)  # its lease still runs
+        time.sleep(0.1)
+        self.assertEqual(other.requeue_expired(), 1)
+        self.assertEqual(other.claim()[:2], (job_id, 0))
+
+    def test_renewed_leases_are_not_requeued(self):
+        self.store.create([(np.zeros(10), "one")])
+        running = jobs.JobStore(self.tmp.name, lease=0.2)
+        running.claim()
+        time.sleep(0.15)
+        self.assertEqual(running.renew(), 1)
+        time.sleep(0.1)
+        self.assertEqual(self.store.requeue_expired(), 0)
+
+    def test_unreadable_recording_fails_its_item(self):
+        job_id = self.store.create([(np.zeros(10), "one"), (np.ones(10), "two")])
+        os.remove(os.path.join(self.tmp.name, job_id, "0.npy"))
+        self.assertEqual(self.store.claim()[:2], (job_id, 1))
+        self.assertEqual(self.store.get(job_id)["items"][0]["status"], "failed")
+
+    def test_validation(self):
+        self.assertIsNone(self.store.get("nope"))
+        with self.assertRaises(ValueError):
+            self.store.create([])
+        with self.assertRaises(ValueError):
+            self.store.create([(np.zeros(10), "one")], mode="paragraph")
+
+
+class TestJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = jobs.JobStore(self.tmp.name)
+
+    def test_failures_are_recorded(self):
+        def analyze(waveform, text, lang, mode):
+            if text == "bad":
+                raise RuntimeError("boom")
+            return {"score": float(len(waveform))}
+
+        job_id = self.store.create([(np.zeros(3), "good"), (np.zeros(3), "bad")])
+        runner = jobs.JobRunner(self.store, analyze=analyze)
+        while runner.run_one():
+            pass
+        self.assertEqual([(r["status"], r.get("error")) for r in self.store.results(job_id)],
+                         [("done", None), ("failed", "boom")])
+
+    def test_item_is_queued_again_when_its_result_cannot_be_recorded(self):
+        job_id = self.store.create([(np.zeros(3), "one")])
+        runner = jobs.JobRunner(self.store, analyze=lambda *a: {"score": 1.0})
+        finish = self.store.finish
+        with patch.object(self.store, "finish", side_effect=sqlite3.OperationalError("database is locked")):
+            with self.assertRaises(sqlite3.OperationalError):
+                runner.run_one()
+        self.assertEqual(self.store.get(job_id)["status"], "queued")
+        self.assertEqual(self.store.renew(), 0)
+        with patch.object(self.store, "finish", side_effect=finish) as retried:
+            self.assertTrue(runner.run_one())
+        retried.assert_called_once()
+        self.assertEqual(self.store.results(job_id)[0]["status"], "done")
+
+    def test_runs_in_the_batch_lane(self):
+        self.store.create([(np.zeros(3), "one")])
+        started = threading.Event()
+        runner = jobs.JobRunner(self.store, analyze=lambda *a: started.set() or {"score": 1.0})
+        lanes = scheduler.Scheduler(slots=2, reserved=1)
+        with patch.object(scheduler, "get_scheduler", return_value=lanes):
+            release = lanes.acquire("batch")  # the only slot batch work may use
+            thread = threading.Thread(target=runner.run_one)
+            thread.start()
+            self.assertFalse(started.wait(0.2))
+            release()
+            self.assertTrue(started.wait(5))
+            thread.join(5)
+
+
+class TestJobEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def wav(self):
+        import soundfile as sf
+        buf = io.BytesIO()
+        sf.write(buf, np.zeros(16000, dtype="float32"), 16000, format="WAV")
+        buf.seek(0)
+        return buf
+
+    @patch("openpronounce.jobs.analyze_item", side_effect=lambda waveform, text, lang, mode, **k: {"score": 50.0,
+                                                                                                   "t": text})
+    def test_submit_poll_and_stream(self, _):
+        with patch.object(jobs, "JOBS_DIR", self.tmp.name), patch.object(server, "JOB_POLL_SECONDS", 0.05), \
+                patch.object(server, "QUALITY_GATE", False):  # silent placeholder uploads
+            with TestClient(server.app) as client:
+                files = [("files", ("a.wav", self.wav(), "audio/wav")), ("files", ("b.wav", self.wav(), "audio/wav"))]
+                response = client.post("/jobs", files=files, data={"expected_text": ["Hello.", "Bye."]})
+                self.assertEqual(response.status_code, 202)
+                job_id = response.json()["id"]
+
+                lines = client.get(f"/jobs/{job_id}/results", params={"follow": "true"}).text.splitlines()
+                self.assertEqual([json.loads(line)["result"]["t"] for line in lines], ["Hello.", "Bye."])
+                job = client.get(f"/jobs/{job_id}").json()
+                self.assertEqual((job["status"], job["done"], job["total"]), ("done", 2, 2))
+
+                self.assertEqual(client.get("/jobs/nope").status_code, 404)
+                self.assertEqual(client.get("/jobs/nope/results").status_code, 404)
+
+    @patch("openpronounce.speech.phones.recognize_phones", return_value=["h", "ə", "l", "oʊ"])
+    @patch("openpronounce.speech.interpolate_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0]))
+    @patch("openpronounce.speech.transcribe", return_value="HELLO")
+    @patch("openpronounce.speech._reference_audio", return_value=np.zeros(16000, dtype=np.float32))
+    @patch("openpronounce.speech.extract_embeddings", return_value=np.zeros((10, 4)))
+    def test_sentence_items_are_trimmed_as_on_pronunciation(self, *_):
+        import soundfile as sf
+        voiced = 0.3 * np.random.default_rng(0).standard_normal(16000)
+        buf = io.BytesIO()
+        sf.write(buf, np.concatenate([np.zeros(16000), voiced, np.zeros(16000)]).astype("float32"), 16000,
+                 format="WAV")
+        buf.seek(0)
+        with patch.object(jobs, "JOBS_DIR", self.tmp.name), patch.object(server, "JOB_POLL_SECONDS", 0.05), \
+                patch.object(server, "TRIM_SILENCE", True), TestClient(server.app) as client:
+            job_id = client.post("/jobs", files=[("files", ("a.wav", buf, "audio/wav"))],
+                                 data={"expected_text": "hello"}).json()["id"]
+            line = client.get(f"/jobs/{job_id}/results", params={"follow": "true"}).text.splitlines()[0]
+        self.assertEqual(json.loads(line)["result"]["trimmed"], {"start": 0.78, "end": 2.215})
+
+    @patch("openpronounce.jobs.analyze_item")
+    def test_unusable_recordings_are_refused_before_queueing(self, analyze_item):
+        import soundfile as sf
+        speech = io.BytesIO()
+        sf.write(speech, 0.3 * np.random.default_rng(0).standard_normal(16000).astype("float32") *
+                 (np.arange(16000) % 8000 < 4000), 16000, format="WAV")
+        speech.seek(0)
+        with patch.object(jobs, "JOBS_DIR", self.tmp.name), patch.object(server, "QUALITY_GATE", True), \
+                TestClient(server.app) as client:
+            files = [("files", ("a.wav", speech, "audio/wav")), ("files", ("b.wav", self.wav(), "audio/wav"))]
+            response = client.post("/jobs", files=files, data={"expected_text": "hello"})
+        self.assertEqual(response.status_code, 422)
+        items = response.json()["detail"]["items"]
+        self.assertEqual([(item["index"], item["quality"]["problems"][0]["code"]) for item in items], [(1, "silent")])
+        analyze_item.assert_not_called()
+
+    def test_bad_requests(self):
+        with patch.object(jobs, "JOBS_DIR", self.tmp.name), TestClient(server.app) as client:
+            files = [("files", ("a.wav", self.wav(), "audio/wav"))] * 2
+            response = client.post("/jobs", files=files, data={"expected_text": ["one", "two", "three"]})
+            self.assertEqual(response.status_code, 422)
+            response = client.post("/jobs", files=files[:1], data={"expected_text": "one", "mode": "chapter"})
+            self.assertEqual(response.status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
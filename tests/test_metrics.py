@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import torch
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import metrics, speech, tracing
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_text_format(self):
+        histogram = metrics.Histogram("test_latency_seconds", "Test latency.", ("stage",), buckets=(0.1, 1.0))
+        self.addCleanup(metrics._metrics.remove, histogram)
+        histogram.observe(0.05, stage="a")
+        histogram.observe(0.5, stage="a")
+        histogram.observe(5, stage="a")
+        self.assertEqual(histogram.render().splitlines(), [
+            "# HELP test_latency_seconds Test latency.",
+            "# TYPE test_latency_seconds histogram",
+            'test_latency_seconds_bucket{stage="a",le="0.1"} 1',
+            'test_latency_seconds_bucket{stage="a",le="1"} 2',
+            'test_latency_seconds_bucket{stage="a",le="+Inf"} 3',
+            'test_latency_seconds_sum{stage="a"} 5.55',
+            'test_latency_seconds_count{stage="a"} 3',
+        ])
+        with self.assertRaises(ValueError):
+            histogram.observe(1.0, step="a")
+
+    def test_counter_escapes_labels(self):
+        counter = metrics.Counter("test_total", "Test.", ("name",))
+        self.addCleanup(metrics._metrics.remove, counter)
+        counter.inc(name='say "hi"\n')
+        counter.inc(2, name='say "hi"\n')
+        self.assertIn('test_total{name="say \\"hi\\"\\n"} 3', counter.render())
+
+    def test_spans_are_observed_once_enabled(self):
+        metrics.observe_stages(False)
+        with tracing.span("test_stage") as attributes:
+            self.assertIs(attributes, tracing._DISCARD)  # nobody listens: nothing is timed
+        self.assertEqual(metrics.STAGE_SECONDS.count(stage="test_stage"), 0)
+        metrics.observe_stages()
+        metrics.observe_stages()  # registered once
+        self.addCleanup(metrics.observe_stages, False)
+        with tracing.span("test_stage"):
+            pass
+        self.assertEqual(metrics.STAGE_SECONDS.count(stage="test_stage"), 1)
+
+    def test_loaded_models_are_reported(self):
+        with patch.dict(metrics._models, {"test-model": torch.nn.Linear(4, 2)}):
+            text = metrics.render()
+        self.assertIn('openpronounce_model_bytes{model="test-model",device="cpu"} 40', text)
+        self.assertIn('openpronounce_queue_depth{priority="batch"}', text)
+        self.assertIn('openpronounce_cache_requests_total{cache="lexicon",result="hit"}', text)
+
+    @patch("openpronounce.speech.phones.recognize_phones", return_value=["h", "ə", "l", "oʊ"])
+    @patch("openpronounce.speech.interpolate_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0]))
+    @patch("openpronounce.speech.transcribe", return_value="HELLO")
+    @patch("openpronounce.speech.audio.load", return_value=np.zeros(16000, dtype=np.float32))
+    @patch("openpronounce.speech.audio.text2speech", return_value="ref.wav")
+    @patch("openpronounce.speech.extract_embeddings", return_value=np.zeros((10, 4)))
+    def test_analysis_stages_are_timed(self, *_):
+        metrics.observe_stages()
+        self.addCleanup(metrics.observe_stages, False)
+        stages = ("embeddings", "reference_embeddings", "dtw", "phone_comparison", "prosody")
+        before = {stage: metrics.STAGE_SECONDS.count(stage=stage) for stage in stages}
+        speech.compare_audio_with_text(np.zeros(16000, dtype=np.float32), "hello", use_phone_model=True)
+        for stage in stages:
+            self.assertEqual(metrics.STAGE_SECONDS.count(stage=stage), before[stage] + 1, stage)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def test_requests_are_counted_by_endpoint_language_and_status(self):
+        client = TestClient(server.app)
+        labels = {"endpoint": "/tts", "lang": "fr", "status": "422"}
+        before = metrics.REQUESTS.value(**labels)
+        client.post("/tts?priority=urgent", data={"text": "bonjour", "lang": "fr"})
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertEqual(metrics.REQUESTS.value(**labels), before + 1)
+        self.assertIn('openpronounce_requests_total{endpoint="/tts",lang="fr",status="422"}', response.text)
+        self.assertIn("# TYPE openpronounce_stage_seconds histogram", response.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
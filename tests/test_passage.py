@@ -0,0 +1,156 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import passage, phones
+from openpronounce.inference import FRAME_STRIDE
+
+
+class TestSplitSentences(unittest.TestCase):
+
+    def test_final_punctuation_and_line_breaks(self):
+        text = "Hello there. How are you?\nFine, thanks!  Bye"
+        self.assertEqual(passage.split_sentences(text), ["Hello there.", "How are you?", "Fine, thanks!", "Bye"])
+
+    def test_sentences_without_words_are_dropped(self):
+        self.assertEqual(passage.split_sentences("Hi. ... \n\n - "), ["Hi."])
+        self.assertEqual(passage.split_sentences(""), [])
+
+
+class TestForcedAlignment(unittest.TestCase):
+
+    VOCAB = ("<pad>", "a", "b", "c")
+
+    def log_posteriors(self, frames):
+        """``frames`` is a string of tokens, one per frame, ``_`` for the blank."""
+        lp = np.full((len(frames), len(self.VOCAB)), 0.02)
+        for t, token in enumerate(frames):
+            lp[t, 0 if token == "_" else self.VOCAB.index(token)] = 0.94
+        return np.log(lp / lp.sum(axis=1, keepdims=True))
+
+    def test_spans_follow_the_posteriors(self):
+        lp = self.log_posteriors("__aa__b_cc__")
+        spans = passage.ctc_forced_align(lp, [(1,), (2,), (3,)])
+        self.assertEqual(spans, [(2, 4), (6, 7), (8, 10)])
+
+    def test_repeated_label_needs_a_blank(self):
+        lp = self.log_posteriors("a_a")
+        self.assertEqual(passage.ctc_forced_align(lp, [(1,), (1,)]), [(0, 1), (2, 3)])
+        self.assertIsNone(passage.ctc_forced_align(self.log_posteriors("aa"), [(1,), (1,)]))
+
+    def test_alternative_tokens(self):
+        lp = self.log_posteriors("_c_")
+        self.assertEqual(passage.ctc_forced_align(lp, [(2, 3)]), [(1, 2)])
+
+    def test_too_few_frames(self):
+        self.assertIsNone(passage.ctc_forced_align(self.log_posteriors("a"), [(1,), (2,)]))
+        self.assertEqual(passage.ctc_forced_align(self.log_posteriors("a"), []), [])
+
+
+class TestLocateSentences(unittest.TestCase):
+
+    VOCAB = ("<pad>", "h", "aɪ", "b")
+
+    def setUp(self):
+        processor = MagicMock()
+        processor.tokenizer.pad_token_id = 0
+        expected = {"Hi.": [["h", "aɪ"]], "Bye.": [["b", "aɪ"]]}
+        self.patches = [
+            patch.object(phones, "_load_model", return_value=(processor, None)),
+            patch.object(phones, "phone_vocab", return_value=self.VOCAB),
+            patch.object(phones, "get_expected_phones", side_effect=lambda s, lang: (["w"], expected[s])),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_silence_between_sentences_is_split_in_the_middle(self):
+        frames = "__h_aɪ______b_aɪ__".replace("aɪ", "A")
+        lp = np.full((len(frames), len(self.VOCAB)), 0.02)
+        for t, token in enumerate(frames):
+            lp[t, {"_": 0, "h": 1, "A": 2, "b": 3}[token]] = 0.94
+        stride = FRAME_STRIDE
+        with patch.object(phones, "phone_log_posteriors", return_value=np.log(lp)):
+            bounds = passage.locate_sentences(np.zeros(len(frames) * stride), ["Hi.", "Bye."])
+        # "Hi." ends at frame 5, "Bye." starts at frame 11: the cut is at frame 8.
+        self.assertEqual(bounds[0][1], 8 * stride)
+        self.assertEqual(bounds[1][0], 8 * stride)
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[1][1], len(frames) * stride)
+
+    def test_proportional_fallback(self):
+        with patch.object(phones, "phone_log_posteriors", return_value=np.log(np.full((3, 4), 0.25))):
+            bounds = passage.locate_sentences(np.zeros(3 * FRAME_STRIDE), ["Hi.", "Bye."])
+        self.assertEqual(len(bounds), 2)
+        self.assertEqual(bounds[0][1], bounds[1][0])
+
+
+def fake_result(score, words_with_errors=()):
+    errors = [{"word": w, "position": 0} for w in words_with_errors]
+    return {"score": score, "differences": {"errors": errors, "words_with_errors": list(words_with_errors)}}
+
+
+class TestPassage(unittest.TestCase):
+
+    @patch("openpronounce.passage.locate_sentences", return_value=[(0, 100), (100, 300)])
+    @patch("openpronounce.passage.speech.compare_audio_with_text")
+    def test_sentences_are_scored_and_aggregated(self, mock_compare, _locate):
+        mock_compare.side_effect = lambda sound, text, sr, lang: (
+            fake_result(90) if text.startswith("Hello") else fake_result(60, ["developer"]))
+        audio_waveform = np.arange(300, dtype=np.float32)
+        sentences = list(passage.iter_passage(audio_waveform, "Hello world. I am a developer.", workers=2))
+
+        self.assertEqual(sorted(s["index"] for s in sentences), [0, 1])
+        second = next(s for s in sentences if s["index"] == 1)
+        self.assertEqual(second["text"], "I am a developer.")
+        np.testing.assert_array_equal(
+            next(c.args[0] for c in mock_compare.call_args_list if c.args[1] == "I am a developer."),
+            audio_waveform[100:300],
+        )
+
+        result = passage.summarize_passage(sentences)
+        self.assertEqual(result["score"], round((90 * 2 + 60 * 4) / 6, 2))
+        self.assertEqual(result["differences"]["words_with_errors"], ["developer"])
+        self.assertEqual(result["differences"]["errors"][0]["sentence"], 1)
+        self.assertEqual([s["index"] for s in result["sentences"]], [0, 1])
+
+    def test_empty_text(self):
+        self.assertEqual(list(passage.iter_passage(np.zeros(10), " ... ")), [])
+
+
+@pytest.mark.usefixtures("without_quality_gate")
+class TestPassageEndpoint(unittest.TestCase):
+
+    @patch("server.passage.iter_passage")
+    def test_streams_ndjson(self, mock_iter):
+        import io
+
+        import soundfile as sf
+
+        mock_iter.return_value = iter([
+            {"index": 1, "text": "Bye.", "start": 1.0, "end": 2.0, "result": fake_result(50, ["bye"])},
+            {"index": 0, "text": "Hi.", "start": 0.0, "end": 1.0, "result": fake_result(100)},
+        ])
+        buf = io.BytesIO()
+        sf.write(buf, np.zeros(16000, dtype="float32"), 16000, format="WAV")
+        buf.seek(0)
+        response = TestClient(server.app).post(
+            "/passage", files={"file": ("rec.wav", buf, "audio/wav")}, data={"expected_text": "Hi. Bye."})
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line["type"] for line in lines], ["sentence", "sentence", "passage"])
+        self.assertEqual(lines[0]["index"], 1)
+        self.assertEqual(lines[-1]["score"], 75.0)
+        self.assertEqual(lines[-1]["differences"]["words_with_errors"], ["bye"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,11 @@
 import json
 import unittest
+from unittest.mock import MagicMock, patch
 
 import numpy as np
 
 from openpronounce import phones
+from openpronounce.inference import FRAME_STRIDE
 
 
 class TestNormalization(unittest.TestCase):
@@ -185,3 +187,60 @@ class TestConfidenceRule(unittest.TestCase):
         result = phones.compare_phones(self.recognition(["h", "u"]), "how")
         json.dumps(result)
         self.assertIsInstance(result["errors"][0]["phones"][1]["confidence"], float)
+
+
+class FakePhoneModel:
+    """Frame posteriors read from the audio itself: frame ``t`` is sure of the token whose
+    index is the sample at ``t * FRAME_STRIDE``, with Wav2Vec2's frame count."""
+
+    VOCAB = ("<pad>", "h", "ə", "l", "oʊ")
+
+    def __call__(self, audio_waveform, sampling_rate=16000):
+        n_frames = (len(audio_waveform) - 400) // FRAME_STRIDE + 1
+        lp = np.full((n_frames, len(self.VOCAB)), 0.01)
+        for t in range(n_frames):
+            lp[t, int(audio_waveform[t * FRAME_STRIDE])] = 0.96
+        return np.log(lp)
+
+
+class TestStreamingRecognizer(unittest.TestCase):
+
+    def setUp(self):
+        processor = MagicMock()
+        processor.tokenizer.pad_token_id = 0
+        self.model = FakePhoneModel()
+        self.patches = [
+            patch.object(phones, "_load_model", return_value=(processor, None)),
+            patch.object(phones, "phone_vocab", return_value=FakePhoneModel.VOCAB),
+            patch.object(phones, "phone_log_posteriors", side_effect=self.model),
+        ]
+        for p in self.patches:
+            p.start()
+        tokens = [0] * 20 + [1] * 10 + [0] * 30 + [2] * 15 + [0] * 40 + [3] * 10 + [0] * 5 + [3] * 10 + [4] * 20 + [0] * 60
+        self.audio = np.repeat(np.array(tokens, dtype=np.float32), FRAME_STRIDE)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_incremental_decoding_matches_a_single_pass(self):
+        full = phones.decode_ctc(self.model(self.audio), FakePhoneModel.VOCAB, 0)
+        recognizer = phones.StreamingRecognizer(context=0.5, lookahead=0.2, step=0.1)
+        partials = []
+        for start in range(0, len(self.audio), 1234):
+            if recognizer.feed(self.audio[start:start + 1234]):
+                partials.append(recognizer.update().phones)
+        final = recognizer.finish()
+        self.assertEqual(final.phones, ["h", "ə", "l", "oʊ"])
+        self.assertEqual(final.phones, full.phones)
+        self.assertEqual(final.spans, full.spans)
+        self.assertGreater(len(partials), 5)
+        self.assertEqual(partials[0], [])
+
+    def test_each_update_decodes_a_bounded_window(self):
+        recognizer = phones.StreamingRecognizer(context=0.5, lookahead=0.2, step=0.1)
+        for start in range(0, len(self.audio), 1600):
+            if recognizer.feed(self.audio[start:start + 1600]):
+                recognizer.update()
+        lengths = [len(c.args[0]) for c in phones.phone_log_posteriors.call_args_list]
+        self.assertLessEqual(max(lengths), 0.5 * 16000 + 0.2 * 16000 + 2 * 1600)
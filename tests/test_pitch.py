@@ -0,0 +1,62 @@
+import unittest
+
+import librosa
+import numpy as np
+
+from openpronounce import pitch
+
+SR = 16000
+
+
+def tone(frequencies, seconds=1.0):
+    """Harmonic tone whose pitch glides through ``frequencies``."""
+    n = int(seconds * SR)
+    f = np.interp(np.arange(n), np.linspace(0, n - 1, len(frequencies)), frequencies)
+    phase = 2 * np.pi * np.cumsum(f) / SR
+    return (0.3 * np.sin(phase) + 0.15 * np.sin(2 * phase) + 0.05 * np.sin(3 * phase)).astype(np.float32)
+
+
+class TestFastF0(unittest.TestCase):
+
+    def test_steady_tone(self):
+        f0 = pitch.fast_f0(tone([150, 150]), SR)
+        voiced = f0[f0 > 0]
+        self.assertGreater(len(voiced), 0.8 * len(f0))
+        np.testing.assert_allclose(voiced, 150, rtol=0.01)
+
+    def test_same_frames_as_the_energy_contour(self):
+        for n in (100, 2048, 16000, 16000 * 3 + 77):
+            sound = np.random.default_rng(n).standard_normal(n).astype(np.float32)
+            self.assertEqual(len(pitch.fast_f0(sound, SR)), librosa.feature.rms(y=sound).shape[1])
+
+    def test_silence_and_quiet_frames_are_unvoiced(self):
+        self.assertFalse(pitch.fast_f0(np.zeros(SR, dtype=np.float32), SR).any())
+        sound = np.concatenate([tone([200, 200]), np.zeros(SR, dtype=np.float32)])
+        f0 = pitch.fast_f0(sound, SR)
+        self.assertFalse(f0[-20:].any())
+        self.assertTrue(f0[5:25].all())
+
+    def test_follows_pyin_on_a_glide(self):
+        sound = tone([110, 220, 140], seconds=2.0)
+        fast = pitch.fast_f0(sound, SR)
+        reference = pitch.pyin_f0(sound, SR)
+        both = (fast > 0) & (reference > 0)
+        self.assertGreater(both.mean(), 0.8)
+        cents = np.abs(1200 * np.log2(fast[both] / reference[both]))
+        self.assertLess(np.median(cents), 50)
+        self.assertLess((cents > 300).mean(), 0.05)  # no octave jumps
+
+
+class TestExtractF0(unittest.TestCase):
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            pitch.extract_f0(np.zeros(SR), SR, method="crepe")
+
+    def test_methods_have_the_same_length(self):
+        sound = tone([150, 180])
+        self.assertEqual(len(pitch.extract_f0(sound, SR, "fast")), len(pitch.extract_f0(sound, SR, "pyin")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import torch
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import profiling, stages
+
+
+def workload():
+    torch.ones(64, 64) @ torch.ones(64, 64)
+    return stages.run_stages({"where": stages.Stage(lambda: threading.current_thread().name)})["where"]
+
+
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_reports_are_written_and_stages_run_in_the_profiled_thread(self):
+        with profiling.profile("req/1", "abc", directory=self.tmp.name) as report:
+            thread = workload()
+        self.assertEqual(thread, threading.current_thread().name)
+        self.assertTrue(os.path.basename(report).endswith("-req_1-abc"))
+        for extension in (".prof", ".txt", ".torch.json"):
+            self.assertTrue(os.path.exists(report + extension), extension)
+        with open(report + ".txt") as f:
+            text = f.read()
+        self.assertIn("workload", text)
+        self.assertIn("aten::mm", text)
+
+    def test_one_profile_at_a_time(self):
+        with profiling.profile("first", "a", directory=self.tmp.name):
+            with profiling.profile("second", "b", directory=self.tmp.name) as report:
+                self.assertIsNone(report)
+        self.assertEqual(len([f for f in os.listdir(self.tmp.name) if f.endswith(".prof")]), 1)
+
+    def test_input_hash(self):
+        sound = np.arange(100, dtype=np.float32)
+        self.assertEqual(profiling.input_hash(sound, "hi"), profiling.input_hash(sound.astype(np.float64), "hi"))
+        self.assertNotEqual(profiling.input_hash(sound, "hi"), profiling.input_hash(sound, "ho"))
+
+
+@pytest.mark.usefixtures("without_quality_gate")
+class TestProfileHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.client = TestClient(server.app)
+
+    def post(self, headers):
+        import soundfile as sf
+        buf = io.BytesIO()
+        sf.write(buf, np.zeros(1600, dtype="float32"), 16000, format="WAV")
+        buf.seek(0)
+        return self.client.post("/pronunciation", files={"file": ("rec.wav", buf, "audio/wav")},
+                                data={"expected_text": "hello"}, headers=headers)
+
+    @patch("server.speech.compare_audio_with_text", side_effect=lambda *a, **k: {"score": 50.0, "t": workload()})
+    def test_header_profiles_the_request_when_enabled(self, _):
+        headers = {"X-Profile": "1", "X-Request-ID": "slow-one"}
+        self.assertNotIn("x-profile-report", self.post(headers).headers)  # no OPENPRONOUNCE_PROFILE_DIR
+        with patch.object(profiling, "PROFILE_DIR", self.tmp.name):
+            self.assertNotIn("x-profile-report", self.post({}).headers)
+            response = self.post(headers)
+        self.assertEqual(response.status_code, 200)
+        report = response.headers["x-profile-report"]
+        self.assertIn("-slow-one-", report)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, report + ".prof")))
+
+
+if __name__ == "__main__":
+    unittest.main()
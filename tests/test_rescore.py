@@ -0,0 +1,144 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import soundfile as sf
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import cli, phones, rescore, speech
+
+VOCAB = ("<pad>", "h", "aʊ", "u")
+
+
+def recognition(heard=("h", "u")):
+    lp = np.full((len(heard) + 1, len(VOCAB)), 1e-6)
+    for t, phone in enumerate(heard):
+        lp[t, VOCAB.index(phone)] = 0.9
+    lp[-1, 0] = 0.9
+    return phones.decode_ctc(np.log(lp / lp.sum(axis=1, keepdims=True)), VOCAB)
+
+
+class TestSerialization(unittest.TestCase):
+
+    def test_round_trip(self):
+        original = recognition()
+        restored = phones.PhoneRecognition.from_bytes(original.to_bytes(), VOCAB)
+        self.assertEqual(restored.phones, original.phones)
+        self.assertEqual(restored.spans, original.spans)
+        self.assertEqual(restored.vocab, VOCAB)
+        np.testing.assert_allclose(restored.confidences, original.confidences, rtol=1e-6)
+        np.testing.assert_allclose(restored.log_posteriors, original.log_posteriors, atol=1e-2)
+
+    def test_vocabulary_is_checked(self):
+        data = recognition().to_bytes()
+        with self.assertRaises(ValueError):
+            phones.PhoneRecognition.from_bytes(data, VOCAB[:-1])
+
+
+@patch("openpronounce.phones.get_expected_phones", return_value=(["how"], [["h", "aʊ"]]))
+class TestRescore(unittest.TestCase):
+
+    @patch("openpronounce.speech.phones.recognize_phones", side_effect=lambda *a, **k: recognition())
+    @patch("openpronounce.speech.interpolate_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0]))
+    @patch("openpronounce.speech.transcribe", return_value="HOW")
+    @patch("openpronounce.speech.audio.load", return_value=np.zeros(16000, dtype=np.float32))
+    @patch("openpronounce.speech.audio.text2speech", return_value="ref.wav")
+    @patch("openpronounce.speech.extract_embeddings", return_value=np.zeros((10, 4)))
+    def analyze(self, path, *mocks):
+        return speech.compare_audio_with_text(np.zeros(16000, dtype=np.float32), "how", use_phone_model=True,
+                                              artifacts=path)
+
+    def test_rescore_matches_the_analysis(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "attempt.npz")
+            result = self.analyze(path)
+            rescored = rescore.rescore(path)
+        self.assertEqual(rescored.pop("previous_score"), result["score"])
+        result.pop("prosody")
+        self.assertEqual(rescored, result)
+
+    def test_rules_apply_to_saved_attempts(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "attempt.npz")
+            self.analyze(path)
+            self.assertEqual(rescore.rescore(path)["differences"]["words_with_errors"], ["how"])
+            with patch.object(phones, "ALTERNATE_PRONUNCIATIONS", {"en": {"how": [["h", "u"]]}}):
+                rescored = rescore.rescore(path)
+        self.assertEqual(rescored["differences"]["words_with_errors"], [])
+
+    def test_offset_of_a_trimmed_recording(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "attempt.npz")
+            rescore.save(path, "how", "en", 5.0, 50, "HOW", recognition(), 80.0, offset=12480)
+            self.assertEqual(rescore.load(path)["offset"], 12480)
+            # version 1, from before silence trimming: no offset
+            with np.load(path) as arrays:
+                contents = dict(arrays)
+            meta = json.loads(str(contents["meta"]))
+            del meta["offset"]
+            contents["meta"] = np.array(json.dumps({**meta, "version": 1}))
+            np.savez_compressed(path, **contents)
+            self.assertEqual(rescore.load(path)["offset"], 0)
+
+    def test_saving_failure_does_not_fail_the_analysis(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "attempt.npz")
+            with patch.object(rescore, "save", side_effect=OSError(28, "No space left on device")), \
+                    self.assertLogs("openpronounce.speech", "ERROR"):
+                result = self.analyze(path)
+            self.assertFalse(os.path.exists(path))
+        self.assertIn("score", result)
+
+    def test_cli(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.analyze(os.path.join(tmp, "day", "a.npz"))
+            with open(os.path.join(tmp, "day", "broken.npz"), "wb") as f:
+                f.write(b"not an archive")
+            out_path = os.path.join(tmp, "out.jsonl")
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                status = cli.main(["rescore", tmp, "--out", out_path])
+            with open(out_path) as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual(status, 1)
+        self.assertEqual([os.path.basename(row["path"]) for row in rows], ["a.npz", "broken.npz"])
+        self.assertEqual(rows[0]["score"], rows[0]["previous_score"])
+        self.assertIn("error", rows[1])
+
+
+@pytest.mark.usefixtures("without_quality_gate")
+class TestArtifactsHeader(unittest.TestCase):
+
+    def post(self, tmp, compare):
+        sound = io.BytesIO()
+        sf.write(sound, np.zeros(16000, dtype=np.float32), 16000, format="WAV")
+        sound.seek(0)
+        with patch.object(rescore, "ARTIFACTS_DIR", tmp), \
+                patch("server.speech.compare_audio_with_text", side_effect=compare):
+            return TestClient(server.app).post("/pronunciation", files={"file": ("rec.wav", sound, "audio/wav")},
+                                               data={"expected_text": "how"})
+
+    def test_header_names_the_saved_file_only(self):
+        def saving(*a, artifacts=None, **k):
+            os.makedirs(os.path.dirname(artifacts), exist_ok=True)
+            open(artifacts, "wb").close()
+            return {"score": 1.0}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            saved = self.post(tmp, saving)
+            self.assertTrue(os.path.exists(os.path.join(tmp, saved.headers["X-Artifacts"])))
+            failed = self.post(tmp, lambda *a, **k: {"score": 1.0})  # nothing written: the disk was full
+        self.assertEqual(failed.status_code, 200)
+        self.assertNotIn("X-Artifacts", failed.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import asyncio
+import io
+import threading
+import unittest
+from unittest.mock import patch
+
+import httpx
+import numpy as np
+import pytest
+import soundfile as sf
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import phones, resultcache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_entries_expire_and_fit_the_byte_budget(self):
+        clock = Clock()
+        cache = resultcache.ResultCache(max_bytes=20, ttl=60, size=len, clock=clock)
+        cache.put("a", "x" * 10)
+        cache.put("b", "y" * 10)
+        self.assertEqual(cache.get("a"), "x" * 10)
+        cache.put("c", "z" * 10)  # evicts b, the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.nbytes, 20)
+        clock.now = 61
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 1)
+
+    def test_concurrent_requests_share_one_computation(self):
+        cache = resultcache.ResultCache(max_bytes=1000, ttl=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"score": 80}
+
+        async def scenario():
+            first = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)))
+            return first + [await cache.get_or_compute("k", compute)]
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([status for _, status in results], ["miss", "shared", "shared", "hit"])
+        self.assertTrue(all(result == {"score": 80} for result, _ in results))
+
+    def test_failures_are_not_cached(self):
+        cache = resultcache.ResultCache(max_bytes=1000, ttl=60)
+
+        async def fail():
+            raise RuntimeError("model crashed")
+
+        async def succeed():
+            return {"score": 1}
+
+        async def scenario():
+            with self.assertRaises(RuntimeError):
+                await cache.get_or_compute("k", fail)
+            return await cache.get_or_compute("k", succeed)
+
+        self.assertEqual(asyncio.run(scenario()), ({"score": 1}, "miss"))
+
+    def test_idempotency_key_is_bound_to_its_payload(self):
+        cache = resultcache.ResultCache(max_bytes=1000, ttl=60)
+        cache.put("idempotency:a", {"score": 1}, digest="payload-1")
+        self.assertEqual(cache.get("idempotency:a", "payload-1"), {"score": 1})
+        with self.assertRaises(resultcache.IdempotencyConflictError):
+            cache.get("idempotency:a", "payload-2")
+
+    def test_key_follows_the_configuration(self):
+        sound = np.zeros(16000, dtype=np.float32)
+        key = resultcache.analysis_key(sound, 16000, "hello", "en")
+        self.assertEqual(key, resultcache.analysis_key(sound.copy(), 16000, "hello", "en"))
+        self.assertNotEqual(key, resultcache.analysis_key(sound, 16000, "hello!", "en"))
+        with patch.object(phones, "PHONE_ERROR_THRESHOLD", 0.5):
+            self.assertNotEqual(key, resultcache.analysis_key(sound, 16000, "hello", "en"))
+
+
+@pytest.mark.usefixtures("without_quality_gate")
+class TestServerRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(server.app)
+        cache = patch.object(server, "_result_cache", resultcache.ResultCache(1 << 20, 60))
+        cache.start()
+        self.addCleanup(cache.stop)
+
+    def wav(self, sound):
+        buf = io.BytesIO()
+        sf.write(buf, sound, 16000, format="WAV")
+        buf.seek(0)
+        return buf
+
+    def post(self, sound, text="hello", headers=None):
+        return self.client.post("/pronunciation", files={"file": ("rec.wav", self.wav(sound), "audio/wav")},
+                                data={"expected_text": text}, headers=headers or {})
+
+    @patch("server.speech.compare_audio_with_text", side_effect=lambda *a, **k: {"score": 70.0})
+    def test_retry_is_served_from_the_cache(self, compare):
+        sound = np.random.default_rng(0).uniform(-0.5, 0.5, 16000).astype(np.float32)
+        first, retry = self.post(sound), self.post(sound)
+        self.assertEqual((first.headers["X-Result-Cache"], retry.headers["X-Result-Cache"]), ("miss", "hit"))
+        self.assertEqual(retry.json(), {"score": 70.0})
+        self.assertEqual(self.post(sound, text="yellow").headers["X-Result-Cache"], "miss")
+        self.assertEqual(compare.call_count, 2)
+
+    @patch("server.speech.compare_audio_with_text", side_effect=lambda *a, **k: {"score": 70.0})
+    def test_idempotency_key(self, compare):
+        headers = {"Idempotency-Key": "attempt-1"}
+        sound = np.zeros(16000, dtype=np.float32)
+        self.post(sound, headers=headers)
+        retry = self.post(sound, headers=headers)
+        self.assertEqual(retry.headers["X-Result-Cache"], "hit")
+        # the same key for another upload or another text is not someone else's result
+        self.assertEqual(self.post(sound + 0.1, headers=headers).status_code, 422)
+        self.assertEqual(self.post(sound, text="yellow", headers=headers).status_code, 422)
+        self.assertEqual(compare.call_count, 1)
+
+    def test_retry_during_the_analysis_waits_for_it(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow(*a, **k):
+            started.set()
+            release.wait(5)
+            return {"score": 55.0}
+
+        async def scenario():
+            # One event loop for both requests, as in the server
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                def post():
+                    return client.post("/pronunciation", files={"file": ("rec.wav", self.wav(sound), "audio/wav")},
+                                       data={"expected_text": "hello"})
+
+                first = asyncio.ensure_future(post())
+                await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+                retry = asyncio.ensure_future(post())
+                await asyncio.sleep(0.2)
+                release.set()
+                return await first, await retry
+
+        sound = np.random.default_rng(1).uniform(-0.5, 0.5, 16000).astype(np.float32)
+        with patch("server.speech.compare_audio_with_text", side_effect=slow) as compare:
+            first, retry = asyncio.run(scenario())
+        self.assertEqual(compare.call_count, 1)
+        self.assertEqual((first.headers["X-Result-Cache"], retry.headers["X-Result-Cache"]), ("miss", "shared"))
+        self.assertEqual(retry.json(), {"score": 55.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
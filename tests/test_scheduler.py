@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import scheduler
+from openpronounce.scheduler import QueueFullError, Scheduler
+
+
+def _hold(sched, priority, order, started=None):
+    """Queue a request that records when it gets its slot, then waits to be let go (``release.set()``)."""
+    release = threading.Event()
+
+    def run():
+        with sched.slot(priority):
+            order.append(priority)
+            if started is not None:
+                started.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, release
+
+
+def _wait_queued(sched, priority, count):
+    deadline = time.monotonic() + 5
+    while sched.stats()["classes"][priority]["queued"] < count:
+        if time.monotonic() > deadline:
+            raise AssertionError(f"{count} {priority} requests never queued")
+        time.sleep(0.005)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_weighted_sharing_under_contention(self):
+        sched = Scheduler(slots=1, reserved=0, weights={"interactive": 3, "batch": 1})
+        order = []
+        started = threading.Event()
+        blocker, unblock = _hold(sched, "batch", order, started)
+        self.assertTrue(started.wait(5))
+        waiting = [_hold(sched, "batch", order) for _ in range(4)]
+        _wait_queued(sched, "batch", 4)
+        waiting += [_hold(sched, "interactive", order) for _ in range(12)]
+        _wait_queued(sched, "interactive", 12)
+        order.clear()
+        unblock.set()
+        for _, release in waiting:
+            release.set()
+        for thread, _ in [(blocker, unblock)] + waiting:
+            thread.join(5)
+        # About three interactive requests for each batch one while both queues wait
+        # (strict priority would serve the twelve interactive ones first).
+        self.assertEqual(order[:13].count("batch"), 3)
+        self.assertEqual(order[0], "interactive")
+        self.assertEqual(sorted(order), ["batch"] * 4 + ["interactive"] * 12)
+
+    def test_batch_never_takes_the_reserved_slot(self):
+        sched = Scheduler(slots=2, reserved=1)
+        order = []
+        first_started = threading.Event()
+        first, release_first = _hold(sched, "batch", order, first_started)
+        self.assertTrue(first_started.wait(5))
+        second, release_second = _hold(sched, "batch", order)
+        _wait_queued(sched, "batch", 1)  # a slot is free, but it is kept for interactive work
+
+        started = threading.Event()
+        interactive, release_interactive = _hold(sched, "interactive", order, started)
+        self.assertTrue(started.wait(5))
+        self.assertEqual(order, ["batch", "interactive"])
+        for release in (release_first, release_second, release_interactive):
+            release.set()
+        for thread in (first, second, interactive):
+            thread.join(5)
+        self.assertEqual(order, ["batch", "interactive", "batch"])
+
+    def test_full_queue_is_refused(self):
+        sched = Scheduler(slots=1, reserved=0, max_queue=1)
+        order = []
+        started = threading.Event()
+        running, release_running = _hold(sched, "batch", order, started)
+        self.assertTrue(started.wait(5))
+        queued, release_queued = _hold(sched, "batch", order)
+        _wait_queued(sched, "batch", 1)
+        with self.assertRaises(QueueFullError):
+            sched.acquire("batch")
+        release_running.set()
+        release_queued.set()
+        running.join(5)
+        queued.join(5)
+        self.assertEqual(sched.stats()["classes"]["batch"]["rejected"], 1)
+
+    def test_stats_and_validation(self):
+        sched = Scheduler(slots=3, reserved=5)
+        self.assertEqual(sched.reserved, 2)  # at least one slot is left to batch work
+        release = sched.acquire("interactive")
+        release()
+        release()  # releasing twice gives the slot back once
+        stats = sched.stats()
+        self.assertEqual(stats["slots"], 3)
+        self.assertEqual(stats["classes"]["interactive"]["served"], 1)
+        self.assertEqual(stats["classes"]["interactive"]["running"], 0)
+        self.assertIn("wait_p99_ms", stats["classes"]["batch"])
+        with self.assertRaises(ValueError):
+            sched.acquire("urgent")
+
+    def test_try_acquire_only_takes_a_free_slot(self):
+        sched = Scheduler(slots=2, reserved=1)
+        batch = sched.try_acquire("batch")
+        self.assertIsNotNone(batch)
+        self.assertIsNone(sched.try_acquire("batch"))  # the other slot is reserved
+        interactive = sched.try_acquire("interactive")
+        self.assertIsNotNone(interactive)
+        self.assertIsNone(sched.try_acquire("interactive"))  # all slots busy
+        queued = []
+        waiter = threading.Thread(target=lambda: queued.append(sched.acquire("interactive")))
+        waiter.start()
+        while not sched.stats()["classes"]["interactive"]["queued"]:
+            time.sleep(0.001)
+        batch()
+        waiter.join(5)
+        self.assertIsNone(sched.try_acquire("interactive"))  # the queued request got the freed slot
+        interactive()
+        queued[0]()
+        stats = sched.stats()["classes"]
+        self.assertEqual((stats["interactive"]["running"], stats["batch"]["running"]), (0, 0))
+        self.assertEqual((stats["interactive"]["served"], stats["batch"]["served"]), (2, 1))
+
+    def test_coroutines_wait_without_a_thread(self):
+        sched = Scheduler(slots=1, reserved=0)
+        order = []
+
+        async def request(n):
+            release = await sched.acquire_async("batch")
+            order.append(n)
+            await asyncio.sleep(0)
+            release()
+
+        async def scenario():
+            release = await sched.acquire_async("batch")
+            threads = threading.active_count()
+            tasks = [asyncio.ensure_future(request(n)) for n in range(8)]
+            await asyncio.sleep(0.01)
+            self.assertEqual(sched.stats()["classes"]["batch"]["queued"], 8)
+            self.assertEqual(threading.active_count(), threads)
+            release()
+            await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+        asyncio.run(scenario())
+        self.assertEqual(order, list(range(8)))
+        self.assertEqual(sched.stats()["classes"]["batch"]["running"], 0)
+
+    def test_cancelled_waiters_give_their_slot_back(self):
+        sched = Scheduler(slots=1, reserved=0)
+
+        async def scenario():
+            release = await sched.acquire_async("interactive")
+            queued = asyncio.ensure_future(sched.acquire_async("interactive"))
+            await asyncio.sleep(0)
+            queued.cancel()  # still waiting: leaves the queue
+            await asyncio.gather(queued, return_exceptions=True)
+            self.assertEqual(sched.stats()["classes"]["interactive"]["queued"], 0)
+
+            granted = asyncio.ensure_future(sched.acquire_async("interactive"))
+            await asyncio.sleep(0)
+            release()  # the slot goes to the waiter...
+            granted.cancel()  # ...which is cancelled before it resumes
+            await asyncio.gather(granted, return_exceptions=True)
+            self.assertTrue(granted.cancelled())
+            (await asyncio.wait_for(sched.acquire_async("interactive"), 1))()
+
+        asyncio.run(scenario())
+        self.assertEqual(sched.stats()["classes"]["interactive"]["running"], 0)
+
+
+class TestPriorityEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(server.app)
+
+    def test_queue_stats(self):
+        body = self.client.get("/queue").json()
+        self.assertEqual(set(body["classes"]), set(scheduler.CLASSES))
+
+    def test_unknown_priority_is_rejected(self):
+        response = self.client.post("/tts?priority=urgent", data={"text": "hello"})
+        self.assertEqual(response.status_code, 422)
+        response = self.client.post("/tts", data={"text": "hello"}, headers={"X-Priority": "urgent"})
+        self.assertEqual(response.status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,14 @@
+import threading
+import time
 import unittest
 from unittest.mock import patch
 
+import numpy as np
+
 from fastapi.testclient import TestClient
 
 import server
+from openpronounce import phones, scheduler
 
 
 class TestServer(unittest.TestCase):
@@ -47,3 +52,120 @@ class TestServer(unittest.TestCase):
         languages = self.client.get("/languages").json()
         self.assertEqual(languages["default"], "en")
         self.assertIn({"code": "en", "name": "English"}, languages["languages"])
+
+    def wav(self, seconds):
+        import io
+        import soundfile as sf
+        buf = io.BytesIO()
+        sf.write(buf, np.zeros(int(16000 * seconds), dtype="float32"), 16000, format="WAV")
+        buf.seek(0)
+        return buf
+
+    @patch("server.speech.transcribe", return_value="HELLO")
+    def test_recording_too_long(self, mock_transcribe):
+        with patch.object(server.audio, "MAX_SECONDS", 2):
+            ok = self.client.post("/speech2text", files={"file": ("rec.wav", self.wav(1.5), "audio/wav")})
+            too_long = self.client.post("/speech2text", files={"file": ("rec.wav", self.wav(3), "audio/wav")})
+        self.assertEqual(ok.status_code, 200)
+        self.assertEqual(too_long.status_code, 413)
+        self.assertIn("2 seconds", too_long.json()["detail"])
+        mock_transcribe.assert_called_once()
+
+    @patch("server.speech.compare_audio_with_text", return_value={"score": 1.0})
+    def test_analysis_trims_silence(self, mock_compare):
+        sound = np.zeros(16000, dtype=np.float32)
+        with patch.object(server, "TRIM_SILENCE", True):
+            server._analyze(sound, "hello", "en")
+        self.assertTrue(mock_compare.call_args.kwargs["trim_silence"])
+
+    @patch("server.speech.compare_audio_with_text")
+    def test_unusable_recording_is_rejected_before_inference(self, mock_compare):
+        with patch.object(server, "QUALITY_GATE", True):
+            response = self.client.post("/pronunciation", files={"file": ("rec.wav", self.wav(2), "audio/wav")},
+                                        data={"expected_text": "hello"})
+        self.assertEqual(response.status_code, 422)
+        quality = response.json()["detail"]["quality"]
+        self.assertFalse(quality["ok"])
+        self.assertEqual([problem["code"] for problem in quality["problems"]], ["silent"])
+        mock_compare.assert_not_called()
+
+    @patch("server.speech.transcribe", return_value="HELLO")
+    def test_upload_too_large(self, mock_transcribe):
+        limited = TestClient(server.UploadLimitMiddleware(server.app, max_bytes=50000))
+        response = limited.post("/speech2text", files={"file": ("rec.wav", self.wav(2), "audio/wav")})
+        self.assertEqual(response.status_code, 413)
+
+        def chunks():
+            for _ in range(10):
+                yield b"x" * 10000
+
+        response = limited.post("/speech2text", content=chunks(),
+                                headers={"Content-Type": "multipart/form-data; boundary=x"})
+        self.assertEqual(response.status_code, 413)
+
+        with patch.object(server, "MAX_UPLOAD_BYTES", 50000):
+            response = self.client.post("/speech2text", files={"file": ("rec.wav", self.wav(2), "audio/wav")})
+        self.assertEqual(response.status_code, 413)
+        mock_transcribe.assert_not_called()
+
+    @patch("server.phones.compare_phones")
+    @patch("server.phones.StreamingRecognizer")
+    def test_websocket_streams_partials_then_the_result(self, mock_recognizer, mock_compare):
+        recognizer = mock_recognizer.return_value
+        recognizer.feed.return_value = True
+        recognizer.update.side_effect = [
+            phones.PhoneRecognition(["h"], [0.9], [(0, 1)], None, ()),
+            phones.PhoneRecognition(["h"], [0.9], [(0, 1)], None, ()),
+            phones.PhoneRecognition(["h", "ə"], [0.9, 0.8], [(0, 1), (2, 3)], None, ()),
+        ]
+        mock_compare.return_value = {
+            "phone_error_rate": 0.25, "errors": [], "words_with_errors": [], "expected_phones": [["h", "ə", "l", "oʊ"]],
+            "heard_phones": ["h", "ə", "l"], "heard_phones_confidence": [0.9, 0.8, 0.7],
+        }
+        with self.client.websocket_connect("/ws/pronunciation") as ws:
+            ws.send_json({"expected_text": "hello", "lang": "en", "sample_rate": 16000})
+            for _ in range(3):
+                ws.send_bytes(np.zeros(8000, dtype="<f4").tobytes())
+            ws.send_json({"type": "end"})
+            messages = [ws.receive_json() for _ in range(3)]
+        self.assertEqual([m["type"] for m in messages], ["partial", "partial", "result"])
+        self.assertEqual(messages[1]["heard_phones"], ["h", "ə"])
+        self.assertEqual(messages[2]["score"], 75.0)
+        self.assertEqual(messages[2]["differences"]["heard_phones"], ["h", "ə", "l"])
+        self.assertEqual(recognizer.feed.call_args_list[0].args[0].shape, (8000,))
+        mock_compare.assert_called_once_with(recognizer.finish.return_value, "hello", "en")
+
+    @patch("server.phones.compare_phones")
+    @patch("server.phones.StreamingRecognizer")
+    def test_websocket_partials_wait_for_a_free_slot(self, mock_recognizer, mock_compare):
+        recognizer = mock_recognizer.return_value
+        recognizer.feed.return_value = True
+        mock_compare.return_value = {
+            "phone_error_rate": 0.0, "errors": [], "words_with_errors": [], "expected_phones": [["h"]],
+            "heard_phones": ["h"], "heard_phones_confidence": [0.9],
+        }
+        sched = scheduler.Scheduler(slots=1, reserved=0)
+        busy = sched.acquire("batch")
+
+        def release_once_the_result_waits():
+            while not sched.stats()["classes"]["interactive"]["queued"]:
+                time.sleep(0.001)
+            busy()
+
+        with patch.object(scheduler, "_default", sched), self.client.websocket_connect("/ws/pronunciation") as ws:
+            ws.send_json({"expected_text": "hello", "lang": "en", "sample_rate": 16000})
+            for _ in range(3):
+                ws.send_bytes(np.zeros(8000, dtype="<f4").tobytes())
+            ws.send_json({"type": "end"})
+            releaser = threading.Thread(target=release_once_the_result_waits)
+            releaser.start()
+            message = ws.receive_json()
+            releaser.join(5)
+        self.assertEqual(message["type"], "result")  # no partial while the only slot was busy
+        recognizer.update.assert_not_called()
+        self.assertEqual(sched.stats()["classes"]["interactive"]["running"], 0)
+
+    def test_websocket_rejects_an_empty_sentence(self):
+        with self.client.websocket_connect("/ws/pronunciation") as ws:
+            ws.send_json({"expected_text": " ", "sample_rate": 16000})
+            self.assertEqual(ws.receive_json()["type"], "error")
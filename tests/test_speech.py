@@ -244,6 +244,26 @@ class TestIntegration(unittest.TestCase):
         mock_text2speech.assert_called_with("hello", lang="en")
         mock_transcribe.assert_called_with(sample_audio, "en")
 
+    @patch("openpronounce.speech.phones.recognize_phones", return_value=["h", "ə", "l", "oʊ", "w", "ɜː", "d"])
+    @patch("openpronounce.speech.interpolate_f0", side_effect=lambda f0: f0 + 1)
+    @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0, 0.0]))
+    @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0, 2.0]))
+    @patch("openpronounce.speech.transcribe", return_value="HELLO WORD")
+    @patch("openpronounce.speech.audio.load", return_value=np.ones(8000, dtype=np.float32))
+    @patch("openpronounce.speech.audio.text2speech", return_value="ref.wav")
+    @patch("openpronounce.speech.extract_embeddings")
+    def test_concurrent_stages_give_the_sequential_result(self, mock_extract_emb, *_):
+        # Learner and reference embeddings differ by the length of their input, whatever the call order
+        mock_extract_emb.side_effect = lambda sound, sr: np.outer(np.arange(len(sound) // 1000), [1.0, 2.0])
+        sound = np.zeros(16000, dtype=np.float32)
+        with patch.object(speech.stages, "STAGE_WORKERS", 1):
+            sequential = speech.compare_audio_with_text(sound, "hello world")
+        with patch.object(speech.stages, "STAGE_WORKERS", 4):
+            concurrent = speech.compare_audio_with_text(sound, "hello world")
+        self.assertEqual(concurrent, sequential)
+        self.assertEqual(sequential["prosody"]["f0"], [101.0, 1.0])
+        self.assertGreater(sequential["distance"], 0)
+
     @patch("openpronounce.speech.interpolate_f0", return_value=np.array([100.0]))
     @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0]))
     @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0]))
@@ -257,5 +277,48 @@ class TestIntegration(unittest.TestCase):
         self.assertNotIn("heard_phones", result["differences"])
 
 
+    @patch("openpronounce.phones.get_expected_phones", return_value=(["hello", "world"], [["h", "ə", "l", "oʊ"],
+                                                                                         ["w", "ɜː", "l", "d"]]))
+    @patch("openpronounce.speech.phones.recognize_phones", return_value=["h", "ə", "l", "oʊ", "b", "ɑ", "t"])
+    @patch("openpronounce.speech.interpolate_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0]))
+    @patch("openpronounce.speech.transcribe")
+    @patch("openpronounce.speech.audio.load", return_value=np.zeros(16000, dtype=np.float32))
+    @patch("openpronounce.speech.audio.text2speech", return_value="ref.wav")
+    @patch("openpronounce.speech.extract_embeddings", return_value=np.zeros((10, 4)))
+    def test_phones_only_mode_skips_the_word_model(self, _emb, _tts, _load, mock_transcribe, *_):
+        result = speech.compare_audio_with_text(np.zeros(16000, dtype=np.float32), "hello world", use_asr=False)
+        mock_transcribe.assert_not_called()
+        self.assertEqual(result["transcribe"], "hello /bɑt/")
+        self.assertEqual(result["differences"]["word_error_rate"], 0.5)
+        self.assertEqual(result["differences"]["words_with_errors"], ["world"])
+        self.assertLessEqual({"word_distance", "phoneme_distance", "expected_phonemes", "transcribed_phonemes",
+                              "expected_vector", "transcribed_vector"}, set(result["differences"]))
+        self.assertIsNone(result["differences"]["word_distance"])
+        self.assertEqual(result["differences"]["expected_vector"], [])
+        self.assertEqual(result["score"], speech.compute_pronunciation_score(
+            result["acoustic_distance"], result["differences"]["phoneme_error_rate"], 0.5))
+        with self.assertRaises(ValueError):
+            speech.compare_audio_with_text(np.zeros(16000, dtype=np.float32), "hello", use_phone_model=False,
+                                           use_asr=False)
+
+    @patch("openpronounce.speech.phones.recognize_phones", return_value=["h", "ə", "l", "oʊ"])
+    @patch("openpronounce.speech.interpolate_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0]))
+    @patch("openpronounce.speech.transcribe", return_value="HELLO")
+    @patch("openpronounce.speech.audio.load", return_value=np.zeros(16000, dtype=np.float32))
+    @patch("openpronounce.speech.audio.text2speech", return_value="ref.wav")
+    @patch("openpronounce.speech.extract_embeddings", return_value=np.zeros((10, 4)))
+    def test_silence_is_trimmed_before_the_models(self, _emb, _tts, _load, mock_transcribe, *_):
+        voiced = 0.3 * np.random.default_rng(0).standard_normal(16000)
+        sound = np.concatenate([np.zeros(16000), voiced, np.zeros(16000)]).astype(np.float32)
+        result = speech.compare_audio_with_text(sound, "hello", trim_silence=True)
+        self.assertEqual(result["trimmed"], {"start": 0.78, "end": 2.215})
+        self.assertEqual(len(mock_transcribe.call_args.args[0]), int(1.435 * 16000))
+        self.assertNotIn("trimmed", speech.compare_audio_with_text(sound, "hello"))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,63 @@
+import threading
+import unittest
+
+import torch
+
+from openpronounce import stages
+from openpronounce.stages import Stage
+
+
+class TestRunStages(unittest.TestCase):
+
+    def test_dependencies_get_the_results_of_earlier_stages(self):
+        graph = {
+            "a": Stage(lambda: 2),
+            "b": Stage(lambda: 3),
+            "product": Stage(lambda a, b: a * b, after=("a", "b")),
+            "square": Stage(lambda p: p * p, after=("product",)),
+        }
+        for parallel in (True, False):
+            self.assertEqual(stages.run_stages(graph, parallel=parallel), {"a": 2, "b": 3, "product": 6, "square": 36})
+
+    def test_independent_stages_overlap(self):
+        barrier = threading.Barrier(2, timeout=5)
+        graph = {"a": Stage(barrier.wait), "b": Stage(barrier.wait)}
+        results = stages.run_stages(graph, parallel=True)  # would raise BrokenBarrierError if run in turn
+        self.assertEqual(sorted(results.values()), [0, 1])
+
+    def test_thread_budget_is_set_for_the_stage_only(self):
+        seen = {}
+
+        def probe(name):
+            seen[name] = (torch.get_num_threads(), threading.current_thread().name)
+
+        graph = {"budget": Stage(lambda: probe("budget"), threads=1), "free": Stage(lambda: probe("free"))}
+        stages.run_stages(graph, parallel=True)
+        self.assertEqual(seen["budget"][0], 1)
+        self.assertTrue(seen["budget"][1].startswith("openpronounce-stage"))
+        stages.run_stages({"after": Stage(lambda: probe("after"))}, parallel=True)
+        self.assertEqual(seen["after"][0], seen["free"][0])
+
+    def test_first_error_is_raised_and_dependents_are_skipped(self):
+        started = []
+
+        def broken():
+            raise RuntimeError("tts unavailable")
+
+        graph = {
+            "reference": Stage(broken),
+            "embeddings": Stage(lambda: started.append("embeddings")),
+            "alignment": Stage(lambda *_: started.append("alignment"), after=("reference", "embeddings")),
+        }
+        for parallel in (True, False):
+            with self.assertRaisesRegex(RuntimeError, "tts unavailable"):
+                stages.run_stages(graph, parallel=parallel)
+        self.assertNotIn("alignment", started)
+
+    def test_dependencies_must_be_declared_first(self):
+        with self.assertRaises(ValueError):
+            stages.run_stages({"b": Stage(lambda a: a, after=("a",)), "a": Stage(lambda: 1)})
+
+
+if __name__ == "__main__":
+    unittest.main()
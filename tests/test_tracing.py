@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import numpy as np
+
+from openpronounce import speech, tracing
+
+
+class TestTracing(unittest.TestCase):
+
+    def test_spans_are_collected_with_their_attributes(self):
+        with tracing.collect() as outer:
+            with tracing.span("decode", frames=10) as span:
+                span.set(cache_hit=True)
+            with tracing.collect() as inner:
+                with self.assertRaises(ValueError), tracing.span("asr"):
+                    raise ValueError("recorded anyway")
+        self.assertEqual([s.name for s in outer], ["decode", "asr"])
+        self.assertEqual([s.name for s in inner], ["asr"])
+        self.assertEqual(outer[0].attributes, {"frames": 10, "cache_hit": True})
+        self.assertGreaterEqual(outer[0].duration, 0)
+        with tracing.span("outside"):
+            pass
+        self.assertEqual(len(outer), 2)
+
+    def test_hooks_and_thread_pools(self):
+        seen = []
+        tracing.add_hook(seen.append)
+        self.addCleanup(tracing.remove_hook, seen.append)
+
+        def stage():
+            with tracing.span("pooled"):
+                return threading.current_thread().name
+
+        with tracing.collect() as spans, ThreadPoolExecutor(1, thread_name_prefix="pool") as pool:
+            thread = tracing.submit(pool, stage).result()
+        self.assertEqual([(s.name, s.thread) for s in spans], [("pooled", thread)])
+        self.assertIn(spans[0], seen)
+
+    def test_chrome_trace(self):
+        spans = [tracing.Span("asr", 1.0, 1.5, "main", {"frames": 50}),
+                 tracing.Span("prosody", 1.1, 1.2, "worker", {})]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.json")
+            tracing.write_chrome_trace(spans, path)
+            with open(path) as f:
+                trace = json.load(f)
+        complete = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        self.assertEqual([(e["name"], e["ts"], e["dur"], e["tid"]) for e in complete],
+                         [("asr", 1e6, 5e5, 1), ("prosody", 1.1e6, 1e5, 2)])
+        self.assertEqual(complete[0]["args"], {"frames": 50})
+        names = {e["tid"]: e["args"]["name"] for e in trace["traceEvents"] if e["ph"] == "M"}
+        self.assertEqual(names, {1: "main", 2: "worker"})
+
+    @patch("openpronounce.speech.interpolate_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_f0", return_value=np.array([100.0]))
+    @patch("openpronounce.speech.extract_energy", return_value=np.array([1.0]))
+    @patch("openpronounce.speech.transcribe", return_value="HELLO")
+    @patch("openpronounce.speech.audio.load", return_value=np.zeros(8000, dtype=np.float32))
+    @patch("openpronounce.speech.audio.text2speech", return_value="ref.wav")
+    @patch("openpronounce.speech.extract_embeddings", return_value=np.zeros((10, 4)))
+    def test_compare_returns_timings_on_request(self, *_):
+        sound = np.zeros(16000, dtype=np.float32)
+        self.assertNotIn("timings", speech.compare_audio_with_text(sound, "hello", use_phone_model=False))
+        timings = speech.compare_audio_with_text(sound, "hello", use_phone_model=False, timings=True)["timings"]
+        stages = {stage["name"]: stage for stage in timings["stages"]}
+        # The second analysis of the same sound reuses its model outputs, which shows the (mocked) asr
+        self.assertEqual(set(stages), {"embeddings", "reference_embeddings", "asr", "prosody", "dtw"})
+        self.assertTrue(stages["embeddings"]["cache_hit"])
+        self.assertTrue(stages["asr"]["cache_hit"])
+        self.assertEqual(stages["embeddings"]["frames"], 50)
+        self.assertEqual(stages["reference_embeddings"]["frames"], 25)
+        self.assertEqual(stages["dtw"]["reference_frames"], 10)
+        self.assertGreaterEqual(timings["total_ms"], max(s["start_ms"] + s["duration_ms"] for s in stages.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
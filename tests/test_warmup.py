@@ -0,0 +1,94 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import server
+from openpronounce import phones, speech, warmup
+from openpronounce.languages import get_language
+
+
+class TestModelsFor(unittest.TestCase):
+
+    def test_checkpoints_are_shared_between_languages(self):
+        with patch.object(phones, "is_enabled", return_value=True):
+            models = warmup.models_for(["en", "fr"])
+        self.assertEqual(list(models)[:2], [speech.MODEL_NAME, get_language("fr").asr_model])
+        self.assertIn(phones.PHONE_MODEL_NAME, models)
+        self.assertEqual(len(models[speech.MODEL_NAME][1]), 2)  # English transcription and embeddings
+        self.assertEqual(warmup.models_for([]), {})
+
+    def test_phones_only_mode_loads_no_transcription_model(self):
+        with patch.object(phones, "is_enabled", return_value=True), patch.object(speech, "WORD_ASR", "0"):
+            models = warmup.models_for(["en", "fr"])
+        self.assertEqual(list(models), [speech.MODEL_NAME, phones.PHONE_MODEL_NAME])
+        self.assertEqual(models[speech.MODEL_NAME][1], [speech.extract_embeddings])
+
+    def test_unknown_language(self):
+        with self.assertRaises(ValueError):
+            warmup.preload(["xx"])
+
+
+class TestPreload(unittest.TestCase):
+
+    def setUp(self):
+        warmup.reset()
+        self.addCleanup(warmup.reset)
+
+    def test_models_are_loaded_in_parallel_then_warmed_up(self):
+        barrier = threading.Barrier(2, timeout=5)
+        warmed = []
+        models = {
+            "asr": (barrier.wait, [lambda sound: warmed.append(("asr", len(sound)))]),
+            "phones": (barrier.wait, [lambda sound: warmed.append(("phones", len(sound)))]),
+        }
+        with patch.object(warmup, "models_for", return_value=models):
+            warmup.preload(["en"], wait=True)
+        state = warmup.status()
+        self.assertTrue(state["ready"])
+        self.assertEqual({m["state"] for m in state["models"].values()}, {"ready"})
+        self.assertEqual(sorted(warmed), [("asr", 32000), ("phones", 32000)])
+
+    def test_failure_is_reported(self):
+        def broken():
+            raise OSError("no such checkpoint")
+
+        with patch.object(warmup, "models_for", return_value={"asr": (broken, [])}):
+            warmup.preload(["en"], wait=True)
+        state = warmup.status()
+        self.assertFalse(state["ready"])
+        self.assertEqual(state["models"]["asr"]["state"], "failed")
+        self.assertIn("no such checkpoint", state["models"]["asr"]["error"])
+
+
+class TestReadyEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        warmup.reset()
+        self.addCleanup(warmup.reset)
+
+    def test_ready_only_once_every_model_is_warm(self):
+        loading, release = threading.Event(), threading.Event()
+        models = {"asr": (lambda: loading.set() or release.wait(5), [])}
+        with patch.object(warmup, "models_for", return_value=models), patch.object(warmup, "PRELOAD", ["en"]):
+            with TestClient(server.app) as client:
+                self.assertTrue(loading.wait(5))  # the preload thread may not have started yet
+                response = client.get("/ready")
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.json()["models"]["asr"]["state"], "loading")
+                self.assertEqual(client.get("/health").status_code, 200)
+                release.set()
+                for thread in threading.enumerate():
+                    if thread.name.startswith("openpronounce-preload-"):
+                        thread.join(5)
+                response = client.get("/ready")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "ready")
+
+    def test_ready_without_preloading(self):
+        self.assertEqual(TestClient(server.app).get("/ready").status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()